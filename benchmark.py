@@ -0,0 +1,267 @@
+"""
+==================================================================
+ iPod Manager - Benchmark
+==================================================================
+ File        : benchmark.py
+ Description : Times the scan, copy, sync, delete and unmount paths
+               against a synthetic {artist}/{album}/{track} library
+               and a fake iPod, either a plain directory or a size
+               limited loopback FAT32 image. Results are written as
+               JSON so runs can be compared across commits.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import contextlib
+import subprocess
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT))
+
+RESULTS_VERSION = 1
+FILL_BLOCK_SIZE = 1024 * 1024
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text: str) -> int:
+    """Parses sizes like 512K, 6M or 2G."""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1] if text and text[-1] in SIZE_UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+def size_sampler(spec: str, rng: random.Random) -> Callable[[], int]:
+    """
+    Returns a function drawing file sizes from a distribution spec:
+    fixed:SIZE, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA.
+    """
+    kind, *args = spec.split(":")
+    if kind == "fixed" and len(args) == 1:
+        size = parse_size(args[0])
+        return lambda: size
+    if kind == "uniform" and len(args) == 2:
+        low, high = parse_size(args[0]), parse_size(args[1])
+        return lambda: rng.randint(low, high)
+    if kind == "lognormal" and len(args) == 2:
+        median, sigma = parse_size(args[0]), float(args[1])
+        return lambda: max(1, int(median * rng.lognormvariate(0, sigma)))
+    raise ValueError(f"Invalid size distribution: {spec}")
+
+def generate_library(library: Path, artists: int, albums: int, tracks: int, sizes: str, seed: int) -> Tuple[int, int]:
+    """
+    Creates a reproducible library with cover art and cue sheets next to the
+    tracks, so extension filtering is exercised too. An existing library
+    generated with the same parameters is reused.
+    Returns the number of tracks and their total size.
+    """
+    params = {"artists": artists, "albums": albums, "tracks": tracks, "sizes": sizes, "seed": seed}
+    stamp = library / ".benchmark.json"
+    if stamp.exists():
+        stats = json.loads(stamp.read_text())
+        if stats.get("params") == params:
+            return stats["files"], stats["bytes"]
+
+    if library.exists():
+        shutil.rmtree(library)
+    rng = random.Random(seed)
+    sample = size_sampler(sizes, rng)
+    block = memoryview(rng.randbytes(FILL_BLOCK_SIZE))
+    count = total = 0
+
+    for a in range(artists):
+        for b in range(albums):
+            album_dir = library / f"Artist {a:03d}" / f"Album {b:02d}"
+            album_dir.mkdir(parents=True)
+            (album_dir / "cover.jpg").write_bytes(block[:64 * 1024])
+            (album_dir / "album.cue").write_text("REM benchmark\n")
+            for t in range(tracks):
+                size = sample()
+                extension = (".flac", ".mp3", ".m4a")[t % 3]
+                with open(album_dir / f"{t + 1:02d} Track {t + 1:02d}{extension}", "wb") as f:
+                    # Start at a random offset so files do not share identical content.
+                    offset = rng.randrange(FILL_BLOCK_SIZE)
+                    remaining = size
+                    while remaining:
+                        chunk = block[offset:offset + remaining]
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                        offset = 0
+                count += 1
+                total += size
+
+    stamp.write_text(json.dumps({"params": params, "files": count, "bytes": total}))
+    return count, total
+
+def load_main_program():
+    """Imports ipod-manager.py, whose name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location("ipod_manager", ROOT / "ipod-manager.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@contextlib.contextmanager
+def fat_image(image: Path, size: int, mountpoint: Path):
+    """Creates, formats and loop-mounts a FAT32 image like udisks mounts an iPod. Needs root."""
+    with open(image, "wb") as f:
+        f.truncate(size)
+    subprocess.run(["mkfs.vfat", "-F", "32", "-n", "IPODBENCH", str(image)], check=True, capture_output=True)
+    mountpoint.mkdir(parents=True, exist_ok=True)
+    mount_image(image, mountpoint)
+    try:
+        yield mountpoint
+    finally:
+        if os.path.ismount(mountpoint):
+            subprocess.run(["umount", str(mountpoint)], check=False)
+        image.unlink(missing_ok=True)
+
+def mount_image(image: Path, mountpoint: Path):
+    subprocess.run(["mount", "-o", "loop,shortname=mixed,utf8=1,flush", str(image), str(mountpoint)], check=True)
+
+def run_phase(name: str, func: Callable[[], object], files: int = 0, size: int = 0) -> dict:
+    """Times one phase. Messages and progress bars go to stderr, results to stdout."""
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+
+    result = {"phase": name, "seconds": round(elapsed, 4), "files": files, "bytes": size}
+    if files:
+        result["ms_per_file"] = round(elapsed * 1000 / files, 4)
+    if size and elapsed:
+        result["mb_per_s"] = round(size / 1024 ** 2 / elapsed, 2)
+    print(f"{name:>16}: {elapsed:8.3f}s" + (f"  {result['mb_per_s']:8.2f} MB/s" if "mb_per_s" in result else ""),
+          file=sys.stderr)
+    return result
+
+def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir).resolve()
+    library = workdir / "library"
+    os.environ["XDG_CACHE_HOME"] = str(workdir / "cache")
+
+    from modules.scan_cache import ScanCache, MUSIC_EXTENSIONS
+    from modules.file_operations import perform_file_operation, delete_files
+
+    phases: List[dict] = []
+    files, size = generate_library(library, args.artists, args.albums, args.tracks, args.sizes, args.seed)
+
+    scan_cache = workdir / "scan.sqlite"
+    scan_cache.unlink(missing_ok=True)
+
+    def scan():
+        with ScanCache(library, cache_path=scan_cache) as cache:
+            return cache.scan(extensions=MUSIC_EXTENSIONS)
+
+    phases.append(run_phase("scan_cold", scan, files))
+    phases.append(run_phase("scan_warm", scan, files))
+    tracks = sorted(scan())
+
+    with contextlib.ExitStack() as stack:
+        if args.fat_image:
+            device = stack.enter_context(fat_image(workdir / "ipod.img", parse_size(args.fat_image), workdir / "ipod"))
+        else:
+            device = workdir / "ipod"
+            shutil.rmtree(device, ignore_errors=True)
+            device.mkdir(parents=True)
+        (device / "iPod_Control").mkdir(exist_ok=True)
+        music_dir = device / "Music"
+
+        items = [(library / rel_path, rel_path) for rel_path in tracks]
+        phases.append(run_phase(
+            "copy", lambda: perform_file_operation(items, str(music_dir), "copy", engine=args.engine), files, size
+        ))
+
+        if args.fat_image:
+            # umount writes back everything still dirty, like unplugging an iPod would need.
+            phases.append(run_phase("unmount", lambda: subprocess.run(["umount", str(device)], check=True), files, size))
+            mount_image(workdir / "ipod.img", device)
+        else:
+            phases.append(run_phase("flush", lambda: os.sync()))
+
+        main_program = load_main_program()
+        sync = lambda: main_program.sync_music(device, sync_all=True, source_dir=library)
+        phases.append(run_phase("sync_bootstrap", sync, files))
+        phases.append(run_phase("sync_noop", sync, files))
+
+        paths = [music_dir / rel_path for rel_path in tracks]
+        phases.append(run_phase("delete", lambda: delete_files(paths, prune_root=music_dir), files))
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target": f"fat32:{args.fat_image}" if args.fat_image else "directory",
+        "params": {
+            "artists": args.artists, "albums": args.albums, "tracks": args.tracks,
+            "sizes": args.sizes, "seed": args.seed, "engine": args.engine,
+        },
+        "library": {"files": files, "bytes": size},
+        "phases": phases,
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "-C", str(ROOT), "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline: dict, results: dict):
+    """Prints the change of every phase against an earlier run."""
+    before = {phase["phase"]: phase for phase in baseline["phases"]}
+    print(f"Compared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):", file=sys.stderr)
+    if baseline.get("params") != results.get("params") or baseline.get("target") != results.get("target"):
+        print("\033[93mThe runs used different parameters.\033[0m", file=sys.stderr)
+    for phase in results["phases"]:
+        old = before.get(phase["phase"])
+        if not old or not old["seconds"]:
+            continue
+        change = (phase["seconds"] - old["seconds"]) / old["seconds"] * 100
+        color = "\033[91m" if change > 10 else "\033[92m" if change < -10 else ""
+        print(f"{phase['phase']:>16}: {old['seconds']:8.3f}s -> {phase['seconds']:8.3f}s  "
+              f"{color}{change:+6.1f}%\033[0m", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the iPod Manager against a synthetic library.")
+    parser.add_argument("--workdir", default="/tmp/ipod-manager-benchmark", help="where the library and fake iPod live")
+    parser.add_argument("--artists", type=int, default=10)
+    parser.add_argument("--albums", type=int, default=4, help="albums per artist")
+    parser.add_argument("--tracks", type=int, default=12, help="tracks per album")
+    parser.add_argument("--sizes", default="lognormal:512K:0.5",
+                        help="track sizes: fixed:SIZE, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=("native", "rsync"), default="native")
+    parser.add_argument("--fat-image", metavar="SIZE",
+                        help="use a loop-mounted FAT32 image of this size as the iPod (needs root and mkfs.vfat)")
+    parser.add_argument("--output", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", metavar="JSON", help="compare with the results of an earlier run")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,9 @@
  Description : The main entry point for the iPod Manager tool.
                Provides a menu-driven interface to manage music
                on iPods running Rockbox and scrobble play history
-               to Last.fm.
+               to Last.fm, a headless command line mode for cron
+               jobs and udev hooks, and a watcher that syncs iPods
+               as soon as they are connected.
  Author      : blackbunt
  Created     : 2025-01-26
  License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
@@ -15,26 +17,46 @@
 """
 
 import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import subprocess
+import contextlib
 from pathlib import Path
-from InquirerPy import inquirer
-from modules.file_operations import perform_file_operation, remove_empty_directories
-from modules.selection import select_artists, list_artists
+from typing import Optional
+from modules.selection import select_artists, list_artists, enter_query
 from modules.utils import get_music_folder, safely_unmount_ipod
-from modules.scrobbler_module import scrobble_log
+from modules.scan_cache import ScanCache, MUSIC_EXTENSIONS
+from modules.transcode import Transcoder, get_encoder, load_device_settings
+from modules.tagcache import database_exists
+from modules.catalog import query_tracks, QueryError
+from modules.planner import plan_space, plan_autofill
+from modules.profiles import load_profile
+from modules.devices import find_ipods
+from modules.checksums import update_checksums, forget_checksums, DEFAULT_AUDIT_WORKERS
+from modules.journal import TransferJournal, load_journal, clear_journal
+from modules.layout import layout_key
+from modules.albumart import ArtScaler, art_settings, find_art, load_art_state, save_art_state, remove_album_art
+from modules import trace
+from modules.manifest import (
+    load_manifest, save_manifest, bootstrap_manifest, read_device_id,
+    classify_entry, find_orphans, update_manifest, remove_from_manifest,
+)
+# InquirerPy, tqdm, the copy engine and the Last.fm client are imported where
+# they are used, so headless runs only load what they need.
 
 
-def find_ipods() -> list:
-    """Find connected iPods."""
-    ipods = []
-    media_path = Path(f"/run/media/{os.getlogin()}")
-    if media_path.exists():
-        for mount in media_path.iterdir():
-            if (mount / "iPod_Control").is_dir():
-                ipods.append(mount)
-    return ipods
+class CommandError(Exception):
+    """A headless command cannot run as requested."""
+
 
 def select_ipod(ipods: list) -> Path:
     """Allows the user to select an iPod from the list of detected devices."""
+    from InquirerPy import inquirer
+
     choices = [str(ipod) for ipod in ipods]
     if not choices:
         print("No iPod found. Ensure that your iPod is connected.")
@@ -45,62 +67,733 @@ def select_ipod(ipods: list) -> Path:
     ).execute()
     return Path(selected)
 
-def copy_music(selected_ipod: Path, copy_all=False):
-    """Copies music to the selected iPod."""
-    source_dir = get_music_folder()
-    artists = list_artists(source_dir)
+def select_ipods(ipods: list) -> list:
+    """Allows the user to select several iPods from the list of detected devices."""
+    from InquirerPy import inquirer
+
+    if not ipods:
+        print("No iPod found. Ensure that your iPod is connected.")
+        return []
+    selected = inquirer.checkbox(
+        message="Choose the iPods to sync:",
+        choices=[str(ipod) for ipod in ipods],
+    ).execute()
+    return [Path(ipod) for ipod in selected]
+
+def resolve_ipod(spec=None) -> Path:
+    """
+    Finds the iPod for a headless run. spec is a mount point or the device id
+    stored on the iPod (stable across mount points); without it exactly one
+    iPod has to be connected.
+    """
+    if isinstance(spec, list):
+        if len(spec) > 1:
+            raise CommandError("This command works on one iPod at a time.")
+        spec = spec[0] if spec else None
+    if spec and (Path(spec).expanduser() / "iPod_Control").is_dir():
+        return Path(spec).expanduser()
+
+    ipods = find_ipods()
+    if spec:
+        for ipod in ipods:
+            if read_device_id(ipod) == spec:
+                return ipod
+        raise CommandError(f"iPod not found: {spec}")
+    if not ipods:
+        raise CommandError("No iPod found. Ensure that your iPod is connected.")
+    if len(ipods) > 1:
+        raise CommandError("Several iPods found, choose one with --ipod: " + ", ".join(map(str, ipods)))
+    return ipods[0]
+
+def find_tracks(source_dir: Path, query: str, extensions=MUSIC_EXTENSIONS) -> list:
+    """Brings the library's tag catalog up to date and returns the library paths matching a query."""
+    with ScanCache(source_dir) as cache:
+        with trace.phase("catalog") as phase:
+            read, _ = cache.update_catalog(extensions)
+            phase.add(files=read)
+        try:
+            tracks = query_tracks(cache.conn, query)
+        except QueryError as e:
+            raise CommandError(str(e))
+    print(f"{len(tracks)} tracks in the library match the query.")
+    return tracks
+
+def plan_library(selected_ipod: Path, cache: ScanCache, selected_artists: list, extensions=MUSIC_EXTENSIONS,
+                 manifest=None, verify_hash=False, transcoder=None, only=None):
+    """
+    Scans the selected artists and maps them to their device paths (through
+    the transcoder, if any). With a manifest only new or changed files are
+    planned for transfer. only limits the scan to these library paths
+    (e.g. the tracks matching a query).
+    The whole selection is planned before anything is copied, so its size
+    can be checked against the free space first.
+    Returns the library keyed by device path, the new/changed/unchanged
+    counts and the planned (source path, device path, entry) transfers.
+    """
+    source_dir = cache.source_dir
+    music_dir = selected_ipod / "Music"
+    hash_dir = source_dir if verify_hash else None
+    library = {}
+    counts = {"new": 0, "changed": 0, "unchanged": 0}
+    album_exists = {}
+    transfers = []
+
+    with trace.phase("scan") as phase:
+        for rel_path, entry in cache.iter_files(selected_artists, extensions):
+            if only is not None and rel_path not in only:
+                continue
+            device_rel = rel_path
+            if transcoder is not None and transcoder.applies(rel_path):
+                device_rel = transcoder.device_path(rel_path)
+                entry = dict(entry, source=rel_path, transcode=transcoder.settings_key)
+            library[device_rel] = entry
+
+            if manifest is not None:
+                status = classify_entry(device_rel, entry, manifest, music_dir, hash_dir, album_exists)
+                counts[status] += 1
+                if status == "unchanged":
+                    continue
+            transfers.append((source_dir / rel_path, device_rel, entry))
+        phase.add(files=len(library))
+
+    return library, counts, transfers
+
+def transfer_sizes(transfers: list, transcoder=None) -> list:
+    """Returns (device path, expected size) of the planned transfers, estimating encoded sizes."""
+    return [
+        (device_rel, transcoder.estimate_size(entry["size"]) if "transcode" in entry else entry["size"])
+        for _, device_rel, entry in transfers
+    ]
+
+def replaced_sizes(selected_ipod: Path, transfers: list, manifest=None) -> dict:
+    """
+    Returns {device path: size on the iPod} of the planned transfers that
+    replace a file. The manifest records the library size of transcoded
+    tracks, so those are measured on the iPod.
+    """
+    replaced = {}
+    for _, device_rel, _ in transfers:
+        entry = (manifest or {}).get(device_rel)
+        if entry is None:
+            continue
+        if "transcode" not in entry:
+            replaced[device_rel] = entry["size"]
+            continue
+        try:
+            replaced[device_rel] = (selected_ipod / "Music" / device_rel).stat().st_size
+        except OSError:
+            pass  # gone from the iPod: nothing is freed
+    return replaced
+
+def check_space(selected_ipod: Path, transfers: list, manifest=None, transcoder=None):
+    """Checks before any I/O whether the planned transfers fit on the iPod. Returns the space plan."""
+    with trace.phase("plan") as phase:
+        sizes = transfer_sizes(transfers, transcoder)
+        replaced = replaced_sizes(selected_ipod, transfers, manifest)
+        plan = plan_space(sizes, selected_ipod, selected_ipod / "Music", replaced)
+        phase.add(files=len(sizes), bytes=plan.required)
+    if not plan.fits:
+        print(f"\033[91mThe selection does not fit on the iPod: {plan.required / 1024**3:.2f} GB needed, "
+              f"{plan.free / 1024**3:.2f} GB free.\033[0m")
+    return plan
+
+def forget_journaled(selected_ipod: Path, manifest: dict):
+    """
+    Drops the files of an interrupted first sync from a bootstrapped
+    manifest, so they are resumed from the journal with their checksums.
+    """
+    for rel_path in load_journal(selected_ipod):
+        manifest.pop(rel_path, None)
+
+def transfer_files(selected_ipod: Path, transfers: list, transcoder=None, hashes=None, journal=None,
+                   layout=False) -> list:
+    """
+    Streams the planned transfers through the transcoder (if any) into the
+    copy engine. If hashes is a dict, the copies' checksums are stored there.
+    Files an interrupted run already copied are skipped and every copied
+    file is journaled (see journal); the iPod is flushed once at the end.
+    layout=True writes album by album into preallocated files (see layout).
+    Returns the device paths in place, including the resumed ones.
+    """
+    if not transfers:
+        return []
+    from modules.file_operations import perform_file_operation
+
+    music_dir = selected_ipod / "Music"
+    journal = journal or TransferJournal(selected_ipod)
+    transfers, resumed, resumed_hashes = journal.resume(transfers)
+    if hashes is not None:
+        hashes.update(resumed_hashes)
+    planned = {device_rel: entry for _, device_rel, entry in transfers}
+
+    def on_done(item, st, checksum):
+        journal.record(item[1], planned[item[1]], st.st_size, checksum)
+
+    copied = []
+    try:
+        with trace.phase("copy") as phase:
+            if transcoder is not None:
+                files = transcoder.stream(transfers)
+            else:
+                files = ((source, device_rel) for source, device_rel, _ in transfers)
+            copied = [device_rel for _, device_rel in
+                      perform_file_operation(files, music_dir, "copy", hashes=hashes, on_done=on_done,
+                                             layout=layout)]
+            if trace.ENABLED:
+                phase.add(files=len(copied), bytes=sum((music_dir / device_rel).stat().st_size for device_rel in copied))
+    finally:
+        # Also when interrupted, so the next run resumes right where this one stopped.
+        with trace.phase("flush"):
+            try:
+                journal.commit()
+            except OSError as e:
+                print(f"\033[91mCould not write the transfer journal: {e}\033[0m")
+    return resumed + copied
+
+def update_tagcache(selected_ipod: Path, manifest: dict, source_dir=None) -> dict:
+    """
+    Builds the Rockbox database of the music in the manifest on this computer.
+    Tags of tracks copied as they are come from the library's scan cache;
+    transcoded tracks and tracks missing from the library are read from the iPod.
+    """
+    from modules.tagcache import build_tagcache
+
+    def library_tags(rel_paths):
+        originals = [rel_path for rel_path in rel_paths if "transcode" not in manifest[rel_path]]
+        if source_dir is None or not originals:
+            return {}
+        with ScanCache(source_dir) as cache:
+            return cache.read_tags(originals)
+
+    with trace.phase("tagcache") as phase:
+        result = build_tagcache(selected_ipod, manifest, library_tags)
+        phase.add(files=result["tagged"])
+    if result["written"]:
+        print(f"Rockbox database updated: {result['tracks']} tracks, {result['tagged']} newly tagged.")
+    return result
+
+def wants_tagcache(selected_ipod: Path, tagcache=None) -> bool:
+    """Decides whether to build the Rockbox database, by default from the iPod's device.json."""
+    if tagcache is None:
+        return bool(load_device_settings(selected_ipod).get("tagcache", False))
+    return tagcache
+
+def wants_layout(selected_ipod: Path, layout=None) -> bool:
+    """Decides whether to copy in the FAT layout mode, by default from the iPod's device.json."""
+    if layout is None:
+        return bool(load_device_settings(selected_ipod).get("layout", False))
+    return layout
+
+def update_album_art(selected_ipod: Path, tracks: dict, source_dir: Path, settings: dict, copied=()) -> dict:
+    """
+    Puts a cover scaled for the iPod into the album folders of the given
+    tracks ({device path: library entry}, e.g. the manifest); see albumart.
+    A cover is only written if it changed or its album got new tracks.
+    Returns {"albums", "written"}.
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("\033[93mAlbum art needs Pillow (pip install Pillow); skipping it.\033[0m")
+        return {"albums": 0, "written": 0}
+    from modules.file_operations import copy_file
+
+    albums = {}  # album folder on the iPod -> (library folder, track names)
+    for rel_path, entry in tracks.items():
+        album = os.path.dirname(rel_path)
+        if album:
+            source_album, track = os.path.split(entry.get("source", rel_path))
+            albums.setdefault(album, (source_album, []))[1].append(track)
 
-    if copy_all:
-        selected_artists = artists
+    music_dir = selected_ipod / "Music"
+    state = load_art_state(selected_ipod)
+    refreshed = {os.path.dirname(rel_path) for rel_path in copied}
+    written = 0
+    with trace.phase("albumart") as phase, ScanCache(source_dir) as cache, ArtScaler(settings) as scaler:
+        picks = {}
+        for album, (source_album, names) in albums.items():
+            files = cache.dir_files(source_album)
+            art = find_art(files, [name for name in names if name in files])
+            if art is not None:
+                picks[album] = (source_dir / source_album / art[0], art[1], files[art[0]])
+        keys = scaler.prepare(set(picks.values()))
+
+        cover_name = "cover" + scaler.extension
+        for album, pick in sorted(picks.items()):
+            key = keys.get(pick[0])
+            if key is None:
+                continue
+            value = f"{cover_name}:{key}"
+            previous = state.get(album)
+            if previous == value and album not in refreshed:
+                continue
+            try:
+                copy_file(scaler.cached_file(key), music_dir / album / cover_name)
+                if previous and previous.split(":", 1)[0] != cover_name:
+                    (music_dir / album / previous.split(":", 1)[0]).unlink(missing_ok=True)
+            except OSError as e:
+                print(f"\033[91mError copying the album art of {album}: {e}\033[0m")
+                continue
+            state[album] = value
+            written += 1
+        phase.add(files=written)
+
+    if written:
+        save_art_state(selected_ipod, state)
+        print(f"Album art updated for {written} of {len(picks)} albums.")
+    return {"albums": len(picks), "written": written}
+
+def wants_album_art(selected_ipod: Path, albumart=None) -> Optional[dict]:
+    """Returns the album art settings to use, by default from the iPod's device.json; None if disabled."""
+    settings = load_device_settings(selected_ipod).get("albumart")
+    if albumart is None:
+        return art_settings(settings)
+    return art_settings(settings or True) if albumart else None
+
+def query_artists(tracks) -> list:
+    """Returns the artist folders holding the given library paths."""
+    return sorted({rel_path.split("/", 1)[0] for rel_path in tracks if "/" in rel_path})
+
+def get_transcoder(selected_ipod: Path):
+    """
+    Creates the transcoder configured for the iPod, if any. Raises
+    CommandError if its device.json names an unknown codec.
+    """
+    transcode_settings = load_device_settings(selected_ipod).get("transcode")
+    if not transcode_settings:
+        return None
+    try:
+        get_encoder(transcode_settings)
+    except ValueError as e:
+        raise CommandError(f"{e} in the device settings of {selected_ipod}") from e
+    return Transcoder(transcode_settings)
+
+def copy_music(selected_ipod: Path, copy_all=False, extensions=MUSIC_EXTENSIONS, query=None, layout=None):
+    """Copies music to the selected iPod; with query only the tracks matching it."""
+    source_dir = Path(get_music_folder())
+    only = set(find_tracks(source_dir, query, extensions)) if query is not None else None
+    transcoder = get_transcoder(selected_ipod)
+
+    try:
+        with ScanCache(source_dir) as cache:
+            artists = cache.artists()
+
+            if only is not None:
+                selected_artists = query_artists(only)
+            elif copy_all:
+                selected_artists = artists
+            else:
+                selected_artists = select_artists(artists)
+
+            library, _, transfers = plan_library(
+                selected_ipod, cache, selected_artists, extensions, transcoder=transcoder, only=only
+            )
+
+        manifest = load_manifest(selected_ipod)
+        if not check_space(selected_ipod, transfers, manifest, transcoder).fits:
+            return
+        hashes = {}
+        copied = transfer_files(selected_ipod, transfers, transcoder, hashes,
+                                layout=wants_layout(selected_ipod, layout))
+    finally:
+        if transcoder is not None:
+            transcoder.close()
+
+    # Keep an existing manifest in step; a missing one is bootstrapped on the next sync.
+    if manifest is not None:
+        update_manifest(manifest, library, copied)
+        save_manifest(selected_ipod, manifest)
+    update_checksums(selected_ipod, copied, hashes)
+    clear_journal(selected_ipod)
+
+    art = wants_album_art(selected_ipod)
+    if art is not None:
+        update_album_art(selected_ipod, library, source_dir, art, copied)
+
+def sync_music(selected_ipod: Path, sync_all=False, verify_hash=False, rescan=False,
+               extensions=MUSIC_EXTENSIONS, autofill=False, selected_artists=None, source_dir=None,
+               tagcache=None, query=None, albumart=None, layout=None) -> dict:
+    """
+    Copies only new or changed music to the selected iPod using the on-device manifest.
+    rescan=True bypasses the scan cache to pick up files rewritten in place.
+    autofill=True copies only the most played albums (from the iPod's
+    .scrobbler.log) that fit into the free space. selected_artists skips the
+    artist prompt. query only syncs the tracks matching it (no orphans are
+    reported then). tagcache=True builds the Rockbox database and
+    albumart=True puts scaled covers into the album folders afterwards and
+    layout=True copies album by album into preallocated files (None: as
+    set in the iPod's device.json).
+    Returns a summary of the sync.
+    """
+    source_dir = Path(source_dir or get_music_folder())
+    music_dir = selected_ipod / "Music"
+    only = set(find_tracks(source_dir, query, extensions)) if query is not None else None
+
+    manifest = load_manifest(selected_ipod)
+    bootstrapped = manifest is None
+    if bootstrapped:
+        print("No manifest found on the iPod. Building one from the files on the device...")
+        manifest = bootstrap_manifest(music_dir, extensions)
+        forget_journaled(selected_ipod, manifest)
+
+    transcoder = get_transcoder(selected_ipod)
+    try:
+        with ScanCache(source_dir, refresh=rescan) as cache:
+            artists = cache.artists()
+
+            if only is not None:
+                selected_artists = query_artists(only)
+            elif sync_all or autofill:
+                selected_artists = artists
+            elif selected_artists is not None:
+                for artist in sorted(set(selected_artists) - set(artists)):
+                    print(f"\033[93mArtist not found in the library: {artist}\033[0m")
+            else:
+                selected_artists = select_artists(artists)
+
+            library, counts, transfers = plan_library(
+                selected_ipod, cache, selected_artists, extensions, manifest, verify_hash, transcoder, only
+            )
+
+        if autofill:
+            # Auto-fill only adds albums; tracks already on the iPod stay as they are.
+            with trace.phase("plan") as phase:
+                sizes = [size for size in transfer_sizes(transfers, transcoder) if size[0] not in manifest]
+                chosen, plan = plan_autofill(sizes, selected_ipod / ".scrobbler.log", selected_ipod)
+                phase.add(files=len(chosen), bytes=plan.required)
+            chosen = set(chosen)
+            transfers = [transfer for transfer in transfers if transfer[1] in chosen]
+            print(f"Auto-fill picked {len(transfers)} files ({plan.required / 1024**3:.2f} GB "
+                  f"of {plan.free / 1024**3:.2f} GB free).")
+        else:
+            plan = check_space(selected_ipod, transfers, manifest, transcoder)
+            if not plan.fits:
+                return dict(counts, status="no_space", required_bytes=plan.required, free_bytes=plan.free)
+
+        hashes = {}
+        copied = transfer_files(selected_ipod, transfers, transcoder, hashes,
+                                layout=wants_layout(selected_ipod, layout))
+    finally:
+        if transcoder is not None:
+            transcoder.close()
+
+    # An unchanged device is left untouched, which keeps a no-op sync cheap.
+    if copied or bootstrapped or verify_hash:
+        with trace.phase("manifest") as phase:
+            update_manifest(manifest, library, copied, source_dir=source_dir if verify_hash else None, hashes=hashes)
+            save_manifest(selected_ipod, manifest)
+            update_checksums(selected_ipod, copied, hashes, keep=manifest)
+            clear_journal(selected_ipod)
+            phase.add(files=len(manifest))
+
+    if wants_tagcache(selected_ipod, tagcache) and (copied or bootstrapped or not database_exists(selected_ipod)):
+        update_tagcache(selected_ipod, manifest, source_dir)
+    art = wants_album_art(selected_ipod, albumart)
+    if art is not None and (copied or bootstrapped or rescan or not load_art_state(selected_ipod)):
+        update_album_art(selected_ipod, manifest, source_dir, art, copied)
+
+    if only is not None:
+        # The library only holds the matching tracks, so every other track would look orphaned.
+        orphans = []
     else:
-        selected_artists = select_artists(artists)
+        orphans = find_orphans(manifest, library, None if sync_all or autofill else selected_artists)
+    print(f"{counts['new']} new, {counts['changed']} changed, "
+          f"{counts['unchanged']} unchanged, {len(orphans)} orphaned files.")
+    if not counts["new"] and not counts["changed"]:
+        print("\033[92mThe iPod is already up to date.\033[0m")
+
+    if orphans:
+        print("\033[93mThe following files are on the iPod but no longer in your library:\033[0m")
+        for rel_path in orphans:
+            print(f"  {rel_path}")
+
+    return dict(counts, status="ok", copied=len(copied), failed=len(transfers) - len(copied),
+                orphans=len(orphans), required_bytes=plan.required, free_bytes=plan.free)
+
+def sync_many(ipods: list, selected_artists=None, verify_hash=False, rescan=False,
+              extensions=MUSIC_EXTENSIONS, source_dir=None, tagcache=None, query=None, albumart=None,
+              layout=None) -> dict:
+    """
+    Syncs several iPods with one pass over the library. Every file needed by
+    at least one iPod is read once and written to all iPods needing it in
+    parallel (see fan_out_copy). Transcoded files are taken from the host-side
+    transcode cache and copied per iPod afterwards.
+    selected_artists=None syncs all music, query only the tracks matching it.
+    If any iPod copies in the layout mode, the library is read album by
+    album; only the iPods in the layout mode preallocate their files.
+    Returns {mount point: summary}.
+    """
+    from modules.fanout import fan_out_copy
+
+    source_dir = Path(source_dir or get_music_folder())
+    only = set(find_tracks(source_dir, query, extensions)) if query is not None else None
+    if only is not None:
+        selected_artists = query_artists(only)
+    names = [ipod.name for ipod in ipods]
+    if len(set(names)) < len(names):
+        names = [str(ipod) for ipod in ipods]
+
+    summaries = {}
+    devices = {}
+    sources = {}  # source path -> {device name: device path}
+    try:
+        with ScanCache(source_dir, refresh=rescan) as cache:
+            artists = cache.artists() if selected_artists is None else selected_artists
+            for name, ipod in zip(names, ipods):
+                manifest = load_manifest(ipod)
+                bootstrapped = manifest is None
+                if bootstrapped:
+                    print(f"No manifest found on {name}. Building one from the files on the device...")
+                    manifest = bootstrap_manifest(ipod / "Music", extensions)
+                    forget_journaled(ipod, manifest)
 
-    all_files = []
-    for artist in selected_artists:
-        artist_path = Path(source_dir) / artist
-        for root, _, files in os.walk(artist_path):
-            for file in files:
-                all_files.append(Path(root) / file)
+                transcoder = get_transcoder(ipod)
+                library, counts, transfers = plan_library(
+                    ipod, cache, artists, extensions, manifest, verify_hash, transcoder, only
+                )
+                plan = check_space(ipod, transfers, manifest, transcoder)
+                if not plan.fits:
+                    if transcoder is not None:
+                        transcoder.close()
+                    print(f"\033[91mSkipping {name}.\033[0m")
+                    summaries[str(ipod)] = dict(counts, status="no_space", required_bytes=plan.required,
+                                                free_bytes=plan.free)
+                    continue
 
-    perform_file_operation(all_files, selected_ipod / "Music", "copy")
+                journal = TransferJournal(ipod)
+                direct, resumed, resumed_hashes = journal.resume(
+                    [transfer for transfer in transfers if "transcode" not in transfer[2]]
+                )
+                devices[name] = {
+                    "ipod": ipod, "manifest": manifest, "bootstrapped": bootstrapped, "transcoder": transcoder,
+                    "library": library, "counts": counts, "plan": plan, "planned": len(transfers),
+                    "transcoded": [transfer for transfer in transfers if "transcode" in transfer[2]],
+                    "journal": journal, "resumed": resumed, "resumed_hashes": resumed_hashes,
+                    "layout": wants_layout(ipod, layout),
+                }
+                for source, device_rel, entry in direct:
+                    sources.setdefault(source, {})[name] = device_rel
+
+        def on_done(name, source, st, checksum):
+            device_rel = sources[source][name]
+            devices[name]["journal"].record(device_rel, devices[name]["library"][device_rel], st.st_size, checksum)
+
+        reserve = [name for name, device in devices.items() if device["layout"]]
+        # The read order is shared: with any iPod in the layout mode the library is read album by album.
+        order = sorted(sources, key=layout_key) if reserve else list(sources)
+        source_hashes = {}
+        try:
+            with trace.phase("copy") as phase:
+                results = fan_out_copy(
+                    ((source, source, sources[source]) for source in order),
+                    {name: device["ipod"] / "Music" for name, device in devices.items()},
+                    hashes=source_hashes, on_done=on_done, reserve=reserve,
+                ) if sources else {}
+                if trace.ENABLED:
+                    phase.add(files=sum(len(done) for done, _ in results.values()),
+                              bytes=sum(source.stat().st_size for done, _ in results.values() for source in done))
+        finally:
+            with trace.phase("flush"):
+                for name, device in devices.items():
+                    try:
+                        device["journal"].commit()
+                    except OSError as e:
+                        print(f"\033[91mCould not write the transfer journal of {name}: {e}\033[0m")
+
+        for name, device in devices.items():
+            done, failed = results.get(name, ([], []))
+            for source, error in failed:
+                print(f"\033[91mError copying {source.name} to {name}: {error}\033[0m")
+            device["copied"] = device["resumed"] + [sources[source][name] for source in done]
+            device["hashes"] = dict(device["resumed_hashes"])
+            device["hashes"].update((sources[source][name], source_hashes[source]) for source in done)
+            device["copied"] += transfer_files(device["ipod"], device["transcoded"], device["transcoder"],
+                                               device["hashes"], device["journal"], device["layout"])
+    finally:
+        for device in devices.values():
+            if device["transcoder"] is not None:
+                device["transcoder"].close()
+
+    for name, device in devices.items():
+        ipod, manifest, copied, counts = device["ipod"], device["manifest"], device["copied"], device["counts"]
+        if copied or device["bootstrapped"] or verify_hash:
+            with trace.phase("manifest") as phase:
+                update_manifest(manifest, device["library"], copied,
+                                source_dir=source_dir if verify_hash else None, hashes=device["hashes"])
+                save_manifest(ipod, manifest)
+                update_checksums(ipod, copied, device["hashes"], keep=manifest)
+                clear_journal(ipod)
+                phase.add(files=len(manifest))
+        if wants_tagcache(ipod, tagcache) and (copied or device["bootstrapped"] or not database_exists(ipod)):
+            update_tagcache(ipod, manifest, source_dir)
+        art = wants_album_art(ipod, albumart)
+        if art is not None and (copied or device["bootstrapped"] or rescan or not load_art_state(ipod)):
+            update_album_art(ipod, manifest, source_dir, art, copied)
+
+        orphans = [] if only is not None else find_orphans(manifest, device["library"], selected_artists)
+        failed = device["planned"] - len(copied)
+        print(f"{name}: {counts['new']} new, {counts['changed']} changed, {counts['unchanged']} unchanged, "
+              f"{len(orphans)} orphaned, {failed} failed.")
+        summaries[str(ipod)] = dict(counts, status="ok" if not failed else "error", copied=len(copied),
+                                    failed=failed, orphans=len(orphans),
+                                    required_bytes=device["plan"].required, free_bytes=device["plan"].free)
+    return summaries
+
+def delete_music(selected_ipod: Path, delete_all=False, selected_artists=None, confirm=None,
+                 query=None, source_dir=None) -> dict:
+    """
+    Deletes music from the selected iPod. selected_artists skips the artist
+    prompt and confirm=True the confirmation. query deletes the tracks of
+    the library (source_dir) matching a selection query instead of whole
+    artists. Returns a summary of the deletion.
+    """
+    from tqdm import tqdm
+    from modules.file_operations import delete_files, delete_tree
 
-def delete_music(selected_ipod: Path, delete_all=False):
-    """Deletes music from the selected iPod."""
     target_dir = selected_ipod / "Music"
-    artists = list_artists(target_dir)
+    manifest = load_manifest(selected_ipod)
+    tracks = None
 
-    if delete_all:
-        selected_artists = artists
-    else:
-        selected_artists = select_artists(artists)
+    if query is not None:
+        matches = set(find_tracks(Path(source_dir or get_music_folder()), query))
+        if manifest is not None:
+            # Transcoded tracks are stored under another name; the manifest knows their source.
+            tracks = [rel_path for rel_path, entry in manifest.items() if entry.get("source", rel_path) in matches]
+        else:
+            tracks = sorted(rel_path for rel_path in matches if (target_dir / rel_path).is_file())
+        selected_artists = []
+        print(f"{len(tracks)} tracks on the iPod match the query.")
+    elif delete_all:
+        selected_artists = list_artists(target_dir) if target_dir.is_dir() else []
+    elif selected_artists is None:
+        selected_artists = select_artists(list_artists(target_dir) if target_dir.is_dir() else [])
 
-    confirm = inquirer.confirm(
-        message="Are you sure you want to delete the selected artists from your iPod?",
-        default=False,
-    ).execute()
+    if confirm is None:
+        from InquirerPy import inquirer
+        confirm = inquirer.confirm(
+            message="Are you sure you want to delete the selected "
+                    f"{'tracks' if query is not None else 'artists'} from your iPod?",
+            default=False,
+        ).execute()
 
     if not confirm:
         print("\033[93mDeletion aborted.\033[0m")
-        return
+        return {"status": "aborted", "deleted": 0, "failed": 0}
+
+    scope = set(selected_artists)
+    deleted_count = failed_count = 0
+    deleted_tracks = []
+
+    with trace.phase("delete") as phase, tqdm(desc="Deleting songs", unit="songs") as progress:
+        if tracks is None and manifest is not None:
+            # The manifest already lists every file, so the iPod does not need to be walked.
+            tracks = [rel_path for rel_path in manifest if rel_path.split("/", 1)[0] in scope]
+        if tracks:
+            progress.total = len(tracks)
+            progress.refresh()
+            deleted, failed = delete_files([target_dir / rel_path for rel_path in tracks], progress, prune_root=target_dir)
+            for path, error in failed:
+                print(f"\033[91mError deleting {path}: {error}\033[0m")
+            deleted_tracks = [file.relative_to(target_dir).as_posix() for file in deleted]
+            for rel_path in deleted_tracks:
+                if manifest is not None:
+                    manifest.pop(rel_path, None)
+            deleted_count += len(deleted)
+            failed_count += len(failed)
+
+        for artist in selected_artists:
+            artist_path = target_dir / artist
+            if artist_path.exists():
+                # No manifest, or files on the iPod the manifest does not know about.
+                count, failed = delete_tree(artist_path, progress)
+                for path, error in failed:
+                    print(f"\033[91mError deleting {path}: {error}\033[0m")
+                deleted_count += count
+                failed_count += len(failed)
+        phase.add(files=deleted_count)
+
+    removed = [artist for artist in selected_artists if not (target_dir / artist).exists()]
+    # Covers keep their album folders; remove them with the album's last track.
+    remove_album_art(selected_ipod, {os.path.dirname(rel_path) for rel_path in deleted_tracks}
+                     | {album for album in load_art_state(selected_ipod) if album.split("/", 1)[0] in removed})
+    if manifest is not None:
+        remove_from_manifest(manifest, removed)
+        save_manifest(selected_ipod, manifest)
+        if database_exists(selected_ipod):
+            update_tagcache(selected_ipod, manifest)
+    forget_checksums(selected_ipod, removed, deleted_tracks)
+    return {"status": "ok" if not failed_count else "error", "deleted": deleted_count, "failed": failed_count}
 
-    all_files = []
-    for artist in selected_artists:
-        artist_path = target_dir / artist
-        for root, _, files in os.walk(artist_path):
-            for file in files:
-                all_files.append(Path(root) / file)
+def audit_music(selected_ipod: Path, sample=None, workers=DEFAULT_AUDIT_WORKERS, seed=None) -> dict:
+    """
+    Re-reads the music on the iPod and checks it against the checksums
+    recorded while copying. sample (a share between 0 and 1) only reads
+    that share of randomly picked blocks of every file. Returns a summary.
+    """
+    from tqdm import tqdm
+    from modules.checksums import audit
 
-    perform_file_operation(all_files, "", "delete")
+    with trace.phase("audit") as phase, \
+            tqdm(total=0, desc="Verifying songs", unit="B", unit_scale=True, unit_divisor=1024) as progress:
+        results = audit(selected_ipod, sample=sample, workers=workers, seed=seed, progress=progress)
+        phase.add(files=len(results), bytes=sum(result["bytes"] for result in results.values()))
 
-    # Remove empty directories after deletion
-    for artist in selected_artists:
-        artist_path = target_dir / artist
-        remove_empty_directories(artist_path)
-        if artist_path.exists():
-            artist_path.rmdir()
+    corrupt = sorted(rel_path for rel_path, result in results.items() if result["status"] == "corrupt")
+    missing = sorted(rel_path for rel_path, result in results.items() if result["status"] == "missing")
+    manifest = load_manifest(selected_ipod) or {}
+    unverified = sum(1 for rel_path in manifest if rel_path not in results)
+
+    for rel_path in corrupt:
+        bad_blocks = results[rel_path]["bad_blocks"]
+        detail = f" (blocks {', '.join(map(str, bad_blocks[:10]))})" if bad_blocks else ""
+        print(f"\033[91mCorrupted: {rel_path}{detail}\033[0m")
+    for rel_path in missing:
+        print(f"\033[91mMissing: {rel_path}\033[0m")
+    if unverified:
+        print(f"\033[93m{unverified} files have no checksum yet; they get one when they are copied again.\033[0m")
+    if not corrupt and not missing:
+        print(f"\033[92mAll {len(results)} checked files are intact.\033[0m")
+
+    return {"status": "ok" if not corrupt and not missing else "error", "checked": len(results),
+            "corrupt": corrupt, "missing": missing, "unverified": unverified,
+            "bytes_read": sum(result["bytes"] for result in results.values())}
+
+def report_fragmentation(selected_ipod: Path) -> dict:
+    """
+    Reports how fragmented the music in the iPod's manifest is and whether
+    rewriting it in the layout mode would pay off. Returns a summary.
+    """
+    from tqdm import tqdm
+    from modules.layout import fragmentation_report
+
+    manifest = load_manifest(selected_ipod)
+    if manifest is None:
+        print("\033[93mSync the iPod once first; the report is built from its manifest.\033[0m")
+        return {"status": "error", "files": 0}
+    with trace.phase("fragmentation") as phase, \
+            tqdm(total=len(manifest), desc="Mapping songs", unit="songs") as progress:
+        report = fragmentation_report(selected_ipod, manifest, progress)
+        phase.add(files=len(manifest))
+    if report is None:
+        print("\033[91mThe iPod's file system does not report where files are stored.\033[0m")
+        return {"status": "error", "files": 0}
+
+    print(f"{report['fragmented']} of {report['files']} files are split ({report['fragmented_share']:.1%}, "
+          f"{report['extents']} pieces in all); {report['scattered']} of {report['albums']} albums "
+          f"are scattered ({report['scattered_share']:.1%}).")
+    for rel_path, extents in report["worst"]:
+        print(f"  {extents:>4} pieces  {rel_path}")
+    if report["rewrite"]:
+        print("\033[93mA full rewrite would pay off: delete all music and sync it again with --layout.\033[0m")
+    else:
+        print("\033[92mThe music is laid out well; a rewrite would not gain much.\033[0m")
+    return dict(report, status="ok")
 
 def main():
     """Main menu using InquirerPy."""
+    from InquirerPy import inquirer
+    from modules.scrobbler_module import scrobble_log
+
     ipods = find_ipods()
     selected_ipod = select_ipod(ipods)
 
@@ -110,31 +803,345 @@ def main():
             choices=[
                 "Copy selected music -> iPod",
                 "Copy all music -> iPod",
+                "Copy music matching a query -> iPod",
+                "Sync selected music -> iPod",
+                "Sync all music -> iPod",
+                "Sync all music with a full rescan -> iPod",
+                "Sync all music -> several iPods",
+                "Auto-fill iPod with most played music",
                 "Delete selected music -> iPod",
                 "Delete all music on iPod",
+                "Delete music matching a query -> iPod",
+                "Verify music on iPod",
+                "Check iPod fragmentation",
+                "Build Rockbox database",
                 "Scrobble from iPod -> last.fm",
                 "Safely unmount iPod",
                 "Exit"
             ],
         ).execute()
 
-        if action == "Copy selected music -> iPod":
-            copy_music(selected_ipod)
-        elif action == "Copy all music -> iPod":
-            copy_music(selected_ipod, copy_all=True)
-        elif action == "Delete selected music -> iPod":
-            delete_music(selected_ipod)
-        elif action == "Delete all music on iPod":
-            delete_music(selected_ipod, delete_all=True)
-        elif action == "Scrobble from iPod -> last.fm":
-            scrobble_log(selected_ipod)
-        elif action == "Safely unmount iPod":
-            safely_unmount_ipod(selected_ipod)
-        elif action == "Exit":
-            print("\033[92mExiting. See you soon!\033[0m")
-            break
-        else:
-            print("\033[91mInvalid selection, try again.\033[0m")
+        try:
+            if action == "Copy selected music -> iPod":
+                copy_music(selected_ipod)
+            elif action == "Copy all music -> iPod":
+                copy_music(selected_ipod, copy_all=True)
+            elif action == "Copy music matching a query -> iPod":
+                copy_music(selected_ipod, query=enter_query())
+            elif action == "Sync selected music -> iPod":
+                sync_music(selected_ipod)
+            elif action == "Sync all music -> iPod":
+                sync_music(selected_ipod, sync_all=True)
+            elif action == "Sync all music with a full rescan -> iPod":
+                sync_music(selected_ipod, sync_all=True, rescan=True)
+            elif action == "Sync all music -> several iPods":
+                targets = select_ipods(find_ipods())
+                if targets:
+                    sync_many(targets)
+            elif action == "Auto-fill iPod with most played music":
+                sync_music(selected_ipod, autofill=True)
+            elif action == "Delete selected music -> iPod":
+                delete_music(selected_ipod)
+            elif action == "Delete all music on iPod":
+                delete_music(selected_ipod, delete_all=True)
+            elif action == "Delete music matching a query -> iPod":
+                delete_music(selected_ipod, query=enter_query())
+            elif action == "Verify music on iPod":
+                audit_music(selected_ipod)
+            elif action == "Check iPod fragmentation":
+                report_fragmentation(selected_ipod)
+            elif action == "Build Rockbox database":
+                manifest = load_manifest(selected_ipod)
+                if manifest is None:
+                    print("\033[93mSync the iPod once first; the database is built from its manifest.\033[0m")
+                else:
+                    update_tagcache(selected_ipod, manifest, Path(get_music_folder()))
+            elif action == "Scrobble from iPod -> last.fm":
+                scrobble_log(selected_ipod)
+            elif action == "Safely unmount iPod":
+                if safely_unmount_ipod(selected_ipod):
+                    exit(0)
+            elif action == "Exit":
+                print("\033[92mExiting. See you soon!\033[0m")
+                break
+            else:
+                print("\033[91mInvalid selection, try again.\033[0m")
+        except CommandError as e:
+            print(f"\033[91m{e}\033[0m")
+
+def normalize_extensions(extensions) -> tuple:
+    """Accepts file types with or without the leading dot."""
+    return tuple("." + ext.lstrip(".").lower() for ext in extensions)
+
+def command_sync(options: dict) -> dict:
+    specs = options.get("ipod")
+    artists = options.get("artists")
+    if options.get("all_ipods") or (isinstance(specs, list) and len(specs) > 1):
+        targets = find_ipods() if options.get("all_ipods") else [resolve_ipod(spec) for spec in specs]
+        if not targets:
+            raise CommandError("No iPod found. Ensure that your iPod is connected.")
+        summaries = sync_many(
+            targets,
+            selected_artists=artists or None,
+            verify_hash=options.get("verify_hash", False),
+            rescan=options.get("rescan", False),
+            extensions=normalize_extensions(options.get("extensions", MUSIC_EXTENSIONS)),
+            source_dir=Path(options["source"]).expanduser() if options.get("source") else None,
+            tagcache=options.get("tagcache"),
+            query=options.get("query"),
+            albumart=options.get("albumart"),
+            layout=options.get("layout"),
+        )
+        status = "ok" if all(summary["status"] == "ok" for summary in summaries.values()) else "error"
+        return {"status": status, "ipods": summaries}
+
+    selected_ipod = resolve_ipod(specs)
+    summary = sync_music(
+        selected_ipod,
+        sync_all=not artists,
+        verify_hash=options.get("verify_hash", False),
+        rescan=options.get("rescan", False),
+        extensions=normalize_extensions(options.get("extensions", MUSIC_EXTENSIONS)),
+        autofill=options.get("autofill", False),
+        selected_artists=artists or None,
+        source_dir=Path(options["source"]).expanduser() if options.get("source") else None,
+        tagcache=options.get("tagcache"),
+        query=options.get("query"),
+        albumart=options.get("albumart"),
+        layout=options.get("layout"),
+    )
+    return dict(summary, ipod=str(selected_ipod))
+
+def command_delete(options: dict) -> dict:
+    selected_ipod = resolve_ipod(options.get("ipod"))
+    if not options.get("all") and not options.get("artists") and not options.get("query"):
+        raise CommandError("Name the artists to delete, pass --query or --all.")
+    if not options.get("yes"):
+        raise CommandError("Deleting needs --yes when running without prompts.")
+    summary = delete_music(selected_ipod, delete_all=options.get("all", False),
+                           selected_artists=options.get("artists"), confirm=True, query=options.get("query"),
+                           source_dir=Path(options["source"]).expanduser() if options.get("source") else None)
+    return dict(summary, ipod=str(selected_ipod))
+
+def command_search(options: dict) -> dict:
+    from modules.catalog import search
+
+    source_dir = Path(options["source"]).expanduser() if options.get("source") else Path(get_music_folder())
+    text = " ".join(options.get("terms") or [])
+    if not text:
+        raise CommandError("Give the text to search for.")
+    with ScanCache(source_dir) as cache:
+        cache.update_catalog(normalize_extensions(options.get("extensions", MUSIC_EXTENSIONS)))
+        suggestions = search(cache.conn, text)
+        try:
+            tracks = query_tracks(cache.conn, text)
+        except QueryError as e:
+            raise CommandError(str(e))
+    for field, value in suggestions:
+        print(f"{field:<8} {value}")
+    print(f"{len(tracks)} tracks match.")
+    return {"status": "ok", "suggestions": [{"field": field, "value": value} for field, value in suggestions],
+            "tracks": len(tracks)}
+
+def command_audit(options: dict) -> dict:
+    selected_ipod = resolve_ipod(options.get("ipod"))
+    sample = options.get("sample")
+    if sample is not None and not 0 < sample <= 100:
+        raise CommandError("--sample takes a percentage between 0 and 100.")
+    summary = audit_music(selected_ipod, sample=sample / 100 if sample is not None else None,
+                          workers=options.get("workers", DEFAULT_AUDIT_WORKERS), seed=options.get("seed"))
+    return dict(summary, ipod=str(selected_ipod))
+
+def command_fragmentation(options: dict) -> dict:
+    selected_ipod = resolve_ipod(options.get("ipod"))
+    return dict(report_fragmentation(selected_ipod), ipod=str(selected_ipod))
+
+def command_scrobble(options: dict) -> dict:
+    from modules.scrobbler_module import load_lastfm_config, scrobble_log_native
+
+    selected_ipod = resolve_ipod(options.get("ipod"))
+    config = load_lastfm_config()
+    if config is None:
+        raise CommandError("Last.fm is not set up. Scrobble once from the menu to authenticate.")
+    result = scrobble_log_native(selected_ipod, config, delete_log=options.get("delete_log", False))
+    if result is None:
+        return {"status": "error", "ipod": str(selected_ipod), "accepted": 0, "ignored": 0}
+    return {"status": "ok", "ipod": str(selected_ipod), "accepted": result[0], "ignored": result[1]}
+
+def command_unmount(options: dict) -> dict:
+    selected_ipod = resolve_ipod(options.get("ipod"))
+    removed = safely_unmount_ipod(selected_ipod, force=options.get("force", False))
+    return {"status": "ok" if removed else "error", "ipod": str(selected_ipod)}
+
+def process_connected_ipod(selected_ipod: Path, options: dict):
+    """Syncs, scrobbles and optionally unmounts an iPod found by the watcher."""
+    device_options = dict(options, ipod=str(selected_ipod))
+    jobs = [("sync", command_sync)]
+    if not options.get("no_scrobble"):
+        jobs.append(("scrobble", command_scrobble))
+    if options.get("unmount"):
+        jobs.append(("unmount", command_unmount))
+
+    for name, command in jobs:
+        if not (selected_ipod / "iPod_Control").is_dir():
+            print(f"\033[93miPod {selected_ipod} was removed, skipping {name}.\033[0m")
+            return
+        summary = {"command": name, "ipod": str(selected_ipod)}
+        try:
+            summary.update(command(device_options))
+        except Exception as e:  # keep watching other iPods whatever happens to this one
+            summary.update(status="error", error=str(e))
+            print(f"\033[91mError during {name} of {selected_ipod}: {e}\033[0m")
+        if options.get("json"):
+            print(json.dumps(summary), file=sys.__stdout__, flush=True)
+        if name == "sync" and summary.get("status") != "ok":
+            return
+
+def command_watch(options: dict) -> dict:
+    """
+    Waits for iPods to be connected and processes them one after another on
+    a background thread, so iPods connected meanwhile are queued, not missed.
+    With --ipod only that iPod (mount point or device id) is processed.
+    """
+    from modules.devices import watch_ipods
+
+    wanted = options.get("ipod") or []
+    if isinstance(wanted, str):  # a profile may name a single iPod
+        wanted = [wanted]
+    pending = queue.Queue()
+    processed = [0]
+
+    def worker():
+        while True:
+            selected_ipod = pending.get()
+            if selected_ipod is None:
+                return
+            process_connected_ipod(selected_ipod, options)
+            processed[0] += 1
+
+    thread = threading.Thread(target=worker, name="ipod-worker", daemon=True)
+    thread.start()
+    print("Waiting for iPods. Press Ctrl+C to stop.")
+    try:
+        for event, mountpoint in watch_ipods():
+            if event == "removed":
+                print(f"iPod removed: {mountpoint}")
+                continue
+            if wanted and not {str(mountpoint), read_device_id(mountpoint)} & set(wanted):
+                continue
+            print(f"iPod connected: {mountpoint} ({pending.qsize()} queued before it)")
+            pending.put(mountpoint)
+    except KeyboardInterrupt:
+        print("Stopping after the iPod currently being processed...")
+    finally:
+        pending.put(None)
+        thread.join()
+    return {"status": "ok", "processed": processed[0]}
+
+COMMANDS = {
+    "sync": command_sync,
+    "delete": command_delete,
+    "search": command_search,
+    "audit": command_audit,
+    "fragmentation": command_fragmentation,
+    "scrobble": command_scrobble,
+    "unmount": command_unmount,
+    "watch": command_watch,
+}
+
+def parse_args(argv: list) -> argparse.Namespace:
+    """Parses the headless command line. Unset options stay None so profiles can fill them in."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--profile", help="profile name (in ~/.config/ipod-manager/profiles) or file")
+    common.add_argument("--ipod", action="append", help="mount point or device id of the iPod (repeat to sync several)")
+    common.add_argument("--json", action="store_true", help="print a machine-readable summary on stdout")
+    common.add_argument("--trace", metavar="FILE", help="write phase timings and I/O counts to FILE")
+    common.add_argument("--trace-format", choices=("json", "chrome"), default="json",
+                        help="trace file format: summary JSON or Chrome trace events (default: json)")
+
+    parser = argparse.ArgumentParser(
+        prog="ipod-manager", description="Manage music on iPods running Rockbox. Without a command the interactive menu starts.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync_options = argparse.ArgumentParser(add_help=False)
+    sync_options.add_argument("--source", help="music library folder")
+    sync_options.add_argument("--extensions", nargs="+", help="file types to sync")
+    sync_options.add_argument("--verify-hash", action="store_true", default=None, help="compare content hashes of changed files")
+    sync_options.add_argument("--rescan", action="store_true", default=None, help="bypass the scan cache")
+    sync_options.add_argument("--autofill", action="store_true", default=None, help="fill free space with the most played albums")
+    sync_options.add_argument("--tagcache", action="store_true", default=None, help="build the Rockbox database after syncing")
+    sync_options.add_argument("--albumart", action="store_true", default=None, help="put covers scaled for the iPod into the album folders")
+    sync_options.add_argument("--layout", action="store_true", default=None, help="write album by album into preallocated files (FAT32)")
+    sync_options.add_argument("--query", help='only sync tracks matching a query, e.g. "genre=jazz AND year<1970"')
+
+    sync = commands.add_parser("sync", parents=[common, sync_options], help="copy new or changed music to the iPod")
+    sync.add_argument("artists", nargs="*", help="artists to sync (default: all)")
+    sync.add_argument("--all-ipods", action="store_true", default=None, help="sync every connected iPod at once")
+
+    delete = commands.add_parser("delete", parents=[common], help="delete music from the iPod")
+    delete.add_argument("artists", nargs="*", help="artists to delete")
+    delete.add_argument("--all", action="store_true", default=None, help="delete all music")
+    delete.add_argument("--yes", action="store_true", default=None, help="do not ask for confirmation")
+    delete.add_argument("--query", help="delete the tracks matching a query instead of artists")
+    delete.add_argument("--source", help="music library folder the query runs on")
+
+    search = commands.add_parser("search", parents=[common], help="search the library's tags")
+    search.add_argument("terms", nargs="*", help="free text or a query")
+    search.add_argument("--source", help="music library folder")
+    search.add_argument("--extensions", nargs="+", help="file types to search")
+
+    audit = commands.add_parser("audit", parents=[common], help="check the music on the iPod for corruption")
+    audit.add_argument("--sample", type=float, metavar="PERCENT", help="only read this share of random blocks")
+    audit.add_argument("--workers", type=int, help=f"parallel readers (default: {DEFAULT_AUDIT_WORKERS})")
+    audit.add_argument("--seed", type=int, help="seed for picking the sampled blocks")
+
+    commands.add_parser("fragmentation", parents=[common], help="report how fragmented the music on the iPod is")
+
+    scrobble = commands.add_parser("scrobble", parents=[common], help="submit .scrobbler.log to Last.fm")
+    scrobble.add_argument("--delete-log", action="store_true", default=None, help="delete the log afterwards")
+
+    unmount = commands.add_parser("unmount", parents=[common], help="unmount and power off the iPod")
+    unmount.add_argument("--force", action="store_true", default=None, help="unmount even if the iPod is in use")
+
+    watch = commands.add_parser("watch", parents=[common, sync_options], help="sync and scrobble iPods as they are connected")
+    watch.add_argument("--no-scrobble", action="store_true", default=None, help="only sync")
+    watch.add_argument("--unmount", action="store_true", default=None, help="unmount each iPod when done")
+
+    return parser.parse_args(argv)
+
+def run_headless(argv: list) -> int:
+    """Runs one command without prompts and reports a summary. Returns the exit code."""
+    args = parse_args(argv)
+    start = time.monotonic()
+    summary = {"command": args.command}
+    if args.trace:
+        trace.enable()
+
+    try:
+        options = load_profile(args.profile)
+        # Empty positional lists mean "not given" as well.
+        options.update({key: value for key, value in vars(args).items() if value not in (None, [])})
+        # Keep stdout clean for the JSON summary; progress and messages go to stderr.
+        with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout), trace.phase(args.command):
+            summary.update(COMMANDS[args.command](options))
+    except (CommandError, ValueError, OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        # Errors of the iPod (gone, read-only, full) or of helpers such as udisksctl end up in the summary as well.
+        summary.update(status="error", error=str(e))
+        if not args.json:
+            print(f"\033[91mError: {e}\033[0m", file=sys.stderr)
+
+    summary["elapsed"] = round(time.monotonic() - start, 3)
+    if args.trace:
+        try:
+            trace.export(args.trace, args.trace_format, {"command": args.command, "argv": argv})
+        except OSError as e:
+            print(f"\033[91mCould not write the trace: {e}\033[0m", file=sys.stderr)
+    if args.json:
+        print(json.dumps(summary))
+    return 0 if summary["status"] == "ok" else 1
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_headless(sys.argv[1:]))
     main()
@@ -0,0 +1,231 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : albumart.py
+ Description : Optional album art stage of the copy pipeline. The
+               cover of every album (an image in its folder or the
+               art embedded in its first track) is scaled to the
+               size the iPod's theme shows and saved as a small
+               baseline cover.bmp or cover.jpg on a process pool,
+               so Rockbox does not decode and scale large scans on
+               the device. Results are kept in a host-side cache
+               keyed by image content and target size. Needs Pillow.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import io
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from modules.manifest import get_state_dir
+from modules.scan_cache import get_cache_dir
+
+ART_STATE_FILE = "albumart.json"
+# Image files taken as an album's cover, by preference of their name; other images only if there is no such file.
+ART_NAMES = ("cover", "folder", "front", "albumart", "album")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
+# The album art size of the default themes on the iPod Video and Classic.
+DEFAULT_ART_SIZE = (100, 100)
+# Rockbox reads uncompressed BMPs and baseline (not progressive) JPEGs.
+ART_FORMATS = {"bmp": ("BMP", ".bmp"), "jpg": ("JPEG", ".jpg")}
+JPEG_QUALITY = 90
+
+
+def art_settings(value) -> Optional[dict]:
+    """
+    Reads the "albumart" setting of device.json: true, or e.g.
+    {"size": [120, 120], "format": "jpg"}. Returns None if disabled.
+    """
+    if not value:
+        return None
+    settings = value if isinstance(value, dict) else {}
+    size = settings.get("size", DEFAULT_ART_SIZE)
+    width, height = (size, size) if isinstance(size, int) else size
+    art_format = settings.get("format", "bmp").lower().lstrip(".").replace("jpeg", "jpg")
+    if art_format not in ART_FORMATS:
+        raise ValueError(f"Unknown album art format: {art_format}")
+    return {"size": (int(width), int(height)), "format": art_format}
+
+def find_art(files: Dict[str, tuple], tracks: List[str]) -> Optional[Tuple[str, bool]]:
+    """
+    Picks the cover of an album from the files in its folder ({name:
+    (size, mtime)}) and its tracks. Returns (file name, embedded), where
+    embedded means the picture is read from that track; None without art.
+    """
+    images = {name: stat for name, stat in files.items() if name.lower().endswith(IMAGE_EXTENSIONS)}
+    for preferred in ART_NAMES:
+        for name in sorted(images):
+            if os.path.splitext(name)[0].lower() == preferred:
+                return name, False
+    if images:
+        # Probably the front scan if nothing says otherwise.
+        return max(images, key=lambda name: images[name][0]), False
+    if tracks:
+        return sorted(tracks)[0], True
+    return None
+
+def _scale_art(source: str, embedded: bool, width: int, height: int, art_format: str,
+               cache_dir: str) -> Optional[Tuple[str, str]]:
+    """
+    Worker: reads the picture, and scales and saves it unless the cache
+    already holds the result. Returns (cache key, cached file); None if
+    the track has no picture.
+    """
+    from PIL import Image
+    from modules.tags import read_picture
+
+    data = read_picture(Path(source)) if embedded else Path(source).read_bytes()
+    if not data:
+        return None
+    content_hash = hashlib.blake2b(data, digest_size=20).hexdigest()
+    key = hashlib.blake2b(f"{content_hash}:{width}x{height}:{art_format}".encode(), digest_size=20).hexdigest()
+    pil_format, extension = ART_FORMATS[art_format]
+    output = Path(cache_dir) / key[:2] / f"{key}{extension}"
+    if output.exists():
+        return key, str(output)
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        # Keep the aspect ratio; Rockbox centers the art in its box.
+        image.thumbnail((width, height), Image.LANCZOS)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        tmp_output = output.with_name(f".{key}.{os.getpid()}{extension}")
+        if pil_format == "JPEG":
+            image.save(tmp_output, pil_format, quality=JPEG_QUALITY, progressive=False, optimize=True)
+        else:
+            image.save(tmp_output, pil_format)
+    os.replace(tmp_output, output)
+    return key, str(output)
+
+
+class ArtScaler:
+    """
+    Prepares scaled covers. Sources already prepared with the same size and
+    modification time are answered from the cache without being read.
+    """
+
+    def __init__(self, settings: dict, cache_dir: Optional[Path] = None, workers: Optional[int] = None):
+        self.width, self.height = settings["size"]
+        self.format = settings["format"]
+        self.extension = ART_FORMATS[self.format][1]
+        self.settings_key = f"{self.width}x{self.height}:{self.format}"
+        self.cache_dir = Path(cache_dir) if cache_dir else get_cache_dir() / "albumart"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.db = sqlite3.connect(str(self.cache_dir / "sources.sqlite"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sources (path TEXT, settings TEXT, size INTEGER, mtime REAL, key TEXT, "
+            "PRIMARY KEY (path, settings))"
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def cached_file(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.extension}"
+
+    def prepare(self, sources: Iterable[Tuple[Path, bool, tuple]]) -> Dict[Path, Optional[str]]:
+        """
+        Takes (source path, embedded, (size, mtime)) items and returns
+        {source path: cache key}, None for tracks without a picture or
+        pictures that cannot be read. Missing covers are made on a process
+        pool; failures are reported and skipped.
+        """
+        keys, todo = {}, []
+        for source, embedded, stat in sources:
+            row = self.db.execute(
+                "SELECT key FROM sources WHERE path = ? AND settings = ? AND size = ? AND mtime = ?",
+                (str(source), self.settings_key, *stat),
+            ).fetchone()
+            if row is not None and (not row[0] or self.cached_file(row[0]).exists()):
+                keys[source] = row[0] or None
+            else:
+                todo.append((source, embedded, stat))
+        if not todo:
+            return keys
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(todo))) as pool:
+            futures = [
+                (source, stat, pool.submit(_scale_art, str(source), embedded, self.width, self.height,
+                                           self.format, str(self.cache_dir)))
+                for source, embedded, stat in todo
+            ]
+            for source, stat, future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"\033[91mError preparing the album art of {source.parent.name}: {e}\033[0m")
+                    keys[source] = None
+                    continue
+                keys[source] = result[0] if result else None
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sources (path, settings, size, mtime, key) VALUES (?, ?, ?, ?, ?)",
+                    (str(source), self.settings_key, *stat, keys[source] or ""),
+                )
+        self.db.commit()
+        return keys
+
+
+def get_art_state_path(ipod_path: Path) -> Path:
+    return get_state_dir(ipod_path) / ART_STATE_FILE
+
+def load_art_state(ipod_path: Path) -> Dict[str, str]:
+    """Loads {album folder below Music/: cover file name:cache key} of the covers on the iPod."""
+    try:
+        with get_art_state_path(ipod_path).open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_art_state(ipod_path: Path, state: Dict[str, str]):
+    path = get_art_state_path(ipod_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def remove_album_art(ipod_path: Path, albums: Iterable[str]) -> List[str]:
+    """
+    Removes the covers of the given album folders that hold no music any
+    more, together with the then empty folders. Returns the albums cleared.
+    """
+    from modules.file_operations import delete_files
+
+    state = load_art_state(ipod_path)
+    music_dir = Path(ipod_path) / "Music"
+    cleared = []
+    for album in set(albums):
+        if album not in state:
+            continue
+        name = state[album].split(":", 1)[0]
+        try:
+            leftovers = [entry for entry in os.listdir(music_dir / album) if entry != name]
+        except FileNotFoundError:
+            leftovers = []
+        if not leftovers:
+            _, failed = delete_files([music_dir / album / name], prune_root=music_dir)
+            if failed:
+                print(f"\033[91mError deleting the album art of {album}: {failed[0][1]}\033[0m")
+                continue
+            del state[album]
+            cleared.append(album)
+    if cleared:
+        save_art_state(ipod_path, state)
+    return cleared
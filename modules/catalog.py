@@ -0,0 +1,198 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : catalog.py
+ Description : Searches the tag catalog kept in the scan cache and
+               selects tracks with queries such as
+               genre=jazz AND year<1970. Queries are compiled to
+               SQL on the indexed catalog; free text is matched by
+               prefix, then by substring, then fuzzily.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import re
+import difflib
+import sqlite3
+from typing import List, Tuple
+
+# Query fields and whether they hold numbers.
+FIELDS = {
+    "title": False, "artist": False, "album": False, "genre": False, "composer": False, "comment": False,
+    "albumartist": False, "grouping": False, "path": False,
+    "year": True, "disc": True, "track": True, "length": True, "bitrate": True,
+}
+COLUMNS = {"disc": "discnumber", "track": "tracknumber"}
+# Fields matched by free text without a field name.
+TEXT_FIELDS = ("artist", "album", "title")
+FUZZY_CUTOFF = 0.6
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<field>[A-Za-z]+)\s*(?P<op><=|>=|!=|=|<|>|~)\s*(?P<value>"[^"]*"|'[^']*'|[^\s()]+)
+      | (?P<word>"[^"]*"|'[^']*'|[^\s()]+)
+    )""", re.VERBOSE)
+
+
+class QueryError(ValueError):
+    """A selection query cannot be parsed."""
+
+
+def _tokens(text: str) -> List[tuple]:
+    tokens, position = [], 0
+    text = text.strip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"Cannot read the query at: {text[position:]}")
+        position = match.end()
+        if match.group("paren"):
+            tokens.append(("paren", match.group("paren")))
+        elif match.group("field"):
+            tokens.append(("compare", match.group("field").lower(), match.group("op"), _unquote(match.group("value"))))
+        elif match.group("word").upper() in ("AND", "OR", "NOT"):
+            tokens.append(("keyword", match.group("word").upper()))
+        else:
+            tokens.append(("word", _unquote(match.group("word"))))
+    return tokens
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'" else value
+
+def _like(value: str) -> str:
+    """Turns * and ? wildcards into a LIKE pattern, escaping LIKE's own wildcards."""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+def _comparison(field: str, op: str, value: str) -> Tuple[str, list]:
+    if field not in FIELDS:
+        raise QueryError(f"Unknown field '{field}'. Known fields: {', '.join(FIELDS)}")
+    column = COLUMNS.get(field, field)
+    if FIELDS[field]:
+        if op == "~":
+            raise QueryError(f"'~' only works on text fields, not on {field}.")
+        try:
+            number = int(value)
+        except ValueError:
+            raise QueryError(f"{field} needs a number, not '{value}'.")
+        return f"{column} {op} ?", [number]
+
+    if op == "~":
+        return f"{column} LIKE ? ESCAPE '\\'", [f"%{_like(value)}%"]
+    if op in ("=", "!=") and ("*" in value or "?" in value):
+        return f"{'' if op == '=' else 'NOT '}{column} LIKE ? ESCAPE '\\'", [_like(value)]
+    # Text columns compare without regard to case (COLLATE NOCASE).
+    return f"{column} {op} ?", [value]
+
+def _free_text(value: str) -> Tuple[str, list]:
+    pattern = f"%{_like(value)}%"
+    return "(" + " OR ".join(f"{field} LIKE ? ESCAPE '\\'" for field in TEXT_FIELDS) + ")", [pattern] * len(TEXT_FIELDS)
+
+def parse_query(text: str) -> Tuple[str, list]:
+    """
+    Compiles a selection query to an SQL condition and its parameters.
+    Conditions are field<op>value with the operators = != < <= > >= and ~
+    (contains); = and != accept * and ? wildcards. They combine with AND
+    (also implied between conditions), OR, NOT and parentheses. Words
+    without a field match artist, album or title. Raises QueryError.
+    """
+    tokens = _tokens(text)
+    if not tokens:
+        raise QueryError("The query is empty.")
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expression():
+        sql, params = conjunction()
+        while peek() == ("keyword", "OR"):
+            take()
+            right, right_params = conjunction()
+            sql, params = f"{sql} OR {right}", params + right_params
+        return sql, params
+
+    def conjunction():
+        sql, params = factor()
+        while peek() is not None and peek() not in (("keyword", "OR"), ("paren", ")")):
+            if peek() == ("keyword", "AND"):
+                take()
+            right, right_params = factor()
+            sql, params = f"{sql} AND {right}", params + right_params
+        return sql, params
+
+    def factor():
+        token = take() if peek() is not None else None
+        if token is None:
+            raise QueryError("The query ends too early.")
+        if token == ("keyword", "NOT"):
+            sql, params = factor()
+            # Tracks without the tag compare as NULL; NOT should still select them.
+            return f"NOT IFNULL(({sql}), 0)", params
+        if token == ("paren", "("):
+            sql, params = expression()
+            if peek() != ("paren", ")"):
+                raise QueryError("A parenthesis is not closed.")
+            take()
+            return f"({sql})", params
+        if token[0] == "compare":
+            return _comparison(*token[1:])
+        if token[0] == "word":
+            return _free_text(token[1])
+        raise QueryError(f"Unexpected '{token[-1]}' in the query.")
+
+    sql, params = expression()
+    if peek() is not None:
+        raise QueryError(f"Unexpected '{peek()[-1]}' in the query.")
+    return sql, params
+
+def query_tracks(conn: sqlite3.Connection, text: str) -> List[str]:
+    """Returns the library paths of the cataloged tracks matching a query, in library order."""
+    sql, params = parse_query(text)
+    return [path for path, in conn.execute(f"SELECT path FROM catalog WHERE {sql} ORDER BY path", params)]
+
+def search(conn: sqlite3.Connection, text: str, limit: int = 20) -> List[Tuple[str, str]]:
+    """
+    Suggests artists, albums and titles for free text: prefix matches first
+    (answered from the indexes), then substring matches and, if those find
+    nothing, close matches for typos. Returns (field, value) pairs.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    results: List[Tuple[str, str]] = []
+    seen = set()
+
+    def add(field: str, values):
+        for value in values:
+            if len(results) >= limit:
+                return
+            if value and (field, value.lower()) not in seen:
+                seen.add((field, value.lower()))
+                results.append((field, value))
+
+    for pattern in (f"{_like(text)}%", f"%{_like(text)}%"):
+        for field in TEXT_FIELDS:
+            rows = conn.execute(
+                f"SELECT DISTINCT {field} FROM catalog WHERE {field} LIKE ? ESCAPE '\\' ORDER BY {field} LIMIT ?",
+                (pattern, limit),
+            )
+            add(field, (value for value, in rows))
+
+    if not results:
+        for field in ("artist", "album"):
+            values = [value for value, in conn.execute(f"SELECT DISTINCT {field} FROM catalog") if value]
+            lowered = {value.lower(): value for value in values}
+            matches = difflib.get_close_matches(text.lower(), list(lowered), n=limit, cutoff=FUZZY_CUTOFF)
+            add(field, (lowered[match] for match in matches))
+    return results
@@ -0,0 +1,213 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : checksums.py
+ Description : Keeps a checksum store on the iPod with a content
+               hash and per-block hashes of every copied file. The
+               hashes are computed by the copy engine while it reads
+               the source, so copying needs no second read. The
+               audit re-reads the device, in full or only a random
+               sample of blocks, and reports corrupted files.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import json
+import random
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from modules.manifest import get_state_dir
+
+CHECKSUM_FILE = "checksums.json"
+CHECKSUM_VERSION = 1
+BLOCK_SIZE = 1024 * 1024  # 1 MiB, the copy buffer size
+DIGEST_SIZE = 20  # same as the manifest's content hash
+BLOCK_DIGEST_SIZE = 8
+BLOCK_HEX = BLOCK_DIGEST_SIZE * 2
+DEFAULT_AUDIT_WORKERS = 4
+
+
+class ContentHasher:
+    """Hashes file content as it streams past, as a whole and per block."""
+
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+        self.digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self.block = hashlib.blake2b(digest_size=BLOCK_DIGEST_SIZE)
+        self.blocks: List[str] = []
+        self.filled = 0
+        self.size = 0
+
+    def update(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self.filled)
+            self.block.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == self.block_size:
+                self.blocks.append(self.block.hexdigest())
+                self.block = hashlib.blake2b(digest_size=BLOCK_DIGEST_SIZE)
+                self.filled = 0
+
+    def entry(self) -> dict:
+        """Returns the checksum store entry: size, hash and the concatenated block hashes."""
+        blocks = self.blocks + [self.block.hexdigest()] if self.filled else self.blocks
+        return {"size": self.size, "hash": self.digest.hexdigest(), "blocks": "".join(blocks)}
+
+
+def get_checksum_path(ipod_path: Path) -> Path:
+    return get_state_dir(ipod_path) / CHECKSUM_FILE
+
+def load_checksums(ipod_path: Path) -> Dict[str, dict]:
+    """Loads the checksum store of an iPod; an empty store if there is none."""
+    try:
+        with get_checksum_path(ipod_path).open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if data.get("version") != CHECKSUM_VERSION or data.get("block_size") != BLOCK_SIZE:
+        return {}
+    return data.get("files", {})
+
+def save_checksums(ipod_path: Path, files: Dict[str, dict]):
+    """Atomically writes the checksum store to the iPod."""
+    path = get_checksum_path(ipod_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump({"version": CHECKSUM_VERSION, "block_size": BLOCK_SIZE, "files": files}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def update_checksums(ipod_path: Path, copied: Iterable[str], hashes: Dict[str, dict],
+                     keep: Optional[Iterable[str]] = None):
+    """
+    Records the hashes of the copied files (device relative paths). Copied
+    files without a hash (e.g. copied by rsync) lose their stale entry.
+    With keep, entries of files not listed there are dropped as well.
+    The store is only rewritten if it changed.
+    """
+    store = load_checksums(ipod_path)
+    before = len(store)
+    changed = False
+    for rel_path in copied:
+        if rel_path in hashes:
+            store[rel_path] = hashes[rel_path]
+            changed = True
+        elif store.pop(rel_path, None) is not None:
+            changed = True
+    if keep is not None:
+        keep = set(keep)
+        store = {rel_path: entry for rel_path, entry in store.items() if rel_path in keep}
+    if changed or len(store) != before:
+        save_checksums(ipod_path, store)
+
+def forget_checksums(ipod_path: Path, prefixes: List[str], paths: Iterable[str] = ()):
+    """Drops the entries below the given top-level directories (deleted artists) and of the given files."""
+    store = load_checksums(ipod_path)
+    scope = set(prefixes)
+    paths = set(paths)
+    remaining = {rel_path: entry for rel_path, entry in store.items()
+                 if rel_path.split("/", 1)[0] not in scope and rel_path not in paths}
+    if len(remaining) != len(store):
+        save_checksums(ipod_path, remaining)
+
+def _drop_cache(fd: int):
+    """Evicts the file's cached pages so the audit reads the device, not memory."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+def _bad_blocks(expected: str, actual: str) -> List[int]:
+    count = max(len(expected), len(actual)) // BLOCK_HEX
+    return [i for i in range(count)
+            if expected[i * BLOCK_HEX:(i + 1) * BLOCK_HEX] != actual[i * BLOCK_HEX:(i + 1) * BLOCK_HEX]]
+
+def verify_file(path: Path, entry: dict, sample: Optional[float] = None,
+                rng: Optional[random.Random] = None, progress=None) -> dict:
+    """
+    Re-reads a file on the device and compares it against its store entry.
+    sample (0 < sample <= 1) only checks that share of randomly picked
+    blocks, at least one per file; otherwise the whole file is hashed.
+    Returns {"status": "ok" | "corrupt" | "missing", "bytes": read, "bad_blocks": [...]}.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return {"status": "missing", "bytes": 0, "bad_blocks": []}
+    try:
+        size = os.fstat(fd).st_size
+        if size != entry["size"]:
+            return {"status": "corrupt", "bytes": 0, "bad_blocks": [], "size": size}
+        _drop_cache(fd)
+
+        read = 0
+        block_count = len(entry["blocks"]) // BLOCK_HEX
+        if sample is not None and block_count:
+            picks = (rng or random).sample(range(block_count), max(1, min(block_count, round(block_count * sample))))
+            bad = []
+            for index in sorted(picks):
+                data = os.pread(fd, BLOCK_SIZE, index * BLOCK_SIZE)
+                read += len(data)
+                expected = entry["blocks"][index * BLOCK_HEX:(index + 1) * BLOCK_HEX]
+                if hashlib.blake2b(data, digest_size=BLOCK_DIGEST_SIZE).hexdigest() != expected:
+                    bad.append(index)
+                if progress is not None:
+                    progress.update(len(data))
+            corrupt = bool(bad)
+        else:
+            hasher = ContentHasher()
+            with os.fdopen(os.dup(fd), "rb", buffering=0) as f:
+                buffer = bytearray(BLOCK_SIZE)
+                view = memoryview(buffer)
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+                    read += n
+                    if progress is not None:
+                        progress.update(n)
+            actual = hasher.entry()
+            corrupt = actual["hash"] != entry["hash"]
+            bad = _bad_blocks(entry["blocks"], actual["blocks"]) if corrupt else []
+    except OSError as e:
+        return {"status": "corrupt", "bytes": 0, "bad_blocks": [], "error": str(e)}
+    finally:
+        os.close(fd)
+    return {"status": "corrupt" if corrupt else "ok", "bytes": read, "bad_blocks": bad}
+
+def audit(ipod_path: Path, sample: Optional[float] = None, workers: int = DEFAULT_AUDIT_WORKERS,
+          seed: Optional[int] = None, progress=None) -> Dict[str, dict]:
+    """
+    Verifies every file in the checksum store of an iPod on a pool of
+    reader threads (hashing runs outside the GIL). See verify_file for
+    sample. Returns {device relative path: result}.
+    """
+    music_dir = Path(ipod_path) / "Music"
+    store = load_checksums(ipod_path)
+    if progress is not None:
+        total = sum(entry["size"] for entry in store.values())
+        progress.total = total if sample is None else min(total, int(total * sample) + len(store) * BLOCK_SIZE)
+        progress.refresh()
+
+    # One generator per file keeps the random picks reproducible for a seed, whatever the thread order.
+    rng = random.Random(seed)
+    seeds = {rel_path: rng.random() for rel_path in store}
+
+    def check(rel_path: str) -> dict:
+        return verify_file(music_dir / rel_path, store[rel_path], sample, random.Random(seeds[rel_path]), progress)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(zip(store, pool.map(check, store)))
@@ -0,0 +1,178 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : devices.py
+ Description : Detects iPods from the kernel's mount table
+               (/proc/self/mountinfo) by their iPod_Control folder,
+               wherever they are mounted, and watches for iPods
+               being connected or removed using poll() on the mount
+               table and inotify on the media folders.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import re
+import time
+import errno
+import select
+import ctypes
+import getpass
+import threading
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+IPOD_MARKER = "iPod_Control"
+
+# Filesystems Rockbox iPods use; network and pseudo filesystems are never probed.
+IPOD_FSTYPES = {"vfat", "msdos", "exfat", "hfsplus", "fuseblk"}
+
+# Full rescan interval in case an event is missed, and the stop check interval.
+RESCAN_SECONDS = 30.0
+POLL_SECONDS = 1.0
+
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_MOVED_TO = 0x80
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+
+class Mount(NamedTuple):
+    mountpoint: Path
+    source: str
+    fstype: str
+
+
+def _unescape(field: str) -> str:
+    """Decodes the octal escapes (e.g. \\040 for a space) used in the mount table."""
+    return re.sub(r"\\([0-7]{3})", lambda match: chr(int(match.group(1), 8)), field)
+
+def read_mounts(mountinfo_path: str = MOUNTINFO_PATH) -> List[Mount]:
+    """Lists the mounts of the current mount namespace."""
+    mounts = []
+    with open(mountinfo_path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            fields = line.split()
+            # Optional fields end with a lone "-", followed by fstype, source and options.
+            try:
+                separator = fields.index("-", 6)
+            except ValueError:
+                continue
+            mounts.append(Mount(Path(_unescape(fields[4])), _unescape(fields[separator + 2]), fields[separator + 1]))
+    return mounts
+
+def is_ipod(mount: Mount) -> bool:
+    """Checks whether a mount is an iPod, i.e. has an iPod_Control folder."""
+    if mount.fstype not in IPOD_FSTYPES:
+        return False
+    try:
+        return (mount.mountpoint / IPOD_MARKER).is_dir()
+    except OSError:
+        return False
+
+def find_ipods(mounts: Optional[List[Mount]] = None) -> List[Path]:
+    """Finds the mounted iPods, wherever they are mounted."""
+    if mounts is None:
+        mounts = read_mounts()
+    return sorted({mount.mountpoint for mount in mounts if is_ipod(mount)})
+
+def get_mount_source(mountpoint: str, mounts: Optional[List[Mount]] = None) -> str:
+    """
+    Returns the device mounted at mountpoint (e.g. /dev/sdb2).
+    Raises FileNotFoundError if nothing is mounted there.
+    """
+    if mounts is None:
+        mounts = read_mounts()
+    target = Path(os.path.realpath(mountpoint))
+    # Later entries are mounted on top of earlier ones.
+    for mount in reversed(mounts):
+        if mount.mountpoint == target:
+            return mount.source
+    raise FileNotFoundError(f"No device found for mountpoint {mountpoint}.")
+
+def get_media_roots() -> List[Path]:
+    """Returns the folders desktop automounters create mount points in."""
+    user = getpass.getuser()
+    return [Path("/run/media") / user, Path("/media") / user, Path("/media")]
+
+
+class _Inotify:
+    """Minimal inotify binding; only used to wake up the watcher."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path: Path, mask: int = _IN_CREATE | _IN_DELETE | _IN_MOVED_TO) -> bool:
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask) >= 0
+
+    def drain(self):
+        """Discards the pending events."""
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        os.close(self.fd)
+
+    @classmethod
+    def create(cls) -> Optional["_Inotify"]:
+        try:
+            return cls()
+        except (OSError, AttributeError):
+            return None
+
+
+def watch_ipods(stop: Optional[threading.Event] = None,
+                rescan_seconds: float = RESCAN_SECONDS) -> Iterator[Tuple[str, Path]]:
+    """
+    Yields ("added", mountpoint) and ("removed", mountpoint) as iPods are
+    mounted and unmounted; iPods mounted already are reported first. The
+    kernel flags the mount table for poll() whenever it changes, and
+    inotify on the media folders catches new mount points; both only
+    trigger a re-read of the mount table. Runs until stop is set.
+    """
+    poller = select.poll()
+    mountinfo = open(MOUNTINFO_PATH, "rb")
+    poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+
+    inotify = _Inotify.create()
+    if inotify is not None:
+        watched = [root for root in get_media_roots() if root.is_dir() and inotify.add_watch(root)]
+        if watched:
+            poller.register(inotify.fd, select.POLLIN)
+
+    known = set()
+    last_scan = 0.0
+    try:
+        changed = True
+        while stop is None or not stop.is_set():
+            if changed or time.monotonic() - last_scan >= rescan_seconds:
+                last_scan = time.monotonic()
+                current = set(find_ipods())
+                for mountpoint in sorted(current - known):
+                    yield "added", mountpoint
+                for mountpoint in sorted(known - current):
+                    yield "removed", mountpoint
+                known = current
+
+            events = poller.poll(POLL_SECONDS * 1000)
+            changed = bool(events)
+            if inotify is not None and any(fd == inotify.fd for fd, _ in events):
+                inotify.drain()
+    finally:
+        mountinfo.close()
+        if inotify is not None:
+            inotify.close()
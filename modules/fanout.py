@@ -0,0 +1,246 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : fanout.py
+ Description : Copies files to several iPods at once while reading
+               every source file only once. Each iPod has its own
+               writer thread, bounded buffer, progress bar and error
+               list, so a slow or failing iPod does not hold up the
+               others beyond its buffer. Files are renamed into
+               place once complete.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import time
+import errno
+import queue
+import threading
+from pathlib import Path
+from tqdm import tqdm
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from modules.checksums import ContentHasher
+from modules.journal import part_path
+from modules.layout import preallocate
+from modules import trace
+
+FANOUT_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024  # 64 MiB queued per iPod
+
+# Errors after which an iPod takes no more writes: full, removed or read-only.
+_DEVICE_ERRORS = {errno.ENOSPC, errno.EIO, errno.ENODEV, errno.ENXIO, errno.EROFS}
+
+_OPEN, _DATA, _CLOSE, _ABORT = range(4)
+
+
+class _DeviceWriter:
+    """Writes the files queued for one iPod on its own thread."""
+
+    def __init__(self, name: str, target: Path, progress, buffer_bytes: int, chunk_size: int,
+                 on_done: Optional[Callable] = None, reserve: bool = False):
+        self.name = name
+        self.reserve = reserve
+        self.on_done = on_done
+        self.target = Path(target)
+        self.progress = progress
+        # The queue counts messages; almost all of them are chunks of chunk_size.
+        self.queue: "queue.Queue" = queue.Queue(maxsize=max(2, buffer_bytes // chunk_size))
+        self.done: List[Any] = []
+        self.failed: List[Tuple[Any, Exception]] = []
+        self.error: Optional[OSError] = None
+        # Set if the writer thread failed unexpectedly; it then only drains its queue.
+        self.dead: Optional[Exception] = None
+        self.created_dirs = set()
+        self.thread = threading.Thread(target=self._run, name=f"fanout-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.f = None
+        self.item = self.path = self.st = self.failure = None
+        self.placed = False
+        while True:
+            message = self.queue.get()
+            if message is None:
+                if self.f is not None:
+                    # Stopped in the middle of a file (Ctrl+C): drop the partial copy.
+                    self._discard()
+                return
+            if self.dead is not None:
+                # Drain the queue so the reader never blocks on a dead writer.
+                if message[0] == _OPEN:
+                    self.failed.append((message[1], self.dead))
+                continue
+            try:
+                self._handle(message)
+            except Exception as e:
+                # Whatever went wrong (e.g. the journal cannot flush a removed iPod), fail the
+                # current file and take no more writes; the other iPods go on.
+                if self.placed:
+                    self.done.remove(self.item)
+                self.failed.append((self.item, e))
+                self._discard()
+                self.dead = e
+                print(f"\033[91mStopped writing to {self.name}: {e}\033[0m")
+
+    def _discard(self):
+        """Closes and removes the partial copy of the current file, if any."""
+        if self.f is not None:
+            try:
+                self.f.close()
+            except OSError:
+                pass
+            self.f = None
+            try:
+                part_path(self.path).unlink()
+            except OSError:
+                pass
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == _OPEN:
+            _, self.item, rel_target, self.st = message
+            self.start = time.perf_counter_ns() if trace.ENABLED else 0
+            self.path = self.target / rel_target
+            self.placed = False
+            self.failure = self.error
+            if self.failure is None:
+                try:
+                    if self.path.parent not in self.created_dirs:
+                        self.path.parent.mkdir(parents=True, exist_ok=True)
+                        self.created_dirs.add(self.path.parent)
+                    self.f = open(part_path(self.path), "wb")
+                    if self.reserve and self.st is not None:
+                        preallocate(self.f.fileno(), self.st.st_size)
+                except OSError as e:
+                    self.failure = e
+        elif kind == _DATA:
+            if self.f is not None and self.failure is None:
+                try:
+                    self.f.write(message[1])
+                    self.progress.update(len(message[1]))
+                except OSError as e:
+                    self.failure = e
+        else:
+            opened = self.f is not None
+            if opened:
+                try:
+                    self.f.close()
+                except OSError as e:
+                    self.failure = self.failure or e
+                self.f = None
+            if kind == _ABORT:
+                self.failure = self.failure or message[1]
+            elif self.failure is None:
+                try:
+                    os.utime(part_path(self.path), ns=(self.st.st_atime_ns, self.st.st_mtime_ns))
+                    os.replace(part_path(self.path), self.path)
+                except OSError as e:
+                    self.failure = e
+
+            if self.failure is None:
+                self.done.append(self.item)
+                self.placed = True
+                if self.on_done is not None:
+                    self.on_done(self.name, self.item, self.st, message[1])
+                if trace.ENABLED:
+                    trace.file_done(self.start)
+                return
+            self.failed.append((self.item, self.failure))
+            if opened:
+                # Never leave a truncated track behind.
+                try:
+                    part_path(self.path).unlink()
+                except OSError:
+                    pass
+            if isinstance(self.failure, OSError) and self.failure.errno in _DEVICE_ERRORS and self.error is None:
+                self.error = self.failure
+                print(f"\033[91mStopped writing to {self.name}: {self.failure}\033[0m")
+
+    def put(self, message):
+        """Queues a message; files for a writer that died are failed right away instead."""
+        if self.dead is not None and message is not None:
+            if message[0] == _OPEN:
+                self.failed.append((message[1], self.dead))
+            return
+        self.queue.put(message)
+
+
+def fan_out_copy(items: Iterable[Tuple[Any, Path, Dict[str, str]]], targets: Dict[str, Path],
+                 chunk_size: int = FANOUT_CHUNK_SIZE,
+                 buffer_bytes: int = DEFAULT_BUFFER_BYTES,
+                 hashes: Optional[Dict[Any, dict]] = None,
+                 on_done: Optional[Callable[[str, Any, os.stat_result, Optional[dict]], None]] = None,
+                 reserve: Iterable[str] = ()) -> Dict[str, Tuple[list, list]]:
+    """
+    Copies every (item, source path, {device: relative target}) to the
+    target directory of each listed device. Each source is read once in
+    chunks that are shared by the writers of all its devices. The reader
+    only waits for a device once that device has buffer_bytes queued.
+    A device that runs full or disappears, or whose writer fails in any
+    other way (e.g. in on_done), is dropped; the others go on.
+    Modification times are preserved. If hashes is a dict, the checksum
+    entry of every source read in full is stored there by item.
+    on_done(device, item, stat, checksum entry or None) is called from the
+    device's writer thread for every file in place. On the devices named
+    in reserve every file is preallocated to its size before it is written
+    (see layout).
+    Returns {device: (done items, [(item, exception)])}.
+    """
+    writers: Dict[str, _DeviceWriter] = {}
+    reserve = set(reserve)
+    try:
+        for position, (device, target) in enumerate(targets.items()):
+            progress = tqdm(total=0, desc=f"Copying to {device}", position=position,
+                            unit="B", unit_scale=True, unit_divisor=1024)
+            writers[device] = _DeviceWriter(device, target, progress, buffer_bytes, chunk_size, on_done,
+                                            device in reserve)
+
+        for item, source, mapping in items:
+            receivers = [(writers[device], rel_target) for device, rel_target in mapping.items()]
+            try:
+                fsrc = open(source, "rb")
+            except OSError as e:
+                # Nothing to write: report the file as failed without creating it on any iPod.
+                for writer, _ in receivers:
+                    writer.failed.append((item, e))
+                continue
+
+            with fsrc:
+                st = os.fstat(fsrc.fileno())
+                for writer, rel_target in receivers:
+                    if writer.dead is None:
+                        writer.progress.total += st.st_size
+                    writer.put((_OPEN, item, rel_target, st))
+                hasher = ContentHasher() if hashes is not None else None
+                try:
+                    while True:
+                        chunk = fsrc.read(chunk_size)
+                        if not chunk:
+                            break
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        for writer, _ in receivers:
+                            if writer.error is None:
+                                writer.put((_DATA, chunk))
+                except OSError as e:
+                    for writer, _ in receivers:
+                        writer.put((_ABORT, e))
+                    continue
+                checksum = None
+                if hasher is not None:
+                    checksum = hashes[item] = hasher.entry()
+            for writer, _ in receivers:
+                writer.put((_CLOSE, checksum))
+    finally:
+        for writer in writers.values():
+            writer.put(None)
+        for writer in writers.values():
+            writer.thread.join()
+            writer.progress.close()
+
+    return {device: (writer.done, writer.failed) for device, writer in writers.items()}
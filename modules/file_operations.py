@@ -5,7 +5,14 @@
  File        : file_operations.py
  Description : Provides file operations such as copying files with 
                progress tracking via tqdm, and deleting files and 
-               empty directories.
+               empty directories in a single pass. Copies run
+               in-process using kernel-side copies where available,
+               with a bulk rsync call as an opt-in fallback.
+               Native copies can hash the content in the same
+               pass for the device's checksum store. Files are
+               written under a temporary name and renamed into
+               place when complete. A layout mode writes album by
+               album into preallocated files for FAT32.
                This submodule is part of the iPod Manager project.
  Author      : blackbunt
  Created     : 2025-01-26
@@ -15,48 +22,484 @@
 """
 
 import os
+import time
+import errno
+import tempfile
 import subprocess
+from itertools import groupby
 from pathlib import Path
 from tqdm import tqdm
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from modules.scheduler import run_transfers, prefetch, DEFAULT_MAX_INFLIGHT_BYTES
+from modules.checksums import ContentHasher
+from modules.journal import part_path
+from modules.layout import layout_key, preallocate
+from modules import trace
 
-def perform_file_operation(file_list: List[Path], target: str, mode: str):
-    """Perform file operations (copy or delete) with tqdm progress tracking."""
-    total_size = sum(file.stat().st_size for file in file_list) if mode == "copy" else len(file_list)
+COPY_BUFFER_SIZE = 1024 * 1024  # 1 MiB
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024  # 64 MiB per copy_file_range/sendfile call
+DELETE_PROGRESS_BATCH = 64  # files per progress bar update when deleting
+LAYOUT_BATCH_FILES = 64  # files of an album created (and kept open) at once in the layout mode
+
+# Errors meaning "this kernel copy is not possible here", not "the copy failed".
+_KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Remember per process which kernel-side copies work so we only probe once.
+_kernel_copy_support = {
+    "copy_file_range": hasattr(os, "copy_file_range"),
+    "sendfile": hasattr(os, "sendfile"),
+}
+
+def _kernel_copy(src_fd: int, dst_fd: int, size: int, progress_callback: Optional[Callable[[int], None]]) -> int:
+    """
+    Copies data between two file descriptors without going through user space.
+    Returns the number of bytes copied, which is less than size if no
+    kernel-side copy is available and the caller has to finish the job.
+    """
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        if not _kernel_copy_support[method]:
+            continue
+        try:
+            while copied < size:
+                count = min(KERNEL_COPY_CHUNK, size - copied)
+                if method == "copy_file_range":
+                    sent = os.copy_file_range(src_fd, dst_fd, count)
+                else:
+                    sent = os.sendfile(dst_fd, src_fd, None, count)
+                if sent == 0:
+                    break
+                copied += sent
+                if progress_callback:
+                    progress_callback(sent)
+            return copied
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+            # Only give up on the method for good if it failed right away.
+            if copied == 0:
+                _kernel_copy_support[method] = False
+    return copied
+
+def _copy_data(fsrc, fdst, size: int, progress_callback: Optional[Callable[[int], None]] = None,
+               hasher: Optional[ContentHasher] = None):
+    """Copies the content of an open file to another, by the kernel unless it has to be hashed."""
+    copied = 0
+    if hasher is None:
+        copied = _kernel_copy(fsrc.fileno(), fdst.fileno(), size, progress_callback)
+    if copied < size:
+        fsrc.seek(copied)
+        fdst.seek(copied)
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            n = fsrc.readinto(buffer)
+            if not n:
+                break
+            if hasher is not None:
+                hasher.update(view[:n])
+            fdst.write(view[:n])
+            if progress_callback:
+                progress_callback(n)
+
+def copy_file(source: Path, target: Path, st: Optional[os.stat_result] = None,
+              progress_callback: Optional[Callable[[int], None]] = None,
+              hasher: Optional[ContentHasher] = None):
+    """
+    Copies a single file in-process and preserves its modification time.
+    The copy is written under a temporary name and renamed to target once
+    complete, so an interrupted copy never leaves a truncated track.
+    With a hasher the data goes through user space and is hashed on its
+    way to the target instead of being copied by the kernel.
+    """
+    if st is None:
+        st = os.stat(source)
+
+    partial = part_path(Path(target))
+    try:
+        with open(source, "rb") as fsrc, open(partial, "wb") as fdst:
+            _copy_data(fsrc, fdst, st.st_size, progress_callback, hasher)
+
+        os.utime(partial, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(partial, target)
+    except BaseException:
+        # Also on Ctrl+C: the journal does not know this file, so it is copied again.
+        try:
+            os.unlink(partial)
+        except OSError:
+            pass
+        raise
+
+def _plan_copy(file_list: Iterable, target: str, source_root: Optional[Path]) -> Iterator[tuple]:
+    """
+    Lazily resolves source root, target path and stat result for every item.
+    Items are source paths (kept relative to the source root) or explicit
+    (source path, relative target path) pairs, which get no source root.
+    Every file is stat'ed exactly once; the result is reused for the progress
+    total, the copy itself and restoring the modification time.
+    """
+    for item in file_list:
+        if isinstance(item, tuple):
+            file, relative_path = item
+            root = None
+        else:
+            file = item
+            root = Path(source_root) if source_root is not None else file.parents[2]
+            relative_path = file.relative_to(root)
+        try:
+            st = file.stat()
+        except OSError as e:
+            print(f"\033[91mError copying {file.name}: {e}\033[0m")
+            continue
+        yield item, file, root, Path(target) / relative_path, st
+
+def _copy_native(jobs, progress, workers: Optional[int] = None,
+                 max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES,
+                 hashes: Optional[Dict[str, dict]] = None, target: Optional[str] = None,
+                 on_done: Optional[Callable[[object, os.stat_result, Optional[dict]], None]] = None) -> list:
+    """
+    Copies the planned files with the in-process copy engine on the transfer
+    scheduler. With hashes, the checksum entry of every copied file is
+    stored there under its path relative to target. on_done(item, stat,
+    checksum entry or None) is called from the copying thread for every
+    file in place.
+    """
+    created_dirs = set()
+
+    def sized_jobs():
+        for job in jobs:
+            parent = job[3].parent
+            if parent not in created_dirs:
+                parent.mkdir(parents=True, exist_ok=True)
+                created_dirs.add(parent)
+            yield job, job[4].st_size
+
+    def transfer(job, progress_callback):
+        item, file, _, target_file, st = job
+        entry = None
+        if hashes is None:
+            copy_file(file, target_file, st, progress_callback)
+        else:
+            hasher = ContentHasher()
+            copy_file(file, target_file, st, progress_callback, hasher)
+            entry = hashes[target_file.relative_to(target).as_posix()] = hasher.entry()
+        if on_done is not None:
+            on_done(item, st, entry)
+
+    done, failed = run_transfers(
+        sized_jobs(), transfer, progress,
+        max_workers=workers, max_inflight_bytes=max_inflight_bytes,
+    )
+    for job, error in failed:
+        print(f"\033[91mError copying {job[1].name}: {error}\033[0m")
+    return [job[0] for job in done]
+
+def _copy_album(jobs: list, progress, hashes: Optional[Dict[str, dict]], target: Optional[str],
+                on_done) -> list:
+    """
+    Copies the files of one album folder for the layout mode: first every
+    file is created under its temporary name and preallocated, then the
+    data is written one file after the other, then all are renamed into
+    place. The files are kept open throughout, as FAT gives back the
+    preallocated clusters of a file closed before it is written.
+    """
+    done = []
+    opened = []
+    try:
+        for job in jobs:
+            partial = part_path(job[3])
+            try:
+                fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            except OSError as e:
+                print(f"\033[91mError copying {job[1].name}: {e}\033[0m")
+                progress.update(job[4].st_size)
+                continue
+            except BaseException:
+                # Interrupted right after the file was created.
+                try:
+                    os.unlink(partial)
+                except OSError:
+                    pass
+                raise
+            opened.append([job, partial, fd, None])
+            try:
+                preallocate(fd, job[4].st_size)
+            except OSError as e:
+                opened[-1][3] = e
+
+        written = []
+        timed = trace.ENABLED
+        for handle in opened:
+            job, partial, fd, failure = handle
+            item, file, _, target_file, st = job
+            start = time.perf_counter_ns() if timed else 0
+            hasher = ContentHasher() if hashes is not None else None
+            try:
+                if failure is not None:
+                    raise failure
+                with open(file, "rb") as fsrc, os.fdopen(os.dup(fd), "wb") as fdst:
+                    _copy_data(fsrc, fdst, st.st_size, progress.update, hasher)
+                os.utime(fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+            except OSError as e:
+                print(f"\033[91mError copying {file.name}: {e}\033[0m")
+                continue
+            written.append((handle, hasher))
+            if timed:
+                trace.file_done(start)
+
+        for handle, hasher in written:
+            job, partial, fd, _ = handle
+            try:
+                os.replace(partial, job[3])
+            except OSError as e:
+                print(f"\033[91mError copying {job[1].name}: {e}\033[0m")
+                continue
+            handle[2] = None
+            os.close(fd)
+            entry = None
+            if hasher is not None:
+                entry = hashes[job[3].relative_to(target).as_posix()] = hasher.entry()
+            done.append(job[0])
+            if on_done is not None:
+                on_done(job[0], job[4], entry)
+    finally:
+        # Also on Ctrl+C: files not renamed yet are not journaled, so they are copied again.
+        for job, partial, fd, _ in opened:
+            if fd is not None:
+                os.close(fd)
+                try:
+                    os.unlink(partial)
+                except OSError:
+                    pass
+    return done
+
+def _copy_layout(jobs, progress, hashes: Optional[Dict[str, dict]] = None, target: Optional[str] = None,
+                 on_done=None) -> list:
+    """
+    Copies the planned files strictly serially, album by album in playback
+    order (see layout), so each album ends up in one contiguous run on a
+    FAT file system instead of being interleaved with other writes. The
+    plan is collected in full before the first file is written.
+    """
+    done = []
+    ordered = sorted(jobs, key=lambda job: layout_key(job[3]))
+    for parent, album in groupby(ordered, key=lambda job: job[3].parent):
+        album = list(album)
+        try:
+            parent.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            for job in album:
+                print(f"\033[91mError copying {job[1].name}: {e}\033[0m")
+            continue
+        for position in range(0, len(album), LAYOUT_BATCH_FILES):
+            done.extend(_copy_album(album[position:position + LAYOUT_BATCH_FILES], progress, hashes, target,
+                                    on_done))
+    return done
+
+def _copy_rsync(jobs, target: str, progress, hashes: Optional[Dict[str, dict]] = None, on_done=None) -> list:
+    """
+    Copies the planned files with one bulk rsync --files-from call per source
+    root. rsync cannot rename, so explicitly mapped files are copied natively
+    (and hashed, if hashes is given); rsync copies are never hashed. rsync
+    writes to temporary names itself; on_done is called as it reports files.
+    """
+    done = []
+    by_root: Dict[Path, list] = {}
+    for job in jobs:
+        by_root.setdefault(job[2], []).append(job)
+
+    if None in by_root:
+        done.extend(_copy_native(by_root.pop(None), progress, workers=1, hashes=hashes, target=target,
+                                 on_done=on_done))
+
+    for root, root_jobs in by_root.items():
+        pending = {job[1].relative_to(root).as_posix(): job for job in root_jobs}
+
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".files") as list_file:
+            list_file.write("\0".join(pending))
+            list_file.flush()
+
+            process = subprocess.Popen(
+                ["rsync", "-ah", "--from0", f"--files-from={list_file.name}",
+                 "--out-format=%n", f"{root}/", f"{target}/"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            for line in process.stdout:
+                job = pending.pop(line.rstrip("\n"), None)
+                if job is not None:
+                    done.append(job[0])
+                    progress.update(job[4].st_size)
+                    if on_done is not None:
+                        on_done(job[0], job[4], None)
+            stderr = process.stderr.read()
+            process.wait()
+
+        if process.returncode != 0:
+            print(f"\033[91mError copying files with rsync: {stderr}\033[0m")
+        else:
+            # rsync does not report files it skipped because they were up to date.
+            for job in pending.values():
+                done.append(job[0])
+                progress.update(job[4].st_size)
+                if on_done is not None:
+                    on_done(job[0], job[4], None)
+    return done
+
+def perform_file_operation(file_list: Iterable[Path], target: str, mode: str,
+                           source_root: Optional[Path] = None, engine: str = "native",
+                           workers: Optional[int] = None,
+                           max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES,
+                           hashes: Optional[Dict[str, dict]] = None, on_done=None, layout: bool = False) -> list:
+    """
+    Perform file operations (copy or delete) with tqdm progress tracking.
+    For copies file_list may be a lazy generator (e.g. encoded files as the
+    transcoder finishes them); the progress total grows while it is
+    consumed. Library copies and syncs pass a finished plan, as the free
+    space is checked before anything is written (see planner).
+    Copied files keep their path relative to source_root (defaults to the
+    {artist}/{album}/{track} layout) unless given as (source, relative
+    target) pairs. The "native" engine copies in-process,
+    the "rsync" engine hands the whole list to a single rsync call.
+    Native copies run on the transfer scheduler; workers=None lets it pick
+    the number of parallel writers, workers=1 copies strictly serially.
+    If hashes is a dict, copies are hashed while they are written and their
+    checksum entries stored there by relative target path (see checksums).
+    on_done(item, stat, checksum entry or None) is called for every copied
+    file once it is in place (e.g. to journal it, see journal).
+    layout=True makes the native engine write album by album in playback
+    order into preallocated files, one file at a time (see _copy_layout).
+    Returns the items of file_list processed successfully.
+    """
+    done = []
 
     if mode == "copy":
-        with tqdm(total=total_size, desc="Copying songs", unit="MB", unit_scale=True) as progress:
-            for file in file_list:
-                relative_path = file.relative_to(file.parents[2])
-                target_file = Path(target) / relative_path
-                target_file.parent.mkdir(parents=True, exist_ok=True)
-
-                result = subprocess.run(
-                    ["rsync", "-ah", str(file), str(target_file)],
-                    stderr=subprocess.PIPE,
-                    stdout=subprocess.PIPE
-                )
-
-                if result.returncode != 0:
-                    print(f"\033[91mError copying {file.name}: {result.stderr.decode()}\033[0m")
-                progress.update(file.stat().st_size)
+        with tqdm(total=0, desc="Copying songs", unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            def grow_total(job):
+                progress.total += job[4].st_size
+
+            # Files are stat'ed on a background thread; copying starts with the first one.
+            jobs = prefetch(_plan_copy(file_list, target, source_root), on_item=grow_total)
+            if engine == "rsync":
+                done = _copy_rsync(list(jobs), target, progress, hashes, on_done)
+            elif engine == "native" and layout:
+                done = _copy_layout(jobs, progress, hashes, target, on_done)
+            elif engine == "native":
+                done = _copy_native(jobs, progress, workers, max_inflight_bytes, hashes, target, on_done)
+            else:
+                raise ValueError(f"Unknown copy engine: {engine}")
     elif mode == "delete":
-        with tqdm(total=total_size, desc="Deleting songs", unit="songs") as progress:
-            for file in file_list:
-                result = subprocess.run(
-                    ["rm", str(file)],
-                    stderr=subprocess.PIPE,
-                    stdout=subprocess.PIPE
-                )
-
-                if result.returncode != 0:
-                    print(f"\033[91mError deleting {file.name}: {result.stderr.decode()}\033[0m")
-                progress.update(1)
-
-def remove_empty_directories(directory: Path):
-    """Recursively remove empty directories."""
-    for root, dirs, _ in os.walk(directory, topdown=False):
-        for d in dirs:
-            dir_path = Path(root) / d
-            if not any(dir_path.iterdir()):
-                dir_path.rmdir()
\ No newline at end of file
+        total = len(file_list) if hasattr(file_list, "__len__") else None
+        with tqdm(total=total, desc="Deleting songs", unit="songs") as progress:
+            done, failed = delete_files(file_list, progress)
+        for path, error in failed:
+            print(f"\033[91mError deleting {Path(path).name}: {error}\033[0m")
+    return done
+
+class _BatchedProgress:
+    """Forwards progress to tqdm in batches instead of once per file."""
+
+    def __init__(self, progress, batch_size: int = DELETE_PROGRESS_BATCH):
+        self.progress = progress
+        self.batch_size = batch_size
+        self.pending = 0
+
+    def add(self, count: int = 1):
+        self.pending += count
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending and self.progress is not None:
+            self.progress.update(self.pending)
+        self.pending = 0
+
+def delete_files(file_list: Iterable[Path], progress=None,
+                 prune_root: Optional[Path] = None) -> Tuple[List[Path], List[Tuple[Path, OSError]]]:
+    """
+    Deletes the given files in-process and prunes the directories they leave
+    empty, deepest first, up to but excluding prune_root (without prune_root
+    only the files' own directories are pruned). Files that are already
+    gone count as deleted.
+    Returns the deleted files and a list of (path, error) for failures;
+    reporting them is up to the caller, as with delete_tree.
+    """
+    done, failed = [], []
+    parents = set()
+    batch = _BatchedProgress(progress)
+    timed = trace.ENABLED
+
+    for file in file_list:
+        start = time.perf_counter_ns() if timed else 0
+        try:
+            os.unlink(file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            failed.append((file, e))
+            batch.add()
+            continue
+        done.append(file)
+        parents.add(os.path.normpath(os.path.dirname(file)))
+        batch.add()
+        if timed:
+            trace.file_done(start)
+    batch.flush()
+
+    # Prune bottom-up; a directory that still has content simply stays.
+    stop = os.path.normpath(prune_root) if prune_root is not None else None
+    for directory in sorted(parents, key=lambda d: d.count(os.sep), reverse=True):
+        while directory and directory != stop:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            if stop is None or not directory.startswith(stop + os.sep):
+                break
+            directory = os.path.dirname(directory)
+    return done, failed
+
+def delete_tree(directory: Path, progress=None) -> Tuple[int, List[Tuple[str, OSError]]]:
+    """
+    Deletes a directory tree in a single bottom-up os.scandir traversal:
+    files are unlinked while scanning and each directory is removed right
+    after its children. Returns the number of deleted files and the failures.
+    """
+    deleted = 0
+    failed = []
+    batch = _BatchedProgress(progress)
+    timed = trace.ENABLED
+
+    def _delete(path: str) -> bool:
+        nonlocal deleted
+        empty = True
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            empty = _delete(entry.path) and empty
+                            continue
+                        start = time.perf_counter_ns() if timed else 0
+                        os.unlink(entry.path)
+                    except OSError as e:
+                        failed.append((entry.path, e))
+                        empty = False
+                        continue
+                    deleted += 1
+                    batch.add()
+                    if timed:
+                        trace.file_done(start)
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if empty:
+                failed.append((path, e))
+            return False
+        return True
+
+    _delete(str(directory))
+    batch.flush()
+    return deleted, failed
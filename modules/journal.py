@@ -0,0 +1,183 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : journal.py
+ Description : Keeps a transfer journal on the iPod so an interrupted
+               copy or sync (cable pulled, Ctrl+C) resumes where it
+               stopped. Files are written under a temporary name and
+               renamed into place once complete; finished files are
+               recorded in batches, each after one flush of the
+               iPod's file system, so every file in the journal is
+               known to be complete on the device.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import json
+import ctypes
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from modules.manifest import get_state_dir
+
+JOURNAL_FILE = "transfer-journal.jsonl"
+JOURNAL_VERSION = 1
+# Suffix of files still being written; they are renamed into place when complete.
+PART_SUFFIX = ".ipm-part"
+# A batch is committed (file system flushed, then recorded) after this many files or bytes.
+JOURNAL_BATCH_FILES = 256
+JOURNAL_BATCH_BYTES = 256 * 1024 * 1024  # 256 MiB, a few seconds of writing to an iPod
+
+_libc = None
+
+
+def part_path(target: Path) -> Path:
+    """Returns the temporary name a file is written under before it is renamed to target."""
+    return target.with_name(target.name + PART_SUFFIX)
+
+def syncfs(path: Path):
+    """Flushes the file system holding path (syncfs(2)); falls back to a global sync."""
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if not hasattr(_libc, "syncfs") or _libc.syncfs(fd) != 0:
+            os.sync()
+    finally:
+        os.close(fd)
+
+def get_journal_path(ipod_path: Path) -> Path:
+    return get_state_dir(ipod_path) / JOURNAL_FILE
+
+def load_journal(ipod_path: Path) -> Dict[str, dict]:
+    """Reads the journal of an interrupted transfer: {device relative path: record}."""
+    records = {}
+    try:
+        with get_journal_path(ipod_path).open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # a batch torn by the interruption; it was not committed
+                if record.get("version", JOURNAL_VERSION) != JOURNAL_VERSION:
+                    return {}
+                if "path" in record:
+                    records[record["path"]] = record
+    except FileNotFoundError:
+        pass
+    return records
+
+def clear_journal(ipod_path: Path):
+    """Removes the journal once the manifest records the transfer."""
+    get_journal_path(ipod_path).unlink(missing_ok=True)
+
+
+class TransferJournal:
+    """The journal of the transfer to one iPod; record() may be called from any thread."""
+
+    def __init__(self, ipod_path: Path, batch_files: int = JOURNAL_BATCH_FILES,
+                 batch_bytes: int = JOURNAL_BATCH_BYTES):
+        self.ipod_path = Path(ipod_path)
+        self.path = get_journal_path(ipod_path)
+        self.batch_files = batch_files
+        self.batch_bytes = batch_bytes
+        self.completed = load_journal(ipod_path)
+        self.pending: List[dict] = []
+        self.pending_bytes = 0
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+
+    def resume(self, transfers: list) -> Tuple[list, List[str], Dict[str, dict]]:
+        """
+        Splits planned (source, device path, entry) transfers into those
+        still to do and those an interrupted run already completed, i.e.
+        recorded for the same source and still on the iPod in full.
+        Returns the remaining transfers, the completed device paths and
+        their checksum entries. Partial files a killed run left behind in
+        the planned album folders are removed first.
+        """
+        self.remove_stale_parts(transfers)
+        if not self.completed:
+            return transfers, [], {}
+        music_dir = self.ipod_path / "Music"
+        remaining, done, hashes = [], [], {}
+        for transfer in transfers:
+            device_rel, entry = transfer[1], transfer[2]
+            record = self.completed.get(device_rel)
+            if (record is not None and record["size"] == entry["size"] and record["mtime"] == entry["mtime"]
+                    and record.get("transcode") == entry.get("transcode")):
+                try:
+                    complete = os.stat(music_dir / device_rel).st_size == record["device_size"]
+                except OSError:
+                    complete = False
+                if complete:
+                    done.append(device_rel)
+                    if record.get("checksum"):
+                        hashes[device_rel] = record["checksum"]
+                    continue
+            remaining.append(transfer)
+        if done:
+            print(f"Resuming an interrupted transfer: {len(done)} files were already copied.")
+        return remaining, done, hashes
+
+    def remove_stale_parts(self, transfers: list) -> int:
+        """
+        Deletes the *.ipm-part files in the album folders of the planned
+        transfers. Only a run that was killed or lost the iPod leaves them;
+        they are in no manifest and would take space for good.
+        """
+        music_dir = self.ipod_path / "Music"
+        removed = 0
+        for album in {os.path.dirname(transfer[1]) for transfer in transfers}:
+            try:
+                entries = os.listdir(music_dir / album)
+            except OSError:
+                continue
+            for name in entries:
+                if name.endswith(PART_SUFFIX):
+                    try:
+                        os.unlink(music_dir / album / name)
+                        removed += 1
+                    except OSError:
+                        pass
+        if removed:
+            print(f"Removed {removed} partial files left by an interrupted transfer.")
+        return removed
+
+    def record(self, device_rel: str, entry: dict, device_size: int, checksum: Optional[dict] = None):
+        """Notes a file placed on the iPod; batches are committed as they fill up."""
+        record = {"path": device_rel, "size": entry["size"], "mtime": entry["mtime"], "device_size": device_size}
+        if "transcode" in entry:
+            record["transcode"] = entry["transcode"]
+        if checksum is not None:
+            record["checksum"] = checksum
+        with self.lock:
+            self.pending.append(record)
+            self.pending_bytes += device_size
+            full = len(self.pending) >= self.batch_files or self.pending_bytes >= self.batch_bytes
+        if full:
+            self.commit()
+
+    def commit(self):
+        """
+        Flushes the iPod's file system once, then appends the pending
+        records. A record is only written once its file is on the device.
+        """
+        with self.commit_lock:
+            with self.lock:
+                batch, self.pending, self.pending_bytes = self.pending, [], 0
+            if not batch:
+                return
+            syncfs(self.ipod_path)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                if f.tell() == 0:
+                    f.write(json.dumps({"version": JOURNAL_VERSION}) + "\n")
+                f.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in batch))
+            self.completed.update((record["path"], record) for record in batch)
@@ -0,0 +1,171 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : layout.py
+ Description : Helps the copy engine lay music out on the iPod's
+               FAT32 file system the way it is played: album by
+               album in track order, each file preallocated to its
+               final size so its clusters are contiguous. Also
+               reports how fragmented the music on an iPod is, from
+               the extents of the files in its manifest, and whether
+               rewriting it in full would pay off.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import re
+import errno
+import fcntl
+import ctypes
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# fallocate(2) mode: allocate clusters without growing the file. vfat turns a
+# plain fallocate (and so posix_fallocate) into an expanding truncate that
+# writes zeros first, which would write every file twice.
+FALLOC_FL_KEEP_SIZE = 0x01
+# Errors meaning "the file system cannot preallocate", not "the copy failed".
+_PREALLOCATE_UNSUPPORTED = {errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# FIEMAP ioctl (linux/fiemap.h): a header followed by extent records.
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_EXTENT_LAST = 0x0001
+_FIEMAP_HEADER = struct.Struct("=QQLLLL")  # start, length, flags, mapped extents, extent count, reserved
+_FIEMAP_EXTENT = struct.Struct("=QQQQQLLLL")  # logical, physical, length, 2 reserved, flags, 3 reserved
+FIEMAP_BATCH = 64  # extents asked for per ioctl
+_FIEMAP_UNSUPPORTED = _PREALLOCATE_UNSUPPORTED | {errno.ENOTTY}
+
+# A rewrite pays off once this share of the files is split, or of the albums is scattered.
+REWRITE_FRAGMENTED_SHARE = 0.10
+REWRITE_SCATTERED_SHARE = 0.25
+# The next track of an album still counts as following the previous one across a gap this small (a cover, say).
+ALBUM_GAP_BYTES = 1024 * 1024
+
+_fallocate = None
+_preallocate_support = True
+
+
+def layout_key(path) -> tuple:
+    """
+    Sorts files album by album and within an album in playback order:
+    numbers in names compare by value, so "2 Title" comes before "10 Title".
+    """
+    parent, name = os.path.split(str(path))
+    return tuple(_natural(part) for part in parent.split(os.sep)), _natural(name)
+
+def _natural(text: str) -> tuple:
+    return tuple(int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", text))
+
+def preallocate(fd: int, size: int) -> bool:
+    """
+    Reserves size bytes of clusters for an open file before it is written,
+    so the file system can place it in one piece. Returns False where the
+    file system cannot preallocate; running out of space raises OSError.
+    """
+    global _fallocate, _preallocate_support
+    if not _preallocate_support or size <= 0:
+        return False
+    if _fallocate is None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        _fallocate = getattr(libc, "fallocate64", None) or getattr(libc, "fallocate", None)
+        if _fallocate is None:
+            _preallocate_support = False
+            return False
+        _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in _PREALLOCATE_UNSUPPORTED:
+        _preallocate_support = False
+        return False
+    raise OSError(error, os.strerror(error))
+
+def file_extents(path: Path) -> Optional[List[Tuple[int, int, int]]]:
+    """
+    Returns the (logical, physical, length) extents of a file, neighbouring
+    extents merged; None if the file system does not report them.
+    """
+    extents: List[Tuple[int, int, int]] = []
+    start = 0
+    with open(path, "rb") as f:
+        while True:
+            request = bytearray(_FIEMAP_HEADER.size + FIEMAP_BATCH * _FIEMAP_EXTENT.size)
+            _FIEMAP_HEADER.pack_into(request, 0, start, 2 ** 64 - 1 - start, 0, 0, FIEMAP_BATCH, 0)
+            try:
+                fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+            except OSError as e:
+                if e.errno in _FIEMAP_UNSUPPORTED:
+                    return None
+                raise
+            mapped = _FIEMAP_HEADER.unpack_from(request)[3]
+            last = False
+            for index in range(mapped):
+                logical, physical, length, _, _, flags, _, _, _ = _FIEMAP_EXTENT.unpack_from(
+                    request, _FIEMAP_HEADER.size + index * _FIEMAP_EXTENT.size)
+                if extents and extents[-1][1] + extents[-1][2] == physical:
+                    extents[-1] = (extents[-1][0], extents[-1][1], extents[-1][2] + length)
+                else:
+                    extents.append((logical, physical, length))
+                start = logical + length
+                last = bool(flags & FIEMAP_EXTENT_LAST)
+            if last or mapped < FIEMAP_BATCH:
+                return extents
+
+def fragmentation_report(ipod_path: Path, files, progress=None) -> Optional[dict]:
+    """
+    Measures the layout of the given files below Music/ (e.g. the
+    manifest): how many are split into several extents, and how many
+    albums are scattered, i.e. their tracks do not follow one another on
+    the device in playback order. Returns None if the file system does not
+    report extents.
+    """
+    music_dir = Path(ipod_path) / "Music"
+    albums: Dict[str, List[str]] = {}
+    for rel_path in files:
+        albums.setdefault(os.path.dirname(rel_path), []).append(rel_path)
+
+    extents_of: Dict[str, List[Tuple[int, int, int]]] = {}
+    for rel_path in sorted(files, key=layout_key):
+        try:
+            extents = file_extents(music_dir / rel_path)
+        except OSError:
+            extents = None  # gone or unreadable; the audit reports those
+        else:
+            if extents is None:
+                return None
+        if extents:
+            extents_of[rel_path] = extents
+        if progress is not None:
+            progress.update(1)
+
+    fragmented = {rel_path: len(extents) for rel_path, extents in extents_of.items() if len(extents) > 1}
+    scattered = []
+    for album, tracks in albums.items():
+        placed = [extents_of[rel_path] for rel_path in sorted(tracks, key=layout_key) if rel_path in extents_of]
+        for previous, current in zip(placed, placed[1:]):
+            end = previous[-1][1] + previous[-1][2]
+            if not 0 <= current[0][1] - end <= ALBUM_GAP_BYTES:
+                scattered.append(album)
+                break
+
+    checked = len(extents_of)
+    multi_track = sum(1 for tracks in albums.values() if len(tracks) > 1)
+    fragmented_share = len(fragmented) / checked if checked else 0.0
+    scattered_share = len(scattered) / multi_track if multi_track else 0.0
+    return {
+        "files": checked,
+        "extents": sum(len(extents) for extents in extents_of.values()),
+        "fragmented": len(fragmented),
+        "fragmented_share": round(fragmented_share, 4),
+        "albums": multi_track,
+        "scattered": len(scattered),
+        "scattered_share": round(scattered_share, 4),
+        "worst": sorted(fragmented.items(), key=lambda item: -item[1])[:10],
+        "rewrite": fragmented_share >= REWRITE_FRAGMENTED_SHARE or scattered_share >= REWRITE_SCATTERED_SHARE,
+    }
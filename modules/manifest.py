@@ -0,0 +1,203 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : manifest.py
+ Description : Keeps a manifest of the music stored on the iPod
+               (relative path, size, mtime and an optional content
+               hash) and diffs it against the local library so only
+               new or changed files need to be transferred.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import json
+import uuid
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_DIR = ".ipod-manager"
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+DEVICE_ID_FILE = "device-id"
+
+# FAT stores modification times with a resolution of two seconds.
+MTIME_TOLERANCE = 2.0
+
+
+def get_state_dir(ipod_path: Path) -> Path:
+    """Returns the directory next to iPod_Control holding the manager's state."""
+    return Path(ipod_path) / MANIFEST_DIR
+
+def get_manifest_path(ipod_path: Path) -> Path:
+    """Returns the path of the manifest on the iPod."""
+    return get_state_dir(ipod_path) / MANIFEST_FILE
+
+def read_device_id(ipod_path: Path) -> Optional[str]:
+    """Returns the identity stored on an iPod without creating one."""
+    try:
+        return (get_state_dir(ipod_path) / DEVICE_ID_FILE).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        return None
+
+def get_device_id(ipod_path: Path) -> str:
+    """
+    Returns the identity of an iPod, a random id stored on the device the
+    first time it is needed. It survives remounts under different paths.
+    """
+    device_id = read_device_id(ipod_path)
+    if device_id:
+        return device_id
+
+    id_path = get_state_dir(ipod_path) / DEVICE_ID_FILE
+    device_id = uuid.uuid4().hex
+    id_path.parent.mkdir(parents=True, exist_ok=True)
+    id_path.write_text(device_id + "\n", encoding="utf-8")
+    return device_id
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Computes the content hash of a file."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(ipod_path: Path) -> Optional[Dict[str, dict]]:
+    """
+    Loads the manifest from the iPod.
+    Returns None if the iPod has no (readable) manifest yet.
+    """
+    manifest_path = get_manifest_path(ipod_path)
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if data.get("version") != MANIFEST_VERSION:
+        return None
+    return data.get("files", {})
+
+def save_manifest(ipod_path: Path, files: Dict[str, dict]):
+    """Atomically writes the manifest to the iPod."""
+    manifest_path = get_manifest_path(ipod_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(".tmp")
+
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": files}, f, separators=(",", ":"))
+    os.replace(tmp_path, manifest_path)
+
+def scan_tree(root: Path) -> Dict[str, dict]:
+    """Scans a music tree and returns {relative path: {"size", "mtime"}}."""
+    root = Path(root)
+    entries = {}
+
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = Path(dirpath) / name
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries[path.relative_to(root).as_posix()] = {
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+            }
+    return entries
+
+def bootstrap_manifest(music_dir: Path, extensions: Optional[Tuple[str, ...]] = None) -> Dict[str, dict]:
+    """
+    Builds a manifest from the files already on the iPod, optionally only
+    from files with the given extensions. Earlier versions copied with
+    rsync -a, which preserves modification times, so the device's size and
+    mtime match the library for every track copied before.
+    """
+    if not Path(music_dir).is_dir():
+        return {}
+    entries = scan_tree(music_dir)
+    if extensions is None:
+        return entries
+    suffixes = tuple(ext.lower() for ext in extensions)
+    return {rel_path: entry for rel_path, entry in entries.items() if rel_path.lower().endswith(suffixes)}
+
+def entry_matches(library_entry: dict, manifest_entry: dict) -> bool:
+    """
+    Checks whether a library file is unchanged compared to the manifest.
+    Entries record the source file's size and mtime and, for transcoded
+    files, the encoder settings they were produced with.
+    """
+    return (
+        library_entry["size"] == manifest_entry.get("size")
+        and abs(library_entry["mtime"] - manifest_entry.get("mtime", 0)) <= MTIME_TOLERANCE
+        and library_entry.get("transcode") == manifest_entry.get("transcode")
+    )
+
+def classify_entry(rel_path: str, entry: dict, manifest: Dict[str, dict], music_dir: Path,
+                   source_dir: Optional[Path] = None, album_exists: Optional[Dict[str, bool]] = None) -> str:
+    """
+    Classifies one library file as "new", "changed" or "unchanged".
+    rel_path is the path on the device; entry["source"] names the library
+    file if it differs (transcoded files). If source_dir is given, files whose size matches but whose mtime differs
+    are hashed and compared against the manifest hash before being marked
+    as changed. album_exists caches the per-album existence checks.
+    """
+    known = manifest.get(rel_path)
+    if known is None:
+        return "new"
+
+    if not entry_matches(entry, known):
+        if (source_dir is not None and known.get("hash")
+                and entry["size"] == known.get("size")
+                and hash_file(Path(source_dir) / entry.get("source", rel_path)) == known["hash"]):
+            known["mtime"] = entry["mtime"]
+        else:
+            return "changed"
+
+    # Trust the manifest per file but make sure the album folder was not
+    # removed behind our back (one stat per album instead of per track).
+    if album_exists is None:
+        album_exists = {}
+    album = os.path.dirname(rel_path)
+    if album not in album_exists:
+        album_exists[album] = (Path(music_dir) / album).is_dir()
+    return "unchanged" if album_exists[album] else "new"
+
+def find_orphans(manifest: Dict[str, dict], library: Dict[str, dict],
+                 prefixes: Optional[List[str]] = None) -> List[str]:
+    """Lists manifest entries missing from the library, only below the given prefixes if set."""
+    if prefixes is None:
+        return sorted(rel_path for rel_path in manifest if rel_path not in library)
+    scope = set(prefixes)
+    return sorted(
+        rel_path for rel_path in manifest
+        if rel_path.split("/", 1)[0] in scope and rel_path not in library
+    )
+
+def update_manifest(manifest: Dict[str, dict], library: Dict[str, dict], rel_paths: List[str],
+                    source_dir: Optional[Path] = None, hashes: Optional[Dict[str, dict]] = None):
+    """
+    Records the given library files as present on the iPod. With source_dir
+    their content hashes are stored too, taken from the checksums the copy
+    computed (hashes) where possible instead of reading the files again.
+    """
+    for rel_path in rel_paths:
+        entry = dict(library[rel_path])
+        if source_dir is not None:
+            if hashes and rel_path in hashes and "transcode" not in entry:
+                entry["hash"] = hashes[rel_path]["hash"]
+            else:
+                entry["hash"] = hash_file(Path(source_dir) / entry.get("source", rel_path))
+        manifest[rel_path] = entry
+
+def remove_from_manifest(manifest: Dict[str, dict], prefixes: List[str]):
+    """Drops every manifest entry below the given top-level directories."""
+    scope = set(prefixes)
+    for rel_path in [p for p in manifest if p.split("/", 1)[0] in scope]:
+        del manifest[rel_path]
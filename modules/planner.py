@@ -0,0 +1,226 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : planner.py
+ Description : Pre-flight capacity planning for copies and syncs.
+               Checks with statvfs whether a selection fits on the
+               iPod, accounting for FAT cluster and directory entry
+               overhead, and picks albums by play count from the
+               device's .scrobbler.log to auto-fill free space.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Kept free for the manifest, the Rockbox database and other small files.
+RESERVE_BYTES = 16 * 1024 * 1024
+# Largest items x capacity-steps table solved exactly; beyond that the greedy solver is used.
+MAX_DP_CELLS = 1_000_000
+DP_STEPS = 1024
+
+
+class SpacePlan(NamedTuple):
+    required: int
+    free: int
+    cluster_size: int
+
+    @property
+    def fits(self) -> bool:
+        return self.required <= self.free
+
+
+def get_device_space(mount: Path) -> Tuple[int, int]:
+    """Returns the free bytes and the cluster size of the filesystem at mount."""
+    st = os.statvfs(mount)
+    # On vfat, f_bsize is the cluster size; f_frsize is the unit of f_bavail.
+    return st.f_bavail * st.f_frsize, st.f_bsize or st.f_frsize
+
+def allocated_size(size: int, cluster_size: int) -> int:
+    """Bytes a file of the given size occupies on disk."""
+    return -(-size // cluster_size) * cluster_size
+
+def fat_entry_size(name: str) -> int:
+    """Directory entry bytes of a file on FAT: one short entry plus long name slots."""
+    return 32 * (1 + -(-len(name) // 13))
+
+def estimate_required(files: Iterable[Tuple[str, int]], music_dir: Path, cluster_size: int,
+                      replaced: Optional[Dict[str, int]] = None) -> int:
+    """
+    Estimates the bytes needed to write the given (device relative path, size)
+    pairs below music_dir. Files replacing an existing copy (replaced maps
+    relative path to the old size) only need the difference. Every directory
+    that gains entries is charged whole clusters for them, new directories
+    one extra cluster.
+    """
+    replaced = replaced or {}
+    required = 0
+    entry_bytes = defaultdict(int)
+    dir_exists = {}
+
+    for rel_path, size in files:
+        required += allocated_size(size, cluster_size)
+        if rel_path in replaced:
+            required -= allocated_size(replaced[rel_path], cluster_size)
+            continue
+
+        parent, name = os.path.split(rel_path)
+        entry_bytes[parent] += fat_entry_size(name)
+        while parent and parent not in dir_exists:
+            dir_exists[parent] = (Path(music_dir) / parent).is_dir()
+            if not dir_exists[parent]:
+                grandparent, dir_name = os.path.split(parent)
+                entry_bytes[grandparent] += fat_entry_size(dir_name)
+                required += cluster_size
+            parent = os.path.dirname(parent)
+
+    for entries in entry_bytes.values():
+        required += allocated_size(entries, cluster_size)
+    return max(required, 0)
+
+def plan_space(files: Iterable[Tuple[str, int]], mount: Path, music_dir: Path,
+               replaced: Optional[Dict[str, int]] = None) -> SpacePlan:
+    """
+    Checks before any I/O whether the given files fit on the device. Nothing
+    to write always fits, even on a device filled up to its reserve.
+    """
+    files = list(files)
+    free, cluster_size = get_device_space(mount)
+    if not files:
+        return SpacePlan(0, free, cluster_size)
+    required = estimate_required(files, music_dir, cluster_size, replaced) + RESERVE_BYTES
+    return SpacePlan(required, free, cluster_size)
+
+def count_plays(log_path: Path) -> Tuple[Dict[Tuple[str, str], int], Dict[str, int]]:
+    """
+    Counts listened plays in a .scrobbler.log per (artist, album) and per
+    artist, with names case-folded for matching against folder names.
+    """
+    from modules.scrobbler_module import parse_scrobbler_log
+
+    album_plays = defaultdict(int)
+    artist_plays = defaultdict(int)
+    if not Path(log_path).exists():
+        return album_plays, artist_plays
+
+    for entry, _ in parse_scrobbler_log(log_path):
+        if entry["rating"] != "L":
+            continue
+        artist = entry["artist"].casefold()
+        album_plays[(artist, entry["album"].casefold())] += 1
+        artist_plays[artist] += 1
+    return album_plays, artist_plays
+
+def group_albums(files: Iterable[Tuple[str, int]], cluster_size: int) -> Dict[str, Tuple[int, List[str]]]:
+    """
+    Groups device relative paths into albums ({artist}/{album}, or the
+    artist itself for loose tracks). Returns {album: (allocated bytes, files)}.
+    """
+    albums: Dict[str, list] = {}
+    for rel_path, size in files:
+        parts = rel_path.split("/")
+        album = "/".join(parts[:2]) if len(parts) > 2 else parts[0]
+        entry = albums.setdefault(album, [0, []])
+        entry[0] += allocated_size(size, cluster_size) + fat_entry_size(parts[-1])
+        entry[1].append(rel_path)
+    return {album: (size + cluster_size, rel_paths) for album, (size, rel_paths) in albums.items()}
+
+def album_values(albums: Iterable[str], album_plays: Dict[Tuple[str, str], int],
+                 artist_plays: Dict[str, int]) -> Dict[str, float]:
+    """
+    Scores albums by their plays. Plays of an artist that match none of its
+    album folders (e.g. differently tagged albums) are spread over its albums.
+    """
+    by_artist = defaultdict(list)
+    for album in albums:
+        by_artist[album.split("/", 1)[0].casefold()].append(album)
+
+    values = {}
+    for artist, artist_albums in by_artist.items():
+        matched = {album: album_plays.get((artist, album.split("/", 1)[-1].casefold()), 0)
+                   for album in artist_albums}
+        unmatched = max(artist_plays.get(artist, 0) - sum(matched.values()), 0)
+        for album, plays in matched.items():
+            values[album] = plays + unmatched / len(artist_albums)
+    return values
+
+def solve_knapsack(items: List[Tuple[str, int, float]], capacity: int) -> List[str]:
+    """
+    Picks items (key, weight, value) maximizing the total value within capacity.
+    Small instances are solved by dynamic programming over capacity rounded to
+    DP_STEPS steps (weights rounded up, so the result always fits); large ones
+    greedily by value density, which is near-optimal when every item is small
+    compared to the capacity, as albums are compared to an iPod.
+    """
+    items = [item for item in items if 0 < item[1] <= capacity and item[2] > 0]
+    if not items or capacity <= 0:
+        return []
+
+    if len(items) * DP_STEPS <= MAX_DP_CELLS:
+        step = -(-capacity // DP_STEPS)
+        slots = capacity // step
+        best = [0.0] * (slots + 1)
+        taken = []
+        for _, weight, value in items:
+            units = -(-weight // step)
+            row = bytearray(slots + 1)
+            for c in range(slots, units - 1, -1):
+                candidate = best[c - units] + value
+                if candidate > best[c]:
+                    best[c] = candidate
+                    row[c] = 1
+            taken.append(row)
+
+        chosen = []
+        c = max(range(slots + 1), key=best.__getitem__)
+        for i in range(len(items) - 1, -1, -1):
+            if taken[i][c]:
+                chosen.append(items[i][0])
+                c -= -(-items[i][1] // step)
+        return chosen[::-1]
+
+    chosen, used = [], 0
+    for key, weight, _ in sorted(items, key=lambda item: item[2] / item[1], reverse=True):
+        if used + weight <= capacity:
+            chosen.append(key)
+            used += weight
+    # Guard against the greedy worst case: one big, valuable item beats many small ones.
+    best_single = max(items, key=lambda item: item[2])
+    picked = set(chosen)
+    if best_single[2] > sum(item[2] for item in items if item[0] in picked):
+        return [best_single[0]]
+    return chosen
+
+def plan_autofill(files: List[Tuple[str, int]], log_path: Path, mount: Path,
+                  fill_unplayed: bool = True) -> Tuple[List[str], SpacePlan]:
+    """
+    Chooses which of the given (device relative path, size) files to copy so
+    that the most played albums fit into the free space of the device.
+    Space left over is filled with unplayed albums in library order.
+    Returns the chosen files and the resulting space plan.
+    """
+    free, cluster_size = get_device_space(mount)
+    capacity = free - RESERVE_BYTES
+    albums = group_albums(files, cluster_size)
+    album_plays, artist_plays = count_plays(log_path)
+    values = album_values(albums, album_plays, artist_plays)
+
+    chosen = solve_knapsack([(album, size, values[album]) for album, (size, _) in albums.items()], capacity)
+    used = sum(albums[album][0] for album in chosen)
+
+    if fill_unplayed:
+        picked = set(chosen)
+        for album, (size, _) in albums.items():
+            if album not in picked and used + size <= capacity:
+                chosen.append(album)
+                used += size
+
+    rel_paths = [rel_path for album in chosen for rel_path in albums[album][1]]
+    return rel_paths, SpacePlan(used + RESERVE_BYTES, free, cluster_size)
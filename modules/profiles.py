@@ -0,0 +1,104 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : profiles.py
+ Description : Loads saved sync profiles for the headless command
+               line mode. A profile is a JSON or TOML file holding
+               the iPod, library and options of a sync, so cron
+               jobs and udev hooks can run without any prompts.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import json
+from pathlib import Path
+from typing import Optional
+
+PROFILE_SUFFIXES = (".json", ".toml")
+
+# Keys a profile may set; command line options take precedence.
+PROFILE_KEYS = {
+    "ipod": (str, list),    # mount point(s) or device id(s) of the iPod(s)
+    "source": str,          # library root, defaults to the XDG music folder
+    "artists": list,        # top-level folders to sync, all if missing
+    "extensions": list,     # file types to sync
+    "verify_hash": bool,
+    "rescan": bool,
+    "autofill": bool,
+    "tagcache": bool,       # build the Rockbox database after syncing
+    "albumart": bool,       # put covers scaled for the iPod into the album folders
+    "layout": bool,         # copy album by album into preallocated files (FAT32)
+    "query": str,           # only sync tracks matching this query, e.g. "genre=jazz"
+    "delete_log": bool,     # delete .scrobbler.log after scrobbling
+    "force": bool,          # unmount even if processes use the iPod
+}
+
+
+def get_config_dir() -> Path:
+    """Returns the configuration directory of the iPod Manager."""
+    base = os.environ.get("XDG_CONFIG_HOME") or str(Path.home() / ".config")
+    return Path(base) / "ipod-manager"
+
+def get_profiles_dir() -> Path:
+    """Returns the directory holding the saved profiles."""
+    return get_config_dir() / "profiles"
+
+def find_profile(name: str) -> Path:
+    """
+    Resolves a profile given as a file path or as the name of a file in the
+    profiles directory (with or without suffix).
+    """
+    path = Path(name).expanduser()
+    if path.is_file():
+        return path
+
+    for suffix in ("",) + PROFILE_SUFFIXES:
+        candidate = get_profiles_dir() / f"{name}{suffix}"
+        if candidate.is_file():
+            return candidate
+    raise FileNotFoundError(f"Profile not found: {name}")
+
+def _read_toml(path: Path) -> dict:
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ValueError("TOML profiles need Python 3.11 or the tomli package; use JSON instead.")
+    with path.open("rb") as f:
+        return tomllib.load(f)
+
+def load_profile(name: Optional[str]) -> dict:
+    """
+    Loads and validates a profile. Returns an empty profile for None.
+    Raises FileNotFoundError or ValueError for missing or invalid profiles.
+    """
+    if name is None:
+        return {}
+
+    path = find_profile(name)
+    try:
+        if path.suffix == ".toml":
+            profile = _read_toml(path)
+        else:
+            with path.open("r", encoding="utf-8") as f:
+                profile = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Cannot read profile {path}: {e}")
+
+    if not isinstance(profile, dict):
+        raise ValueError(f"Profile {path} must hold a table of settings.")
+    for key, value in profile.items():
+        if key not in PROFILE_KEYS:
+            raise ValueError(f"Unknown setting '{key}' in profile {path}.")
+        types = PROFILE_KEYS[key] if isinstance(PROFILE_KEYS[key], tuple) else (PROFILE_KEYS[key],)
+        if not isinstance(value, types):
+            expected = " or ".join(t.__name__ for t in types)
+            raise ValueError(f"Setting '{key}' in profile {path} must be a {expected}.")
+    return profile
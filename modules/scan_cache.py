@@ -0,0 +1,315 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : scan_cache.py
+ Description : Caches the layout of the local music library in a
+               SQLite database on the host. Every directory's mtime
+               is recorded together with its files and
+               subdirectories, so later runs only list directories
+               whose mtime changed. File tags are kept in an
+               indexed catalog and only re-read when a file's size
+               or mtime changes.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# File types synced to the iPod; cover scans, cue sheets and .DS_Store junk are skipped.
+MUSIC_EXTENSIONS = (".flac", ".mp3", ".m4a")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subdirs (
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (parent, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (dir, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS catalog (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    title TEXT COLLATE NOCASE,
+    artist TEXT COLLATE NOCASE,
+    album TEXT COLLATE NOCASE,
+    genre TEXT COLLATE NOCASE,
+    composer TEXT COLLATE NOCASE,
+    comment TEXT COLLATE NOCASE,
+    albumartist TEXT COLLATE NOCASE,
+    grouping TEXT COLLATE NOCASE,
+    year INTEGER,
+    discnumber INTEGER,
+    tracknumber INTEGER,
+    length INTEGER,
+    bitrate INTEGER
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS catalog_artist ON catalog (artist);
+CREATE INDEX IF NOT EXISTS catalog_album ON catalog (album);
+CREATE INDEX IF NOT EXISTS catalog_title ON catalog (title);
+CREATE INDEX IF NOT EXISTS catalog_genre ON catalog (genre);
+CREATE INDEX IF NOT EXISTS catalog_year ON catalog (year);
+-- Replaced by the catalog.
+DROP TABLE IF EXISTS tags;
+"""
+
+# Columns of the catalog holding tags (see modules.tags).
+TAG_COLUMNS = ("title", "artist", "album", "genre", "composer", "comment", "albumartist", "grouping",
+               "year", "discnumber", "tracknumber", "length", "bitrate")
+# Paths per catalog query; SQLite limits the number of parameters.
+CATALOG_QUERY_BATCH = 500
+
+
+def get_cache_dir() -> Path:
+    """Returns the host-side cache directory of the iPod Manager."""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "ipod-manager"
+
+def get_scan_cache_path(source_dir: Path) -> Path:
+    """Returns the scan cache database used for a library root."""
+    key = hashlib.blake2b(str(Path(source_dir).resolve()).encode(), digest_size=8).hexdigest()
+    return get_cache_dir() / f"library-{key}.sqlite"
+
+
+class ScanCache:
+    """
+    Directory-mtime based scan cache for one library root.
+    A directory's mtime changes whenever an entry is added, removed or renamed
+    in it, so unchanged directories are served from the cache without listing
+    them or stat'ing their files. Files rewritten in place (same name) keep the
+    directory mtime; use refresh=True to rescan everything.
+    """
+
+    def __init__(self, source_dir: Path, cache_path: Optional[Path] = None, refresh: bool = False):
+        self.source_dir = Path(source_dir)
+        self.cache_path = Path(cache_path) if cache_path else get_scan_cache_path(source_dir)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Scans may run on a prefetch thread; access is never concurrent.
+        self.conn = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.refresh = refresh
+        self._load()
+
+    def _load(self):
+        """Reads the whole cache into memory; one query per table is cheaper than one per directory."""
+        self.dir_mtimes = dict(self.conn.execute("SELECT path, mtime_ns FROM dirs"))
+        self.subdirs: Dict[str, List[str]] = {}
+        for parent, name in self.conn.execute("SELECT parent, name FROM subdirs"):
+            self.subdirs.setdefault(parent, []).append(name)
+        self.files: Dict[str, Dict[str, tuple]] = {}
+        for directory, name, size, mtime in self.conn.execute("SELECT dir, name, size, mtime FROM files"):
+            self.files.setdefault(directory, {})[name] = (size, mtime)
+        self.dirty = set()
+
+    def close(self):
+        """Writes changed directories back to the database and closes it."""
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flush(self):
+        """Persists every directory rescanned since the last flush in one transaction."""
+        if not self.dirty:
+            return
+        with self.conn:
+            for rel_dir in self.dirty:
+                self.conn.execute("DELETE FROM subdirs WHERE parent = ?", (rel_dir,))
+                self.conn.execute("DELETE FROM files WHERE dir = ?", (rel_dir,))
+                if rel_dir not in self.dir_mtimes:
+                    self.conn.execute("DELETE FROM dirs WHERE path = ?", (rel_dir,))
+                    continue
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO dirs (path, mtime_ns) VALUES (?, ?)",
+                    (rel_dir, self.dir_mtimes[rel_dir]),
+                )
+                self.conn.executemany(
+                    "INSERT INTO subdirs (parent, name) VALUES (?, ?)",
+                    ((rel_dir, name) for name in self.subdirs.get(rel_dir, [])),
+                )
+                self.conn.executemany(
+                    "INSERT INTO files (dir, name, size, mtime) VALUES (?, ?, ?, ?)",
+                    ((rel_dir, name, size, mtime) for name, (size, mtime) in self.files.get(rel_dir, {}).items()),
+                )
+        self.dirty.clear()
+
+    def _forget(self, rel_dir: str):
+        """Drops a vanished directory and everything below it from the cache."""
+        for name in self.subdirs.get(rel_dir, []):
+            self._forget(f"{rel_dir}/{name}" if rel_dir else name)
+        self.dir_mtimes.pop(rel_dir, None)
+        self.subdirs.pop(rel_dir, None)
+        self.files.pop(rel_dir, None)
+        self.dirty.add(rel_dir)
+
+    def _refresh_dir(self, rel_dir: str) -> bool:
+        """Brings one directory up to date. Returns False if it no longer exists or cannot be read."""
+        path = self.source_dir / rel_dir if rel_dir else self.source_dir
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self._forget(rel_dir)
+            return False
+
+        if not self.refresh and self.dir_mtimes.get(rel_dir) == mtime_ns:
+            return True
+
+        subdirs, files = [], {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files[entry.name] = (st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+        except OSError:  # replaced by a file, unreadable or removed meanwhile
+            self._forget(rel_dir)
+            return False
+
+        for name in set(self.subdirs.get(rel_dir, [])) - set(subdirs):
+            self._forget(f"{rel_dir}/{name}" if rel_dir else name)
+
+        self.dir_mtimes[rel_dir] = mtime_ns
+        self.subdirs[rel_dir] = sorted(subdirs)
+        self.files[rel_dir] = files
+        self.dirty.add(rel_dir)
+        return True
+
+    def artists(self) -> List[str]:
+        """Lists the artists (top-level directories) of the library."""
+        self._refresh_dir("")
+        return list(self.subdirs.get("", []))
+
+    def dir_files(self, rel_dir: str) -> Dict[str, tuple]:
+        """Returns {name: (size, mtime)} of all files in one library folder, refreshing it if it changed."""
+        if not self._refresh_dir(rel_dir):
+            return {}
+        return dict(self.files.get(rel_dir, {}))
+
+    def iter_files(self, artists: Optional[List[str]] = None,
+                   extensions: Optional[Iterable[str]] = MUSIC_EXTENSIONS) -> Iterator[Tuple[str, dict]]:
+        """
+        Lazily yields (relative path, {"size", "mtime"}) for every file below the
+        given artists (all artists if None), rescanning changed directories as
+        it goes. Only files with one of the extensions are yielded (all files
+        if extensions is None).
+        """
+        if artists is None:
+            artists = self.artists()
+        suffixes = tuple(ext.lower() for ext in extensions) if extensions is not None else None
+
+        stack = list(reversed(artists))
+        while stack:
+            rel_dir = stack.pop()
+            if not self._refresh_dir(rel_dir):
+                continue
+            for name, (size, mtime) in sorted(self.files.get(rel_dir, {}).items()):
+                if suffixes is None or name.lower().endswith(suffixes):
+                    yield f"{rel_dir}/{name}", {"size": size, "mtime": mtime}
+            stack.extend(f"{rel_dir}/{name}" for name in reversed(self.subdirs.get(rel_dir, [])))
+
+        self.flush()
+
+    def _current(self, rel_paths: Iterable[str]) -> Dict[str, tuple]:
+        """Returns the (size, mtime) of the given files, from the scan where possible."""
+        current = {}
+        for rel_path in rel_paths:
+            directory, _, name = rel_path.rpartition("/")
+            known = self.files.get(directory, {}).get(name)
+            if known is None:
+                try:
+                    st = os.stat(self.source_dir / rel_path)
+                except OSError:
+                    continue
+                known = (st.st_size, st.st_mtime)
+            current[rel_path] = known
+        return current
+
+    def _catalog_files(self, current: Dict[str, tuple], workers: Optional[int] = None) -> List[str]:
+        """Reads the tags (headers only, on a process pool) of the given files into the catalog."""
+        from modules.tags import read_many
+
+        paths = list(current)
+        tags = read_many([self.source_dir / rel_path for rel_path in paths], workers)
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO catalog (path, size, mtime, {', '.join(TAG_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(TAG_COLUMNS) + 3))})",
+                ((rel_path, *current[rel_path], *(tag.get(column) for column in TAG_COLUMNS))
+                 for rel_path, tag in zip(paths, tags)),
+            )
+        return paths
+
+    def read_tags(self, rel_paths: Iterable[str], workers: Optional[int] = None) -> Dict[str, dict]:
+        """
+        Returns {relative path: tags} for the given library files. Tags are
+        served from the catalog while a file's size and mtime are unchanged;
+        the other files are read and cataloged first.
+        """
+        current = self._current(rel_paths)
+        paths = list(current)
+        tags = {}
+        for start in range(0, len(paths), CATALOG_QUERY_BATCH):
+            batch = paths[start:start + CATALOG_QUERY_BATCH]
+            rows = self.conn.execute(
+                f"SELECT path, size, mtime, {', '.join(TAG_COLUMNS)} FROM catalog "
+                f"WHERE path IN ({', '.join('?' * len(batch))})", batch
+            )
+            for rel_path, size, mtime, *values in rows:
+                if current[rel_path] == (size, mtime):
+                    tags[rel_path] = {column: value for column, value in zip(TAG_COLUMNS, values) if value is not None}
+
+        missing = {rel_path: current[rel_path] for rel_path in paths if rel_path not in tags}
+        if missing:
+            self._catalog_files(missing, workers)
+            tags.update(self.read_tags(missing, workers))
+        return tags
+
+    def update_catalog(self, extensions: Optional[Iterable[str]] = MUSIC_EXTENSIONS,
+                       workers: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Brings the catalog in line with the library: only directories whose
+        mtime changed are listed again, only new or changed files are read,
+        and files that are gone are dropped.
+        Returns the number of files read and removed.
+        """
+        files = {rel_path: (entry["size"], entry["mtime"]) for rel_path, entry in self.iter_files(None, extensions)}
+        known = {path: (size, mtime) for path, size, mtime in self.conn.execute("SELECT path, size, mtime FROM catalog")}
+        stale = [path for path in known if path not in files]
+        changed = {rel_path: stat for rel_path, stat in files.items() if known.get(rel_path) != stat}
+        if stale:
+            with self.conn:
+                self.conn.executemany("DELETE FROM catalog WHERE path = ?", ((path,) for path in stale))
+        if changed:
+            self._catalog_files(changed, workers)
+        return len(changed), len(stale)
+
+    def scan(self, artists: Optional[List[str]] = None,
+             extensions: Optional[Iterable[str]] = MUSIC_EXTENSIONS) -> Dict[str, dict]:
+        """Returns {relative path: {"size", "mtime"}} for every matching file below the given artists."""
+        return dict(self.iter_files(artists, extensions))
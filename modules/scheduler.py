@@ -0,0 +1,187 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : scheduler.py
+ Description : Runs file transfers on a bounded thread pool so that
+               reading from the library overlaps with writing to the
+               iPod. The number of writers grows only while it
+               improves throughput, and the bytes in flight are
+               capped to keep memory usage flat. Scans can run
+               ahead on a background thread to feed transfers.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+from modules import trace
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024  # 256 MiB
+
+# How long to measure a worker count before deciding whether to add another,
+# and how much faster the extra worker has to be to be worth keeping.
+SAMPLE_SECONDS = 2.0
+MIN_SPEEDUP = 1.10
+
+
+class _ThroughputTuner:
+    """Adds writers one at a time and stops as soon as one does not pay off."""
+
+    def __init__(self, max_workers: int, adaptive: bool):
+        self.max_workers = max_workers
+        self.workers = 1 if adaptive else max_workers
+        self.growing = adaptive and max_workers > 1
+        self.previous_rate = 0.0
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def sample(self, new_bytes: int):
+        """Accounts transferred bytes and adjusts the worker count once per window."""
+        self.window_bytes += new_bytes
+        if not self.growing:
+            return
+
+        elapsed = time.monotonic() - self.window_start
+        if elapsed < SAMPLE_SECONDS:
+            return
+
+        rate = self.window_bytes / elapsed
+        if self.previous_rate and rate < self.previous_rate * MIN_SPEEDUP:
+            # The last writer did not help (slow flash, iFlash adapters): drop it.
+            self.workers -= 1
+            self.growing = False
+        elif self.workers < self.max_workers:
+            self.previous_rate = rate
+            self.workers += 1
+        else:
+            self.growing = False
+
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+
+def run_transfers(jobs: Iterable[Tuple[Any, int]],
+                  transfer: Callable[[Any, Callable[[int], None]], None],
+                  progress=None,
+                  max_workers: Optional[int] = None,
+                  max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES) -> Tuple[List[Any], List[Tuple[Any, Exception]]]:
+    """
+    Runs transfer(job, progress_callback) for every (job, size) pair.
+    With max_workers=None the number of writers is tuned automatically up to
+    DEFAULT_MAX_WORKERS. A job is only started while the sizes of the running
+    jobs stay within max_inflight_bytes (a single larger job always runs).
+    The tqdm progress bar, if given, is updated from the calling thread.
+    Returns the finished jobs and a list of (job, exception) for failed ones.
+    """
+    tuner = _ThroughputTuner(max_workers or DEFAULT_MAX_WORKERS, adaptive=max_workers is None)
+    if trace.ENABLED:
+        untimed = transfer
+
+        def transfer(job, progress_callback):
+            start = time.perf_counter_ns()
+            untimed(job, progress_callback)
+            trace.file_done(start)
+    lock = threading.Lock()
+    transferred = [0]
+
+    def on_bytes(count: int):
+        with lock:
+            transferred[0] += count
+
+    def collect() -> int:
+        with lock:
+            count, transferred[0] = transferred[0], 0
+        return count
+
+    done, failed = [], []
+    inflight = {}
+    inflight_bytes = 0
+    job_iter = iter(jobs)
+    next_job = next(job_iter, None)
+
+    with ThreadPoolExecutor(max_workers=tuner.max_workers, thread_name_prefix="transfer") as pool:
+        while True:
+            while (next_job is not None and len(inflight) < tuner.workers
+                   and (not inflight or inflight_bytes + next_job[1] <= max_inflight_bytes)):
+                job, size = next_job
+                inflight[pool.submit(transfer, job, on_bytes)] = (job, size)
+                inflight_bytes += size
+                next_job = next(job_iter, None)
+
+            if not inflight:
+                break
+
+            finished, _ = wait(inflight, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, size = inflight.pop(future)
+                inflight_bytes -= size
+                error = future.exception()
+                if error is None:
+                    done.append(job)
+                else:
+                    failed.append((job, error))
+
+            new_bytes = collect()
+            tuner.sample(new_bytes)
+            if progress is not None:
+                progress.update(new_bytes)
+                progress.set_postfix(workers=tuner.workers, refresh=False)
+
+    if progress is not None:
+        progress.update(collect())
+    return done, failed
+
+
+_END = object()
+
+def prefetch(items: Iterable[Any], on_item: Optional[Callable[[Any], None]] = None,
+             buffer_size: int = 4096) -> Iterator[Any]:
+    """
+    Runs a (scanning) generator on a background thread and yields its items
+    as they arrive, keeping at most buffer_size items queued. on_item is
+    called on the background thread for every item, e.g. to grow a progress
+    bar total while the consumer is already transferring.
+    """
+    items_queue: "queue.Queue" = queue.Queue(maxsize=buffer_size)
+    failure = []
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                if on_item is not None:
+                    on_item(item)
+                items_queue.put(item)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            items_queue.put(_END)
+
+    thread = threading.Thread(target=producer, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items_queue.get()
+            if item is _END:
+                break
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue so it can notice the stop.
+        while thread.is_alive():
+            try:
+                items_queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+    if failure:
+        raise failure[0]
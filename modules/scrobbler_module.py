@@ -13,19 +13,181 @@
 """
 import os
 import sys
+import json
+import time
+import hashlib
 import subprocess
 import requests
 from pathlib import Path
 from tqdm import tqdm
 from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
 from InquirerPy import inquirer
+from modules.manifest import get_device_id
+from modules.scan_cache import get_cache_dir
+from modules.profiles import get_config_dir
+from modules import trace
+
+GITHUB_API_URL = "https://api.github.com"
+RB_SCROBBLER_REPO = "blackbunt/rb-scrobbler"
+RELEASE_CACHE_TTL = 6 * 3600  # seconds before release metadata is revalidated
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+LASTFM_API_URL = "https://ws.audioscrobbler.com/2.0/"
+LASTFM_AUTH_URL = "https://www.last.fm/api/auth/"
+LASTFM_BATCH_SIZE = 50  # maximum number of scrobbles per track.scrobble call
+LASTFM_RETRY_ERRORS = {11, 16, 29}  # service offline, temporary error, rate limit exceeded
+MAX_RETRIES = 5
+
+SCROBBLER_LOG_FIELDS = ("artist", "album", "track", "tracknumber", "duration", "rating", "timestamp", "mbid")
+
+def get_latest_version(api_url: str = GITHUB_API_URL, cache_path: Optional[Path] = None,
+                       ttl: float = RELEASE_CACHE_TTL) -> dict:
+    """
+    Fetches the latest version details of rb-scrobbler from GitHub.
+    The answer is cached for ttl seconds; after that it is revalidated with
+    If-None-Match, so an unchanged release costs a 304 without a body.
+    When GitHub cannot be reached, a cached answer of any age is used.
+    """
+    url = f"{api_url}/repos/{RB_SCROBBLER_REPO}/releases/latest"
+    cache_path = Path(cache_path) if cache_path else get_cache_dir() / "rb-scrobbler-release.json"
+    try:
+        with cache_path.open("r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("url") != url:
+            cached = None
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached = None
+
+    if cached and time.time() - cached.get("fetched_at", 0) < ttl:
+        return cached["release"]
 
-def get_latest_version() -> dict:
-    """Fetches the latest version details of rb-scrobbler from GitHub."""
-    url = "https://api.github.com/repos/blackbunt/rb-scrobbler/releases/latest"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.json()
+    headers = {"Accept": "application/vnd.github+json"}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=15)
+        if response.status_code == 304 and cached:
+            release = cached["release"]
+        else:
+            response.raise_for_status()
+            release = response.json()
+    except requests.RequestException:
+        if cached:
+            return cached["release"]
+        raise
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump({
+            "url": url,
+            "etag": response.headers.get("ETag") or (cached or {}).get("etag"),
+            "fetched_at": time.time(),
+            "release": release,
+        }, f)
+    os.replace(tmp_path, cache_path)
+    return release
+
+def get_asset_checksum(release: dict, asset_name: str) -> Optional[str]:
+    """
+    Finds the SHA-256 of a release asset: from the "digest" field GitHub
+    reports for assets, or from a published .sha256/checksums file.
+    """
+    for asset in release.get("assets", []):
+        if asset["name"] == asset_name and str(asset.get("digest", "")).startswith("sha256:"):
+            return asset["digest"].split(":", 1)[1].lower()
+
+    for asset in release.get("assets", []):
+        name = asset["name"].lower()
+        if name == f"{asset_name.lower()}.sha256" or name in ("checksums.txt", "sha256sums", "sha256sums.txt"):
+            try:
+                response = requests.get(asset["browser_download_url"], timeout=15)
+                response.raise_for_status()
+            except requests.RequestException:
+                return None
+            for line in response.text.splitlines():
+                parts = line.split()
+                if len(parts) == 1 and name.endswith(".sha256"):
+                    return parts[0].lower()
+                if len(parts) >= 2 and parts[-1].lstrip("*") == asset_name:
+                    return parts[0].lower()
+    return None
+
+def _load_part_info(info_path: Path) -> dict:
+    try:
+        with info_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def download_file(url: str, download_path: Path, expected_sha256: Optional[str] = None,
+                  desc: str = "downloading", chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                  version: Optional[str] = None):
+    """
+    Downloads a file into a .part file next to download_path, resuming an
+    interrupted download with an HTTP Range request. The release version and
+    the server's ETag are kept next to the .part file: a .part file of
+    another version is discarded, and If-Range makes the server send the
+    whole file again if it changed. The result is checked against
+    expected_sha256 (if given) and then atomically renamed into place.
+    """
+    part_path = download_path.with_name(download_path.name + ".part")
+    info_path = download_path.with_name(download_path.name + ".part.json")
+    info = _load_part_info(info_path)
+    if part_path.exists() and (not info or info.get("version") != version or info.get("url") != url):
+        # Left over from another release, or from a release that did not say which.
+        part_path.unlink()
+    resume_from = part_path.stat().st_size if part_path.exists() else 0
+    headers = {}
+    if resume_from:
+        headers["Range"] = f"bytes={resume_from}-"
+        validator = info.get("etag") or info.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    response = requests.get(url, stream=True, headers=headers, timeout=30)
+    if response.status_code == 416:
+        response.close()
+        if not expected_sha256:
+            # Nothing can tell a complete .part file from a bogus one: start over.
+            part_path.unlink()
+            info_path.unlink(missing_ok=True)
+            return download_file(url, download_path, expected_sha256, desc, chunk_size, version)
+        # The .part file is already complete; the checksum below catches a bogus one.
+        total_size = resume_from
+    else:
+        response.raise_for_status()
+        if response.status_code != 206:
+            resume_from = 0
+        total_size = resume_from + int(response.headers.get("content-length", 0))
+        if total_size == 0:
+            raise ValueError("Download failed: The content is empty.")
+
+        with info_path.open("w", encoding="utf-8") as f:
+            json.dump({"url": url, "version": version, "etag": response.headers.get("ETag"),
+                       "last_modified": response.headers.get("Last-Modified")}, f)
+        with open(part_path, "ab" if resume_from else "wb") as f:
+            with tqdm(total=total_size, initial=resume_from, unit="B", unit_scale=True, desc=desc) as pbar:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        pbar.update(len(chunk))
+
+    if expected_sha256:
+        digest = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        if digest.hexdigest() != expected_sha256:
+            part_path.unlink()
+            info_path.unlink(missing_ok=True)
+            raise ValueError("Download failed: checksum mismatch.")
+
+    os.replace(part_path, download_path)
+    info_path.unlink(missing_ok=True)
 
 def save_version(version: str, version_file: Path):
     """Saves the current version to a file."""
@@ -45,9 +207,301 @@ def get_time_offset() -> str:
     offset_hours = offset_seconds / 3600
     return f"{offset_hours:+.1f}"
 
-def download_rb_scrobbler(download_path: Path):
+def load_lastfm_config() -> Optional[dict]:
+    """Loads the Last.fm API key, secret and session key, if configured."""
+    config_path = get_config_dir() / "lastfm.json"
+    try:
+        with config_path.open("r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not all(config.get(key) for key in ("api_key", "api_secret", "session_key")):
+        return None
+    return config
+
+def save_lastfm_config(config: dict):
+    """Saves the Last.fm credentials, readable by the current user only."""
+    config_path = get_config_dir() / "lastfm.json"
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(config_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+def parse_scrobbler_log(log_path: Path, start_offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """
+    Stream-parses a Rockbox .scrobbler.log (AUDIOSCROBBLER/1.1).
+    Yields (entry, offset) for every track line, where offset is the byte
+    position right after the line. Header lines are skipped; if the log
+    declares #TZ/UTC, entries get "utc": True.
+    """
+    utc = False
+    with open(log_path, "rb") as f:
+        if start_offset:
+            # Read the header for the time zone, then continue where we left off.
+            for raw in f:
+                if not raw.startswith(b"#"):
+                    break
+                utc = utc or raw.strip() == b"#TZ/UTC"
+            f.seek(start_offset)
+
+        offset = start_offset
+        for raw in f:
+            offset += len(raw)
+            if not raw.endswith(b"\n"):
+                # Rockbox is still writing this line; pick it up next time.
+                break
+            line = raw.rstrip(b"\r\n").decode("utf-8", errors="replace")
+            if line.startswith("#"):
+                utc = utc or line == "#TZ/UTC"
+                continue
+
+            fields = line.split("\t")
+            if len(fields) < 7:
+                continue
+            entry = dict(zip(SCROBBLER_LOG_FIELDS, fields))
+            try:
+                entry["timestamp"] = int(entry["timestamp"])
+            except ValueError:
+                continue
+            entry["utc"] = utc
+            yield entry, offset
+
+def get_data_dir() -> Path:
+    """Returns the host-side data directory of the iPod Manager."""
+    base = os.environ.get("XDG_DATA_HOME") or str(Path.home() / ".local" / "share")
+    return Path(base) / "ipod-manager"
+
+def scrobble_key(entry: dict) -> int:
+    """Compact 64-bit identity of a play: (artist, track, timestamp)."""
+    raw = f"{entry['artist']}\t{entry['track']}\t{entry['timestamp']}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+
+def _last_line_before(f, offset: int) -> bytes:
+    """Returns the log line that ends at the given byte offset."""
+    start = max(0, offset - 4096)
+    f.seek(start)
+    window = f.read(offset - start)
+    return window.rstrip(b"\n").rsplit(b"\n", 1)[-1]
+
+
+class ScrobbleJournal:
+    """
+    Host-side journal of a device's .scrobbler.log.
+    Stores the byte offset up to which the log has been processed with a
+    hash of the line ending there, so a run can seek straight to the new
+    entries (and notices when the log was deleted or replaced). Every
+    submitted play is also recorded as an 8-byte key in an append-only
+    index, so plays are never submitted twice even if the log is re-read.
+    """
+
+    def __init__(self, device_id: str, journal_dir: Optional[Path] = None):
+        self.journal_dir = Path(journal_dir) if journal_dir else get_data_dir() / "scrobbles"
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.state_path = self.journal_dir / f"{device_id}.json"
+        self.index_path = self.journal_dir / f"{device_id}.idx"
+
+        try:
+            with self.state_path.open("r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {"offset": 0, "line_hash": ""}
+
+        self.submitted = set()
+        if self.index_path.exists():
+            data = self.index_path.read_bytes()
+            usable = len(data) - len(data) % 8
+            self.submitted = {
+                int.from_bytes(data[i:i + 8], "little") for i in range(0, usable, 8)
+            }
+
+    def resume_offset(self, log_path: Path) -> int:
+        """Returns where to continue reading the log, or 0 if it changed."""
+        offset = self.state.get("offset", 0)
+        if not offset:
+            return 0
+        try:
+            if log_path.stat().st_size < offset:
+                return 0
+            with open(log_path, "rb") as f:
+                line = _last_line_before(f, offset)
+        except OSError:
+            return 0
+        if hashlib.blake2b(line, digest_size=16).hexdigest() != self.state.get("line_hash"):
+            return 0
+        return offset
+
+    def is_submitted(self, entry: dict) -> bool:
+        return scrobble_key(entry) in self.submitted
+
+    def record(self, entries: List[dict]):
+        """Appends the keys of successfully submitted plays to the index."""
+        keys = [scrobble_key(entry) for entry in entries]
+        self.submitted.update(keys)
+        with self.index_path.open("ab") as f:
+            f.write(b"".join(key.to_bytes(8, "little") for key in keys))
+
+    def checkpoint(self, log_path: Path, offset: int):
+        """Atomically remembers that the log has been processed up to offset."""
+        with open(log_path, "rb") as f:
+            line = _last_line_before(f, offset)
+        self.state = {"offset": offset, "line_hash": hashlib.blake2b(line, digest_size=16).hexdigest()}
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+def sign_request(params: dict, api_secret: str) -> str:
+    """Computes the api_sig of a Last.fm API call."""
+    payload = "".join(f"{key}{params[key]}" for key in sorted(params) if key not in ("format", "callback"))
+    return hashlib.md5((payload + api_secret).encode("utf-8")).hexdigest()
+
+
+class LastfmError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(f"Last.fm error {code}: {message}")
+        self.code = code
+
+
+class LastfmClient:
+    """Minimal Last.fm API client with a pooled session and retries with backoff."""
+
+    def __init__(self, api_key: str, api_secret: str, session_key: Optional[str] = None,
+                 api_url: str = LASTFM_API_URL, backoff: float = 1.0):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.session_key = session_key
+        self.api_url = api_url
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.mount(api_url, HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+    def call(self, method: str, params: dict, post: bool = True) -> dict:
+        """Performs a signed API call, retrying temporary failures with exponential backoff."""
+        params = dict(params, method=method, api_key=self.api_key)
+        if self.session_key:
+            params["sk"] = self.session_key
+        params["api_sig"] = sign_request(params, self.api_secret)
+        params["format"] = "json"
+
+        for attempt in range(MAX_RETRIES):
+            retry_after = self.backoff * (2 ** attempt)
+            try:
+                if post:
+                    response = self.session.post(self.api_url, data=params, timeout=30)
+                else:
+                    response = self.session.get(self.api_url, params=params, timeout=30)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                time.sleep(retry_after)
+                continue
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+
+            if "error" in data:
+                error = LastfmError(data["error"], data.get("message", ""))
+                if data["error"] not in LASTFM_RETRY_ERRORS or attempt == MAX_RETRIES - 1:
+                    raise error
+            elif response.status_code >= 500 or response.status_code == 429:
+                if attempt == MAX_RETRIES - 1:
+                    response.raise_for_status()
+            else:
+                response.raise_for_status()
+                return data
+
+            time.sleep(float(response.headers.get("Retry-After", retry_after)))
+        raise RuntimeError("unreachable")
+
+    def scrobble(self, entries: List[dict], offset_seconds: int = 0) -> Tuple[int, int]:
+        """
+        Submits up to LASTFM_BATCH_SIZE scrobbles in one call.
+        offset_seconds is subtracted from timestamps not logged in UTC.
+        Returns the number of accepted and ignored scrobbles.
+        """
+        params = {}
+        for i, entry in enumerate(entries[:LASTFM_BATCH_SIZE]):
+            timestamp = entry["timestamp"] if entry.get("utc") else entry["timestamp"] - offset_seconds
+            params[f"artist[{i}]"] = entry["artist"]
+            params[f"track[{i}]"] = entry["track"]
+            params[f"timestamp[{i}]"] = str(timestamp)
+            if entry.get("album"):
+                params[f"album[{i}]"] = entry["album"]
+            if entry.get("tracknumber"):
+                params[f"trackNumber[{i}]"] = entry["tracknumber"]
+            if entry.get("duration"):
+                params[f"duration[{i}]"] = entry["duration"]
+            if entry.get("mbid"):
+                params[f"mbid[{i}]"] = entry["mbid"]
+
+        attrs = self.call("track.scrobble", params).get("scrobbles", {}).get("@attr", {})
+        return int(attrs.get("accepted", 0)), int(attrs.get("ignored", 0))
+
+def authenticate_lastfm(api_url: str = LASTFM_API_URL) -> Optional[dict]:
+    """Walks the user through Last.fm desktop authentication and saves the session key."""
+    print("Create an API account at https://www.last.fm/api/account/create to get a key and secret.")
+    api_key = inquirer.text(message="Last.fm API key:").execute().strip()
+    api_secret = inquirer.secret(message="Last.fm API secret:").execute().strip()
+    client = LastfmClient(api_key, api_secret, api_url=api_url)
+
+    try:
+        token = client.call("auth.getToken", {}, post=False)["token"]
+        print(f"Allow access in your browser: {LASTFM_AUTH_URL}?api_key={api_key}&token={token}")
+        inquirer.confirm(message="Have you granted access?", default=True).execute()
+        session = client.call("auth.getSession", {"token": token}, post=False)["session"]
+    except (LastfmError, requests.RequestException, KeyError) as e:
+        print(f"Error while authenticating with Last.fm: {e}")
+        return None
+
+    config = {"api_key": api_key, "api_secret": api_secret, "session_key": session["key"]}
+    save_lastfm_config(config)
+    print(f"Authenticated as {session.get('name', 'unknown user')}.")
+    return config
+
+def submit_scrobbler_log(log_path: Path, config: dict, api_url: str = LASTFM_API_URL,
+                         journal: Optional[ScrobbleJournal] = None) -> Tuple[int, int]:
+    """
+    Submits every listened ("L") track of a .scrobbler.log to Last.fm in
+    batches of LASTFM_BATCH_SIZE. With a journal, reading starts where the
+    last run stopped, plays submitted before are skipped and a checkpoint is
+    written after every batch. Returns the accepted and ignored counts.
+    """
+    log_path = Path(log_path)
+    client = LastfmClient(config["api_key"], config["api_secret"], config["session_key"], api_url=api_url)
+    offset_seconds = int(float(get_time_offset()) * 3600)
+    start_offset = journal.resume_offset(log_path) if journal else 0
+    accepted = ignored = 0
+    batch = []
+    offset = start_offset
+
+    def flush(batch, offset):
+        counts = client.scrobble(batch, offset_seconds) if batch else (0, 0)
+        if journal:
+            journal.record(batch)
+            journal.checkpoint(log_path, offset)
+        return counts
+
+    for entry, offset in parse_scrobbler_log(log_path, start_offset):
+        if entry["rating"] != "L" or (journal and journal.is_submitted(entry)):
+            continue
+        batch.append(entry)
+        if len(batch) == LASTFM_BATCH_SIZE:
+            counts = flush(batch, offset)
+            accepted, ignored = accepted + counts[0], ignored + counts[1]
+            batch = []
+
+    if batch or offset != start_offset:
+        counts = flush(batch, offset)
+        accepted, ignored = accepted + counts[0], ignored + counts[1]
+    return accepted, ignored
+
+def download_rb_scrobbler(download_path: Path, latest_release: Optional[dict] = None,
+                          api_url: str = GITHUB_API_URL):
     """Downloads the latest version of rb-scrobbler from GitHub."""
-    latest_release = get_latest_version()
+    if latest_release is None:
+        latest_release = get_latest_version(api_url)
     latest_version = latest_release["tag_name"]
     version_file = download_path.parent / "rb-scrobbler-version"
     saved_version = load_version(version_file)
@@ -68,31 +522,24 @@ def download_rb_scrobbler(download_path: Path):
     if not asset_name:
         raise ValueError(f"Unsupported platform: {system}")
 
-    asset_url = next(
+    asset = next(
         (
-            asset["browser_download_url"]
+            asset
             for asset in latest_release["assets"]
             if asset_name in asset["name"]
         ),
         None,
     )
 
-    if not asset_url:
+    if not asset:
         raise FileNotFoundError(f"Asset not found for platform: {system}")
 
-    response = requests.get(asset_url, stream=True)
-    response.raise_for_status()
-
-    total_size = int(response.headers.get("content-length", 0))
-    if total_size == 0:
-        raise ValueError("Download failed: The content is empty.")
-
-    with open(download_path, "wb") as f:
-        with tqdm(total=total_size, unit="B", unit_scale=True, desc="downloading rb-scrobbler") as pbar:
-            for chunk in response.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    pbar.update(len(chunk))
+    download_path.parent.mkdir(parents=True, exist_ok=True)
+    download_file(
+        asset["browser_download_url"], download_path,
+        expected_sha256=get_asset_checksum(latest_release, asset["name"]),
+        desc="downloading rb-scrobbler", version=latest_version,
+    )
 
     # Make the downloaded file executable
     download_path.chmod(download_path.stat().st_mode | 0o111)
@@ -105,9 +552,76 @@ def download_rb_scrobbler(download_path: Path):
     save_version(latest_version, version_file)
     print(f"rb-scrobbler {latest_version} has been downloaded and verified.")
 
+def ask_delete_log(scrobbler_log_path: Path):
+    """Asks the user whether to delete the .scrobbler.log file."""
+    delete_log = inquirer.confirm(
+        message=f"Do you want to delete the file '{scrobbler_log_path}'?",
+        default=False
+    ).execute()
+
+    if delete_log:
+        try:
+            scrobbler_log_path.unlink()
+            print(f"File '{scrobbler_log_path}' has been deleted.")
+        except Exception as e:
+            print(f"Error while deleting the file: {e}")
+    else:
+        print("The file has been kept.")
+
+def scrobble_log_native(ipod_path: Path, config: dict, api_url: str = LASTFM_API_URL,
+                        delete_log: Optional[bool] = None) -> Optional[Tuple[int, int]]:
+    """
+    Scrobbles the .scrobbler.log file on the specified iPod with the built-in submitter.
+    delete_log=None asks whether to delete the log afterwards.
+    Returns the accepted and ignored counts, or None if nothing was submitted.
+    """
+    scrobbler_log_path = ipod_path / ".scrobbler.log"
+    if not scrobbler_log_path.exists():
+        print(f"No .scrobbler.log file found in directory {ipod_path}.")
+        return None
+
+    journal = ScrobbleJournal(get_device_id(ipod_path))
+    try:
+        with trace.phase("scrobble") as phase:
+            accepted, ignored = submit_scrobbler_log(scrobbler_log_path, config, api_url, journal)
+            phase.add(files=accepted + ignored)
+    except (LastfmError, requests.RequestException) as e:
+        print(f"Error while scrobbling to Last.fm: {e}")
+        return None
+    print(f"{accepted} scrobbles accepted, {ignored} ignored by Last.fm.")
+
+    if delete_log is None:
+        ask_delete_log(scrobbler_log_path)
+    elif delete_log:
+        try:
+            scrobbler_log_path.unlink()
+            print(f"File '{scrobbler_log_path}' has been deleted.")
+        except OSError as e:
+            print(f"Error while deleting the file: {e}")
+    return accepted, ignored
+
 def scrobble_log(ipod_path: Path):
-    """Executes the scrobbling of the .scrobbler.log file on the specified iPod."""
+    """
+    Executes the scrobbling of the .scrobbler.log file on the specified iPod.
+    Uses the built-in submitter when Last.fm credentials are configured and
+    falls back to rb-scrobbler otherwise.
+    """
     scrobbler_path = Path.home() / ".local" / "bin" / "rb-scrobbler"
+    config = load_lastfm_config()
+
+    if config is None and not scrobbler_path.exists():
+        use_native = inquirer.confirm(
+            message="Set up the built-in Last.fm submitter? (needs a Last.fm API account, otherwise rb-scrobbler is used)",
+            default=True
+        ).execute()
+        if use_native:
+            config = authenticate_lastfm()
+            if config is None:
+                return
+
+    if config is not None:
+        scrobble_log_native(ipod_path, config)
+        return
 
     # Check if rb-scrobbler exists
     if not scrobbler_path.exists():
@@ -133,13 +647,17 @@ def scrobble_log(ipod_path: Path):
         print("Error: rb-scrobbler is not executable or missing after download.")
         return
 
-    # Check for updates
+    # Check for updates (cached, and skipped when GitHub cannot be reached)
     version_file = scrobbler_path.parent / "rb-scrobbler-version"
-    latest_release = get_latest_version()
-    latest_version = latest_release["tag_name"]
+    try:
+        latest_release = get_latest_version()
+    except requests.RequestException as e:
+        print(f"Could not check for rb-scrobbler updates: {e}")
+        latest_release = None
+    latest_version = latest_release["tag_name"] if latest_release else None
     saved_version = load_version(version_file)
 
-    if saved_version != latest_version:
+    if latest_version and saved_version != latest_version:
         print(f"A new version of rb-scrobbler is available: {latest_version} (current: {saved_version})")
         update_choice = inquirer.confirm(
             message="Do you want to update to the latest version?",
@@ -148,7 +666,7 @@ def scrobble_log(ipod_path: Path):
 
         if update_choice:
             try:
-                download_rb_scrobbler(scrobbler_path)
+                download_rb_scrobbler(scrobbler_path, latest_release)
                 print("rb-scrobbler has been updated successfully.")
             except Exception as e:
                 print(f"Error while updating rb-scrobbler: {e}")
@@ -175,20 +693,7 @@ def scrobble_log(ipod_path: Path):
         print(f"Error while executing rb-scrobbler: {e.stderr}")
         return
 
-    # Ask the user whether to delete the .scrobbler.log file
-    delete_log = inquirer.confirm(
-        message=f"Do you want to delete the file '{scrobbler_log_path}'?",
-        default=False
-    ).execute()
-
-    if delete_log:
-        try:
-            scrobbler_log_path.unlink()
-            print(f"File '{scrobbler_log_path}' has been deleted.")
-        except Exception as e:
-            print(f"Error while deleting the file: {e}")
-    else:
-        print("The file has been kept.")
+    ask_delete_log(scrobbler_log_path)
 
 if __name__ == "__main__":
     ipod_path = Path(input("Enter the path to your iPod: ").strip())
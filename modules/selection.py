@@ -5,7 +5,8 @@
  File        : selection.py
  Description : Provides functions for discovering connected iPods,
                prompting the user to select an iPod or artists, 
-               and listing artists in the music library.
+               entering a selection query and listing artists in
+               the music library.
                This submodule is part of the iPod Manager project.
  Author      : blackbunt
  Created     : 2025-01-26
@@ -13,19 +14,16 @@
  Repository  : https://github.com/blackbunt/ipod-manager
 ==================================================================
 """
-import os
 from pathlib import Path
 from typing import List
-from InquirerPy import prompt
+from modules.devices import find_ipods as find_mounted_ipods
+
+# Longer artist lists get a prompt filtered by typing instead of a plain checkbox list.
+FUZZY_PROMPT_THRESHOLD = 30
 
 def find_ipods() -> List[str]:
     """Find connected iPods."""
-    ipods = []
-    media_path = Path(f"/run/media/{os.getlogin()}")
-    for mount in media_path.iterdir():
-        if (mount / "iPod_Control").is_dir():
-            ipods.append(str(mount))
-    return ipods
+    return [str(mount) for mount in find_mounted_ipods()]
 
 def select_ipod(ipods: List[str]) -> str:
     """Prompt user to select an iPod."""
@@ -33,6 +31,7 @@ def select_ipod(ipods: List[str]) -> str:
         print("\033[91mNo iPod found. Please ensure your iPod is connected.\033[0m")
         exit(1)
 
+    from InquirerPy import prompt
     questions = [
         {
             "type": "list",
@@ -54,6 +53,7 @@ def select_artists(artists: List[str]) -> List[str]:
         print("\033[91mNo artists found. Exiting.\033[0m")
         exit(1)
 
+    from InquirerPy import prompt
     questions = [
         {
             "type": "checkbox",
@@ -62,5 +62,26 @@ def select_artists(artists: List[str]) -> List[str]:
             "choices": [{"name": artist, "value": artist} for artist in artists],
         }
     ]
+    if len(artists) > FUZZY_PROMPT_THRESHOLD:
+        questions[0].update(type="fuzzy", multiselect=True,
+                            message="Select artists (type to filter, Tab to mark):")
     answers = prompt(questions)
     return answers["selected_artists"]
+
+def enter_query() -> str:
+    """Prompt user for a selection query such as genre=jazz AND year<1970."""
+    from InquirerPy import inquirer
+    from modules.catalog import parse_query, QueryError
+
+    def valid(text: str) -> bool:
+        try:
+            parse_query(text)
+        except QueryError:
+            return False
+        return True
+
+    return inquirer.text(
+        message="Query (e.g. genre=jazz AND year<1970, artist=Miles*):",
+        validate=valid,
+        invalid_message="The query cannot be read; use field=value, AND, OR, NOT and parentheses.",
+    ).execute()
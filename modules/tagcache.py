@@ -0,0 +1,221 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : tagcache.py
+ Description : Builds the Rockbox database (.rockbox/database_*.tcd)
+               on the host, so the iPod does not have to scan and
+               read every track on its slow CPU after a sync. The
+               existing database is read back first: unchanged
+               tracks keep their entry (including play counts and
+               ratings) and only new or changed tracks are tagged.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import re
+import time
+import struct
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from modules.tags import read_many
+
+ROCKBOX_DIR = ".rockbox"
+INDEX_FILE = "database_idx.tcd"
+TAG_FILE = "database_{}.tcd"
+PENDING_FILE = "database_tmp.tcd"
+
+# Layout of the Rockbox 3.x tagcache (tagcache.h). Rockbox checks the magic
+# and simply rebuilds the database itself if it does not match its version.
+TAGCACHE_MAGIC = 0x5443480F
+STRING_TAGS = ("artist", "album", "genre", "title", "filename", "composer", "comment", "albumartist", "grouping")
+NUMERIC_TAGS = ("year", "discnumber", "tracknumber", "bitrate", "length", "playcount", "rating", "playtime",
+                "lastplayed", "commitid", "mtime", "lastelapsed", "lastoffset")
+TAG_COUNT = len(STRING_TAGS) + len(NUMERIC_TAGS)
+# String tags stored once however many tracks share them; titles and file names are stored per track.
+UNIQUE_TAGS = {"artist", "album", "genre", "composer", "comment", "albumartist", "grouping"}
+# Kept from the existing database: the player records these.
+RUNTIME_TAGS = ("playcount", "rating", "playtime", "lastplayed", "lastelapsed", "lastoffset")
+
+FLAG_DELETED = 0x0001
+FLAG_TRKNUMGEN = 0x0008
+UNTAGGED = "<Untagged>"
+TAG_MAXLEN = 255  # bytes; longer tags are cut to what the player's buffers hold
+ENTRY_PADDING = 8  # string entries other than file names are padded to this size
+
+# Little-endian, as on every iPod Rockbox runs on.
+_HEADER = struct.Struct("<iii")  # magic, data size, entry count
+_MASTER_HEADER = struct.Struct("<iiiiii")  # header + serial, commit id, dirty
+_INDEX_ENTRY = struct.Struct(f"<{TAG_COUNT + 1}i")  # tag values or offsets + flag
+_TAG_ENTRY = struct.Struct("<ii")  # tag length, index id
+
+
+def get_rockbox_dir(ipod_path: Path) -> Path:
+    return Path(ipod_path) / ROCKBOX_DIR
+
+def database_exists(ipod_path: Path) -> bool:
+    return (get_rockbox_dir(ipod_path) / INDEX_FILE).is_file()
+
+def fat_timestamp(mtime: float) -> int:
+    """Packs a modification time like FAT and Rockbox do: (date << 16) | time, local time."""
+    t = time.localtime(mtime)
+    date = (max(0, t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return (date << 16) | (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+
+def device_filename(rel_path: str) -> str:
+    """Returns the path the player sees for a file below Music/."""
+    return f"/Music/{rel_path}"
+
+
+def read_database(ipod_path: Path) -> Tuple[Dict[str, dict], int, int]:
+    """
+    Reads the database on the iPod. Returns ({file name: entry}, commit id,
+    serial); no entries if there is no database or it has another format.
+    """
+    rockbox_dir = get_rockbox_dir(ipod_path)
+    try:
+        index = (rockbox_dir / INDEX_FILE).read_bytes()
+        magic, _, count, serial, commitid, _ = _MASTER_HEADER.unpack_from(index)
+        if magic != TAGCACHE_MAGIC:
+            return {}, 0, 0
+        tag_files = [(rockbox_dir / TAG_FILE.format(i)).read_bytes() for i in range(len(STRING_TAGS))]
+    except (OSError, struct.error):
+        return {}, 0, 0
+
+    entries = {}
+    try:
+        for position in range(_MASTER_HEADER.size, _MASTER_HEADER.size + count * _INDEX_ENTRY.size, _INDEX_ENTRY.size):
+            values = _INDEX_ENTRY.unpack_from(index, position)
+            if values[-1] & FLAG_DELETED:
+                continue
+            entry = {"flag": values[-1]}
+            for i, name in enumerate(STRING_TAGS):
+                length, _ = _TAG_ENTRY.unpack_from(tag_files[i], values[i])
+                start = values[i] + _TAG_ENTRY.size
+                entry[name] = tag_files[i][start:start + length].split(b"\x00", 1)[0].decode("utf-8", "replace")
+            for i, name in enumerate(NUMERIC_TAGS, len(STRING_TAGS)):
+                entry[name] = values[i]
+            entries[entry["filename"]] = entry
+    except struct.error:
+        return {}, 0, 0
+    return entries, commitid, serial
+
+def _clip(text: str) -> str:
+    data = text.encode("utf-8")
+    return text if len(data) <= TAG_MAXLEN else data[:TAG_MAXLEN].decode("utf-8", "ignore")
+
+def make_entry(rel_path: str, file: dict, tags: dict, previous: Optional[dict], commitid: int) -> dict:
+    """Builds the database entry of one track from its tags and its previous entry, if any."""
+    entry = {"flag": 0, "filename": device_filename(rel_path)}
+    for name in STRING_TAGS:
+        if name != "filename":
+            entry[name] = _clip(str(tags.get(name) or UNTAGGED))
+    for name in ("year", "discnumber", "tracknumber", "bitrate", "length"):
+        entry[name] = int(tags.get(name) or 0)
+    if not entry["tracknumber"]:
+        # Like the player, take the track number from the file name ("03 Title.flac").
+        match = re.match(r"(?:\d+-)?(\d+)", os.path.basename(rel_path))
+        if match:
+            entry["tracknumber"] = int(match.group(1))
+            entry["flag"] |= FLAG_TRKNUMGEN
+    entry["mtime"] = fat_timestamp(file["mtime"])
+    for name in RUNTIME_TAGS:
+        entry[name] = previous.get(name, 0) if previous else 0
+    entry["commitid"] = previous["commitid"] if previous else commitid
+    return entry
+
+def _write_tag_file(path: Path, values: List[Tuple[str, int]], padded: bool) -> List[int]:
+    """Writes one tag file. Returns the offset of every value."""
+    chunks, offsets = [], []
+    position = _HEADER.size
+    for text, idx_id in values:
+        data = text.encode("utf-8") + b"\x00"
+        if padded and len(data) % ENTRY_PADDING:
+            data += b"X" * (ENTRY_PADDING - len(data) % ENTRY_PADDING)
+        offsets.append(position)
+        chunks.append(_TAG_ENTRY.pack(len(data), idx_id))
+        chunks.append(data)
+        position += _TAG_ENTRY.size + len(data)
+    _write_atomic(path, [_HEADER.pack(TAGCACHE_MAGIC, position - _HEADER.size, len(values))] + chunks)
+    return offsets
+
+def _write_atomic(path: Path, chunks: List[bytes]):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(chunks))
+    os.replace(tmp_path, path)
+
+def write_database(ipod_path: Path, entries: List[dict], commitid: int, serial: int = 0):
+    """Writes the tag files and the index of the given entries. The index is written last."""
+    rockbox_dir = get_rockbox_dir(ipod_path)
+    rockbox_dir.mkdir(parents=True, exist_ok=True)
+    seeks = [[0] * len(STRING_TAGS) for _ in entries]
+
+    for i, name in enumerate(STRING_TAGS):
+        if name == "filename":
+            values = [(entry[name], idx) for idx, entry in enumerate(entries)]
+            offsets = _write_tag_file(rockbox_dir / TAG_FILE.format(i), values, padded=False)
+            for idx, offset in enumerate(offsets):
+                seeks[idx][i] = offset
+            continue
+
+        # Sorted like the player sorts (strcasecmp); each value points back to its first track.
+        first = {}
+        if name in UNIQUE_TAGS:
+            for idx, entry in enumerate(entries):
+                first.setdefault(entry[name], idx)
+            values = sorted(first.items(), key=lambda item: item[0].encode("utf-8").lower())
+        else:
+            values = sorted(((entry[name], idx) for idx, entry in enumerate(entries)),
+                            key=lambda item: item[0].encode("utf-8").lower())
+        offsets = _write_tag_file(rockbox_dir / TAG_FILE.format(i), values, padded=True)
+        if name in UNIQUE_TAGS:
+            offset_of = {text: offset for (text, _), offset in zip(values, offsets)}
+            for idx, entry in enumerate(entries):
+                seeks[idx][i] = offset_of[entry[name]]
+        else:
+            for (_, idx), offset in zip(values, offsets):
+                seeks[idx][i] = offset
+
+    chunks = [_MASTER_HEADER.pack(TAGCACHE_MAGIC, len(entries) * _INDEX_ENTRY.size, len(entries), serial, commitid, 0)]
+    for idx, entry in enumerate(entries):
+        chunks.append(_INDEX_ENTRY.pack(*seeks[idx], *(entry[name] for name in NUMERIC_TAGS), entry["flag"]))
+    _write_atomic(rockbox_dir / INDEX_FILE, chunks)
+    # A commit the player had not finished would be applied on top of ours.
+    (rockbox_dir / PENDING_FILE).unlink(missing_ok=True)
+
+def build_tagcache(ipod_path: Path, files: Dict[str, dict],
+                   library_tags: Optional[Callable[[List[str]], Dict[str, dict]]] = None,
+                   workers: Optional[int] = None) -> dict:
+    """
+    Brings the database on the iPod in line with files ({path below Music/:
+    {"size", "mtime"}}, i.e. the manifest). Entries of tracks with the same
+    modification time are kept as they are. The other tracks are tagged by
+    library_tags(paths), which returns the tags it knows (e.g. from the scan
+    cache); the rest are read from the iPod on a process pool. The database
+    is only rewritten if something changed. Returns {"tracks", "tagged", "written"}.
+    """
+    existing, commitid, serial = read_database(ipod_path)
+    music_dir = Path(ipod_path) / "Music"
+
+    outdated = [rel_path for rel_path, file in files.items()
+                if existing.get(device_filename(rel_path), {}).get("mtime") != fat_timestamp(file["mtime"])]
+    tags = library_tags(outdated) if library_tags is not None and outdated else {}
+    unknown = [rel_path for rel_path in outdated if rel_path not in tags]
+    tags.update(zip(unknown, read_many([music_dir / rel_path for rel_path in unknown], workers)))
+
+    entries = []
+    for rel_path in sorted(files):
+        previous = existing.get(device_filename(rel_path))
+        if rel_path in tags:
+            previous = make_entry(rel_path, files[rel_path], tags[rel_path], previous, commitid + 1)
+        entries.append(previous)
+
+    written = bool(outdated) or len(entries) != len(existing)
+    if written:
+        write_database(ipod_path, entries, commitid + 1, serial)
+    return {"tracks": len(entries), "tagged": len(outdated), "written": written}
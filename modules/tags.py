@@ -0,0 +1,473 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : tags.py
+ Description : Reads the tags, length and bitrate of FLAC, MP3 and
+               M4A files from their headers only: FLAC metadata
+               blocks, ID3v2/ID3v1 tags with the first MPEG frame
+               (Xing/VBRI) and the MP4 moov atom. Audio data is
+               skipped with seeks and never read. Embedded cover
+               art is read on request.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import re
+import struct
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# Tag names used throughout; strings except for the numeric ones.
+STRING_TAGS = ("title", "artist", "album", "genre", "composer", "comment", "albumartist", "grouping")
+NUMERIC_TAGS = ("year", "discnumber", "tracknumber", "length", "bitrate")  # length in ms, bitrate in kbps
+
+# Bytes read after an ID3v2 tag to find the first MPEG frame.
+MPEG_PROBE_SIZE = 16 * 1024
+# Below this many files, starting worker processes costs more than it saves.
+PARALLEL_THRESHOLD = 64
+
+ID3V1_GENRES = (
+    "Blues", "Classic Rock", "Country", "Dance", "Disco", "Funk", "Grunge", "Hip-Hop", "Jazz", "Metal",
+    "New Age", "Oldies", "Other", "Pop", "R&B", "Rap", "Reggae", "Rock", "Techno", "Industrial",
+    "Alternative", "Ska", "Death Metal", "Pranks", "Soundtrack", "Euro-Techno", "Ambient", "Trip-Hop", "Vocal",
+    "Jazz+Funk", "Fusion", "Trance", "Classical", "Instrumental", "Acid", "House", "Game", "Sound Clip",
+    "Gospel", "Noise", "AlternRock", "Bass", "Soul", "Punk", "Space", "Meditative", "Instrumental Pop",
+    "Instrumental Rock", "Ethnic", "Gothic", "Darkwave", "Techno-Industrial", "Electronic", "Pop-Folk",
+    "Eurodance", "Dream", "Southern Rock", "Comedy", "Cult", "Gangsta", "Top 40", "Christian Rap", "Pop/Funk",
+    "Jungle", "Native American", "Cabaret", "New Wave", "Psychadelic", "Rave", "Showtunes", "Trailer", "Lo-Fi",
+    "Tribal", "Acid Punk", "Acid Jazz", "Polka", "Retro", "Musical", "Rock & Roll", "Hard Rock",
+)
+
+VORBIS_KEYS = {
+    "TITLE": "title", "ARTIST": "artist", "ALBUM": "album", "GENRE": "genre", "COMPOSER": "composer",
+    "COMMENT": "comment", "DESCRIPTION": "comment", "ALBUMARTIST": "albumartist", "ALBUM ARTIST": "albumartist",
+    "GROUPING": "grouping", "CONTENTGROUP": "grouping", "DATE": "year", "YEAR": "year",
+    "TRACKNUMBER": "tracknumber", "DISCNUMBER": "discnumber",
+}
+
+ID3_FRAMES = {
+    "TIT2": "title", "TPE1": "artist", "TALB": "album", "TCON": "genre", "TCOM": "composer", "COMM": "comment",
+    "TPE2": "albumartist", "TIT1": "grouping", "TYER": "year", "TDRC": "year", "TRCK": "tracknumber",
+    "TPOS": "discnumber",
+    # ID3v2.2
+    "TT2": "title", "TP1": "artist", "TAL": "album", "TCO": "genre", "TCM": "composer", "COM": "comment",
+    "TP2": "albumartist", "TT1": "grouping", "TYE": "year", "TRK": "tracknumber", "TPA": "discnumber",
+}
+
+MP4_ITEMS = {
+    b"\xa9nam": "title", b"\xa9ART": "artist", b"\xa9alb": "album", b"\xa9gen": "genre", b"\xa9wrt": "composer",
+    b"\xa9cmt": "comment", b"aART": "albumartist", b"\xa9grp": "grouping", b"\xa9day": "year",
+    b"trkn": "tracknumber", b"disk": "discnumber", b"gnre": "genre",
+}
+
+_MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MPEG_SAMPLE_RATES = (44100, 48000, 32000)
+
+
+def _number(value) -> Optional[int]:
+    """Parses "3", "3/12" or "1969-05-01" style values."""
+    if isinstance(value, int):
+        return value
+    match = re.match(r"\s*(\d+)", value or "")
+    return int(match.group(1)) if match else None
+
+def _set(tags: dict, name: str, value):
+    """Keeps the first non-empty value of a tag, converting numeric ones."""
+    if name in tags or value is None:
+        return
+    if name in NUMERIC_TAGS:
+        value = _number(value)
+    elif isinstance(value, str):
+        value = value.strip("\x00").strip()
+    if value not in (None, ""):
+        tags[name] = value
+
+def _genre_name(value: str) -> str:
+    """Resolves ID3 genre references such as "(17)" or "17"."""
+    match = re.fullmatch(r"\((\d+)\)(.*)|(\d+)", value.strip())
+    if match is None:
+        return value
+    if match.group(2):
+        return match.group(2)
+    index = int(match.group(1) or match.group(3))
+    return ID3V1_GENRES[index] if index < len(ID3V1_GENRES) else value
+
+def _finish(tags: dict, file_size: int, audio_bytes: int) -> dict:
+    if "genre" in tags:
+        tags["genre"] = _genre_name(tags["genre"])
+    if tags.get("length") and "bitrate" not in tags:
+        tags["bitrate"] = round(audio_bytes * 8 / tags["length"])
+    return tags
+
+
+# FLAC
+
+def _read_flac(f: BinaryIO, file_size: int) -> dict:
+    tags = {}
+    f.seek(4)
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        kind, length = header[0] & 0x7F, int.from_bytes(header[1:], "big")
+        if kind == 0:  # STREAMINFO
+            data = f.read(length)
+            sample_rate = int.from_bytes(data[10:13], "big") >> 4
+            samples = int.from_bytes(data[13:18], "big") & 0xFFFFFFFFF
+            if sample_rate:
+                tags["length"] = samples * 1000 // sample_rate
+        elif kind == 4:  # VORBIS_COMMENT
+            data = f.read(length)
+            vendor_length = struct.unpack_from("<I", data)[0]
+            position = 4 + vendor_length
+            count = struct.unpack_from("<I", data, position)[0]
+            position += 4
+            for _ in range(count):
+                comment_length = struct.unpack_from("<I", data, position)[0]
+                comment = data[position + 4:position + 4 + comment_length].decode("utf-8", "replace")
+                position += 4 + comment_length
+                key, _, value = comment.partition("=")
+                if key.upper() in VORBIS_KEYS:
+                    _set(tags, VORBIS_KEYS[key.upper()], value)
+        else:  # pictures, seek tables, padding: never read
+            f.seek(length, os.SEEK_CUR)
+        if header[0] & 0x80:
+            break
+    return _finish(tags, file_size, file_size - f.tell())
+
+
+# MP3
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def _decode_text(data: bytes) -> str:
+    """Decodes an ID3 text frame; only the first of several values is kept."""
+    encoding, data = data[:1], data[1:]
+    if encoding == b"\x01":
+        text = data.decode("utf-16", "replace")
+    elif encoding == b"\x02":
+        text = data.decode("utf-16-be", "replace")
+    elif encoding == b"\x03":
+        text = data.decode("utf-8", "replace")
+    else:
+        text = data.decode("latin-1")
+    return text.split("\x00")[0] if text.strip("\x00") else ""
+
+def _decode_comment(data: bytes) -> str:
+    """Decodes a COMM frame: encoding, language, description and the comment itself."""
+    encoding, body = data[:1], data[4:]
+    separator = b"\x00\x00" if encoding in (b"\x01", b"\x02") else b"\x00"
+    position = 0
+    while True:
+        position = body.find(separator, position)
+        if position < 0 or len(separator) == 1 or position % 2 == 0:
+            break
+        position += 1
+    text = body[position + len(separator):] if position >= 0 else b""
+    return _decode_text(encoding + text)
+
+def _id3_frames(data: bytes, major: int):
+    """Yields (frame id, body) of the readable frames of an ID3v2 tag."""
+    position = 0
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    while position + header_size <= len(data):
+        frame_id = data[position:position + id_size]
+        if not frame_id.strip(b"\x00") or not frame_id.isalnum():
+            break
+        if major == 2:
+            size = int.from_bytes(data[position + 3:position + 6], "big")
+            flags = 0
+        elif major == 4:
+            size = _syncsafe(data[position + 4:position + 8])
+            flags = int.from_bytes(data[position + 8:position + 10], "big")
+        else:
+            size = int.from_bytes(data[position + 4:position + 8], "big")
+            flags = int.from_bytes(data[position + 8:position + 10], "big")
+        body = data[position + header_size:position + header_size + size]
+        position += header_size + size
+
+        if not body:
+            continue
+        if major == 3 and flags & 0x00C0 or major == 4 and flags & 0x000C:
+            continue  # compressed or encrypted
+        if major == 4:
+            if flags & 0x0001:
+                body = body[4:]
+            if flags & 0x0002:
+                body = body.replace(b"\xff\x00", b"\xff")
+        yield frame_id.decode("latin-1"), body
+
+def _parse_id3v2(data: bytes, major: int, tags: dict):
+    for frame_id, body in _id3_frames(data, major):
+        name = ID3_FRAMES.get(frame_id)
+        if name is not None:
+            _set(tags, name, _decode_comment(body) if name == "comment" else _decode_text(body))
+
+def _mpeg_info(data: bytes, audio_bytes: int) -> dict:
+    """Reads length and bitrate from the first MPEG audio frame (and its Xing/Info or VBRI header)."""
+    position = data.find(b"\xff")
+    while 0 <= position <= len(data) - 4:
+        b1, b2, b3 = data[position + 1], data[position + 2], data[position + 3]
+        version_bits, layer_bits = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        if (b1 & 0xE0) == 0xE0 and version_bits != 1 and layer_bits and 0 < bitrate_index < 15 and rate_index < 3:
+            break
+        position = data.find(b"\xff", position + 1)
+    else:
+        return {}
+
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    sample_rate = _MPEG_SAMPLE_RATES[rate_index] >> (0 if mpeg1 else 1 if version_bits == 2 else 2)
+    samples_per_frame = 384 if layer == 1 else 1152 if layer == 2 or mpeg1 else 576
+    mono = (b3 >> 6) == 3
+
+    frames = None
+    xing = position + 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        if struct.unpack_from(">I", data, xing + 4)[0] & 1:
+            frames = struct.unpack_from(">I", data, xing + 8)[0]
+    elif data[position + 36:position + 40] == b"VBRI":
+        frames = struct.unpack_from(">I", data, position + 50)[0]
+
+    if frames:
+        return {"length": frames * samples_per_frame * 1000 // sample_rate}
+    bitrate = _MPEG_BITRATES[(1 if mpeg1 else 2, layer)][bitrate_index]
+    return {"bitrate": bitrate, "length": audio_bytes * 8 // bitrate}
+
+def _read_id3v2(f: BinaryIO) -> Tuple[int, bytes, int]:
+    """Reads the ID3v2 tag at the start of a file. Returns (major version, frame data, audio start)."""
+    header = f.read(10)
+    if header[:3] != b"ID3" or len(header) < 10:
+        return 0, b"", 0
+    major, flags = header[3], header[5]
+    size = _syncsafe(header[6:10])
+    data = f.read(size)
+    if major == 3 and flags & 0x80:
+        data = data.replace(b"\xff\x00", b"\xff")
+    if flags & 0x40 and major in (3, 4):
+        extended = int.from_bytes(data[:4], "big") + 4 if major == 3 else _syncsafe(data[:4])
+        data = data[extended:]
+    return major, data, 10 + size + (10 if flags & 0x10 else 0)
+
+def _read_mp3(f: BinaryIO, file_size: int) -> dict:
+    tags = {}
+    major, data, audio_start = _read_id3v2(f)
+    if major in (2, 3, 4):
+        _parse_id3v2(data, major, tags)
+
+    audio_end = file_size
+    if file_size >= 128 + audio_start:
+        f.seek(file_size - 128)
+        trailer = f.read(128)
+        if trailer[:3] == b"TAG":
+            audio_end -= 128
+            latin = lambda raw: raw.split(b"\x00")[0].decode("latin-1").strip()
+            for name, value in (("title", latin(trailer[3:33])), ("artist", latin(trailer[33:63])),
+                                ("album", latin(trailer[63:93])), ("year", latin(trailer[93:97])),
+                                ("comment", latin(trailer[97:127]))):
+                _set(tags, name, value)
+            if trailer[125] == 0 and trailer[126]:
+                _set(tags, "tracknumber", trailer[126])
+            if trailer[127] < len(ID3V1_GENRES):
+                _set(tags, "genre", ID3V1_GENRES[trailer[127]])
+
+    f.seek(audio_start)
+    audio_bytes = max(0, audio_end - audio_start)
+    for name, value in _mpeg_info(f.read(MPEG_PROBE_SIZE), audio_bytes).items():
+        tags.setdefault(name, value)
+    return _finish(tags, file_size, audio_bytes)
+
+
+# M4A
+
+def _atoms(f: BinaryIO, start: int, end: int):
+    """Yields (type, payload offset, payload end) of the atoms between start and end."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        payload = position + 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            size = end - position
+        if size < payload - position:
+            return
+        yield kind, payload, position + size
+        position += size
+
+def _moov_items(f: BinaryIO, file_size: int):
+    """Yields (type, payload offset, payload end) of the children of moov, and of its ilst as ("ilst", ...)."""
+    for kind, start, end in _atoms(f, 0, file_size):
+        if kind != b"moov":
+            continue  # mdat and friends are skipped unread
+        for child, child_start, child_end in _atoms(f, start, end):
+            if child != b"udta":
+                yield child, child_start, child_end
+                continue
+            for meta, meta_start, meta_end in _atoms(f, child_start, child_end):
+                if meta != b"meta":
+                    continue
+                # meta is a full atom: four bytes of version and flags precede its children.
+                for ilst, ilst_start, ilst_end in _atoms(f, meta_start + 4, meta_end):
+                    if ilst == b"ilst":
+                        yield ilst, ilst_start, ilst_end
+        return
+
+def _read_m4a(f: BinaryIO, file_size: int) -> dict:
+    tags = {}
+    for child, child_start, child_end in _moov_items(f, file_size):
+        if child == b"mvhd":
+            f.seek(child_start)
+            data = f.read(32)
+            if data[0] == 1:
+                timescale, duration = struct.unpack_from(">IQ", data, 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", data, 12)
+            if timescale:
+                tags["length"] = duration * 1000 // timescale
+        elif child == b"ilst":
+            _read_ilst(f, child_start, child_end, tags)
+    return _finish(tags, file_size, file_size)
+
+def _read_ilst(f: BinaryIO, start: int, end: int, tags: dict):
+    for item, item_start, item_end in _atoms(f, start, end):
+        name = MP4_ITEMS.get(item)
+        if name is None:
+            continue
+        for data_kind, data_start, data_end in _atoms(f, item_start, item_end):
+            if data_kind != b"data":
+                continue
+            f.seek(data_start + 8)  # type and locale
+            value = f.read(data_end - data_start - 8)
+            if item in (b"trkn", b"disk"):
+                _set(tags, name, int.from_bytes(value[2:4], "big") if len(value) >= 4 else None)
+            elif item == b"gnre":
+                index = int.from_bytes(value[:2], "big") - 1
+                _set(tags, name, ID3V1_GENRES[index] if 0 <= index < len(ID3V1_GENRES) else None)
+            else:
+                _set(tags, name, value.decode("utf-8", "replace"))
+            break
+
+
+READERS = {".flac": _read_flac, ".mp3": _read_mp3, ".m4a": _read_m4a, ".mp4": _read_m4a, ".m4b": _read_m4a}
+
+
+# Embedded pictures
+
+FRONT_COVER = 3  # picture type of FLAC PICTURE blocks and ID3 APIC frames
+
+def _flac_picture(f: BinaryIO, file_size: int) -> Optional[bytes]:
+    found = None
+    f.seek(4)
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return found
+        kind, length = header[0] & 0x7F, int.from_bytes(header[1:], "big")
+        if kind == 6:  # PICTURE
+            data = f.read(length)
+            picture_type, mime_length = struct.unpack_from(">II", data)
+            position = 8 + mime_length
+            position += 4 + struct.unpack_from(">I", data, position)[0] + 16  # description, size and colors
+            picture = data[position + 4:position + 4 + struct.unpack_from(">I", data, position)[0]]
+            if picture_type == FRONT_COVER:
+                return picture
+            found = found or picture
+        else:
+            f.seek(length, os.SEEK_CUR)
+        if header[0] & 0x80:
+            return found
+
+def _id3_picture(f: BinaryIO, file_size: int) -> Optional[bytes]:
+    major, data, _ = _read_id3v2(f)
+    found = None
+    for frame_id, body in _id3_frames(data, major):
+        if frame_id == "APIC":
+            position = body.index(b"\x00", 1) + 1  # encoding, MIME type
+        elif frame_id == "PIC":
+            position = 4  # encoding, image format
+        else:
+            continue
+        picture_type = body[position]
+        separator = b"\x00\x00" if body[:1] in (b"\x01", b"\x02") else b"\x00"
+        end = body.find(separator, position + 1)
+        while len(separator) == 2 and end >= 0 and (end - position - 1) % 2:
+            end = body.find(separator, end + 1)
+        if end < 0:
+            continue
+        picture = body[end + len(separator):]
+        if picture_type == FRONT_COVER:
+            return picture
+        found = found or picture
+    return found
+
+def _m4a_picture(f: BinaryIO, file_size: int) -> Optional[bytes]:
+    for child, child_start, child_end in _moov_items(f, file_size):
+        if child != b"ilst":
+            continue
+        for item, item_start, item_end in _atoms(f, child_start, child_end):
+            if item != b"covr":
+                continue
+            for data_kind, data_start, data_end in _atoms(f, item_start, item_end):
+                if data_kind == b"data":
+                    f.seek(data_start + 8)  # type and locale
+                    return f.read(data_end - data_start - 8)
+    return None
+
+PICTURE_READERS = {".flac": _flac_picture, ".mp3": _id3_picture, ".m4a": _m4a_picture, ".mp4": _m4a_picture,
+                   ".m4b": _m4a_picture}
+
+def read_picture(path: Path) -> Optional[bytes]:
+    """Returns the embedded cover (the front cover if marked) of a file; None if it has none."""
+    reader = PICTURE_READERS.get(Path(path).suffix.lower())
+    if reader is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            return reader(f, os.fstat(f.fileno()).st_size) or None
+    except (OSError, struct.error, IndexError, ValueError):
+        return None
+
+def read_tags(path: Path) -> Dict[str, object]:
+    """
+    Reads the tags of one file. Returns the tags found (see STRING_TAGS and
+    NUMERIC_TAGS); an empty dict for unknown or unreadable files.
+    """
+    reader = READERS.get(Path(path).suffix.lower())
+    if reader is None:
+        return {}
+    try:
+        with open(path, "rb") as f:
+            return reader(f, os.fstat(f.fileno()).st_size)
+    except (OSError, struct.error, IndexError, ValueError, ZeroDivisionError):
+        return {}
+
+def read_many(paths: List[Path], workers: Optional[int] = None) -> List[Dict[str, object]]:
+    """
+    Reads the tags of many files, on a process pool unless there are only a
+    few. Returns the tags in the order of paths.
+    """
+    if workers == 1 or len(paths) < PARALLEL_THRESHOLD:
+        return [read_tags(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_tags, paths, chunksize=32))
@@ -0,0 +1,198 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : trace.py
+ Description : Optional phase-level instrumentation. When enabled,
+               phases such as scan, copy or unmount record their wall
+               and CPU time, files, bytes, per-file latencies, I/O
+               syscalls and audited events (opens, directory scans,
+               subprocesses). The result can be exported as a JSON
+               summary or a Chrome trace (chrome://tracing, Perfetto).
+               When disabled, every hook is a no-op.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from collections import Counter
+from typing import List, Optional
+
+# Checked by the hot paths before timing anything; only enable() sets it.
+ENABLED = False
+
+TRACE_VERSION = 1
+# Per-file events kept for the Chrome trace; latencies are always kept in full.
+MAX_FILE_EVENTS = 200_000
+
+# Audit events (PEP 578) counted per phase.
+AUDITED_EVENTS = {
+    "open", "os.scandir", "os.listdir", "os.mkdir", "os.rmdir", "os.remove", "os.rename",
+    "os.utime", "os.truncate", "subprocess.Popen", "sqlite3.connect", "socket.connect",
+}
+
+
+def _read_proc_io() -> dict:
+    """Reads the I/O counters of this process (Linux only)."""
+    try:
+        with open("/proc/self/io", "rb") as f:
+            return {key.decode(): int(value) for key, value in (line.split(b":") for line in f)}
+    except OSError:
+        return {}
+
+def _percentile(values: List[int], fraction: float) -> int:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Phase:
+    """Measurements of one phase; use add() and file_done() while it runs."""
+
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.tid = threading.get_ident()
+        self.files = 0
+        self.bytes = 0
+        self.events = Counter()
+        self.latencies: List[int] = []
+        self.file_events: List[tuple] = []
+        self.start_ns = self.end_ns = 0
+
+    def __enter__(self):
+        # The I/O counters are process-wide; nested phases overlap their parents.
+        self.io_start = _read_proc_io()
+        self.usage_start = resource.getrusage(resource.RUSAGE_SELF)
+        _stack.append(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.end_ns = time.perf_counter_ns()
+        _stack.remove(self)
+        io_end = _read_proc_io()
+        usage_end = resource.getrusage(resource.RUSAGE_SELF)
+        self.io = {key: io_end[key] - self.io_start.get(key, 0) for key in io_end}
+        self.cpu_ns = int((usage_end.ru_utime + usage_end.ru_stime
+                           - self.usage_start.ru_utime - self.usage_start.ru_stime) * 1e9)
+        _finished.append(self)
+
+    def add(self, files: int = 0, bytes: int = 0):
+        self.files += files
+        self.bytes += bytes
+
+    def summary(self) -> dict:
+        wall_ms = (self.end_ns - self.start_ns) / 1e6
+        result = {
+            "name": self.name,
+            "depth": self.depth,
+            "start_ms": round((self.start_ns - _origin_ns) / 1e6, 3),
+            "wall_ms": round(wall_ms, 3),
+            "cpu_ms": round(self.cpu_ns / 1e6, 3),
+            "files": self.files,
+            "bytes": self.bytes,
+            "events": dict(self.events),
+            "io": self.io,
+        }
+        if self.bytes and wall_ms:
+            result["mb_per_s"] = round(self.bytes / 1024 ** 2 / (wall_ms / 1000), 2)
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            result["file_latency_ms"] = {
+                "count": len(latencies),
+                "p50": round(_percentile(latencies, 0.50) / 1e6, 3),
+                "p99": round(_percentile(latencies, 0.99) / 1e6, 3),
+                "max": round(latencies[-1] / 1e6, 3),
+            }
+        return result
+
+
+class _NullPhase:
+    """Stands in for a phase while tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def add(self, files: int = 0, bytes: int = 0):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+_stack: List[Phase] = []
+_finished: List[Phase] = []
+_origin_ns = time.perf_counter_ns()
+_audit_installed = False
+
+
+def _audit(event: str, args):
+    if event in AUDITED_EVENTS and ENABLED:
+        for phase in _stack:
+            phase.events[event] += 1
+
+def enable():
+    """Turns tracing on for the rest of the process."""
+    global ENABLED, _audit_installed, _origin_ns
+    if not _audit_installed:
+        # Audit hooks cannot be removed, so one is only installed when tracing is wanted.
+        sys.addaudithook(_audit)
+        _audit_installed = True
+    _origin_ns = time.perf_counter_ns()
+    ENABLED = True
+
+def phase(name: str):
+    """
+    Returns a context manager measuring a phase, e.g.
+    with trace.phase("copy") as p: ...; p.add(files=n, bytes=size)
+    """
+    if not ENABLED:
+        return _NULL_PHASE
+    return Phase(name, len(_stack))
+
+def file_done(start_ns: int, name: Optional[str] = None):
+    """Records one file handled by the innermost phase since start_ns (from time.perf_counter_ns)."""
+    if not _stack:
+        return
+    end_ns = time.perf_counter_ns()
+    current = _stack[-1]
+    current.latencies.append(end_ns - start_ns)
+    if len(current.file_events) < MAX_FILE_EVENTS:
+        current.file_events.append((start_ns, end_ns, threading.get_ident(), name))
+
+def summary(meta: Optional[dict] = None) -> dict:
+    """Returns the finished phases in start order."""
+    phases = sorted(_finished, key=lambda p: p.start_ns)
+    return dict(meta or {}, version=TRACE_VERSION, pid=os.getpid(), phases=[p.summary() for p in phases])
+
+def chrome_trace(meta: Optional[dict] = None) -> dict:
+    """Returns the finished phases and per-file events in the Chrome trace event format."""
+    pid = os.getpid()
+    events = []
+    for p in sorted(_finished, key=lambda p: p.start_ns):
+        stats = p.summary()
+        events.append({
+            "name": p.name, "cat": "phase", "ph": "X", "pid": pid, "tid": p.tid,
+            "ts": (p.start_ns - _origin_ns) / 1000, "dur": (p.end_ns - p.start_ns) / 1000,
+            "args": {key: stats[key] for key in stats if key not in ("name", "depth", "start_ms", "wall_ms")},
+        })
+        for start_ns, end_ns, tid, name in p.file_events:
+            events.append({
+                "name": name or p.name, "cat": f"{p.name}.file", "ph": "X", "pid": pid, "tid": tid,
+                "ts": (start_ns - _origin_ns) / 1000, "dur": (end_ns - start_ns) / 1000,
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": meta or {}}
+
+def export(path: str, fmt: str = "json", meta: Optional[dict] = None):
+    """Writes the trace as a JSON summary (fmt="json") or a Chrome trace (fmt="chrome")."""
+    data = chrome_trace(meta) if fmt == "chrome" else summary(meta)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=None if fmt == "chrome" else 2)
@@ -0,0 +1,229 @@
+"""
+==================================================================
+ iPod Manager - Submodule
+==================================================================
+ File        : transcode.py
+ Description : Optional transcode stage of the copy pipeline.
+               Lossless files are converted to a per-device codec
+               and bitrate by a pluggable command-line encoder on a
+               process pool. Results are kept in a host-side cache
+               keyed by source content hash and encoder settings.
+               This submodule is part of the iPod Manager project.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import json
+import sqlite3
+import multiprocessing
+import hashlib
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from modules.manifest import get_state_dir, hash_file
+from modules.scan_cache import get_cache_dir
+
+DEVICE_SETTINGS_FILE = "device.json"
+LOSSLESS_EXTENSIONS = (".flac",)
+
+
+class Encoder(NamedTuple):
+    command: List[str]  # {input}, {output} and {bitrate} are substituted
+    extension: str
+
+
+# Any local CLI encoder works; these use ffmpeg, which most systems have.
+ENCODERS = {
+    "aac": Encoder(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", "{input}", "-map", "0:a", "-map_metadata", "0",
+         "-c:a", "aac", "-b:a", "{bitrate}", "-f", "ipod", "-y", "{output}"],
+        ".m4a",
+    ),
+    "mp3": Encoder(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", "{input}", "-map", "0:a", "-map_metadata", "0",
+         "-c:a", "libmp3lame", "-b:a", "{bitrate}", "-id3v2_version", "3", "-f", "mp3", "-y", "{output}"],
+        ".mp3",
+    ),
+    "vorbis": Encoder(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", "{input}", "-map", "0:a", "-map_metadata", "0",
+         "-c:a", "libvorbis", "-b:a", "{bitrate}", "-f", "ogg", "-y", "{output}"],
+        ".ogg",
+    ),
+    "opus": Encoder(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", "{input}", "-map", "0:a", "-map_metadata", "0",
+         "-c:a", "libopus", "-b:a", "{bitrate}", "-f", "ogg", "-y", "{output}"],
+        ".opus",
+    ),
+}
+
+
+def load_device_settings(ipod_path: Path) -> dict:
+    """
+    Loads the per-device settings stored next to the manifest, e.g.
+    {"transcode": {"codec": "aac", "bitrate": "256k"}}.
+    """
+    settings_path = get_state_dir(ipod_path) / DEVICE_SETTINGS_FILE
+    try:
+        with settings_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def get_encoder(settings: dict) -> Encoder:
+    """
+    Returns the encoder the transcode settings ask for: a custom command or
+    one of ENCODERS. Raises ValueError for an unknown codec.
+    """
+    if "command" in settings:
+        return Encoder(list(settings["command"]), settings.get("extension", ".m4a"))
+    codec = settings.get("codec", "aac")
+    if codec not in ENCODERS:
+        raise ValueError(f"Unknown transcode codec: {codec} (choose from {', '.join(ENCODERS)})")
+    return ENCODERS[codec]
+
+def _transcode_file(source: str, content_hash: Optional[str], settings_key: str,
+                    command: List[str], bitrate: str, cache_dir: str, extension: str) -> Tuple[str, str]:
+    """
+    Worker: hashes the source if needed and encodes it unless the cache
+    already holds the result. Returns (cached output path, content hash).
+    """
+    if content_hash is None:
+        content_hash = hash_file(Path(source))
+
+    key = hashlib.blake2b(f"{content_hash}:{settings_key}".encode(), digest_size=20).hexdigest()
+    output = Path(cache_dir) / key[:2] / f"{key}{extension}"
+    if output.exists():
+        return str(output), content_hash
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    # Keep the extension so encoders can pick the container from the name.
+    tmp_output = output.with_name(f".{key}.{os.getpid()}{extension}")
+    args = [arg.format(input=source, output=str(tmp_output), bitrate=bitrate) for arg in command]
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0 or not tmp_output.exists():
+        tmp_output.unlink(missing_ok=True)
+        raise RuntimeError(result.stderr.strip() or f"{args[0]} exited with {result.returncode}")
+
+    os.replace(tmp_output, output)
+    return str(output), content_hash
+
+
+class Transcoder:
+    """
+    Maps library files to their device form. Lossless files are replaced by
+    a cached encode (created on the process pool when missing); everything
+    else passes through unchanged.
+    """
+
+    def __init__(self, settings: dict, cache_dir: Optional[Path] = None, workers: Optional[int] = None):
+        self.encoder = get_encoder(settings)
+        self.bitrate = str(settings.get("bitrate", "256k"))
+        self.lossless = tuple(ext.lower() for ext in settings.get("lossless_extensions", LOSSLESS_EXTENSIONS))
+        self.settings_key = hashlib.blake2b(
+            json.dumps([self.encoder.command, self.encoder.extension, self.bitrate]).encode(), digest_size=8
+        ).hexdigest()
+
+        self.cache_dir = Path(cache_dir) if cache_dir else get_cache_dir() / "transcode"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+
+        # Remember content hashes by (path, size, mtime) so unchanged sources are never re-read.
+        self.hashes = sqlite3.connect(str(self.cache_dir / "hashes.sqlite"), check_same_thread=False)
+        self.hashes.execute(
+            "CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)"
+        )
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.hashes.commit()
+        self.hashes.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def applies(self, rel_path: str) -> bool:
+        """Checks whether a library file gets transcoded."""
+        return rel_path.lower().endswith(self.lossless)
+
+    def device_path(self, rel_path: str) -> str:
+        """Returns the relative path a library file gets on the device."""
+        if not self.applies(rel_path):
+            return rel_path
+        return os.path.splitext(rel_path)[0] + self.encoder.extension
+
+    def estimate_size(self, source_size: int) -> int:
+        """
+        Estimates the encoded size of a lossless file before encoding it,
+        assuming the typical FLAC bitrate of about 900 kbit/s.
+        """
+        bitrate = self.bitrate.lower()
+        try:
+            bps = float(bitrate.rstrip("k")) * (1000 if bitrate.endswith("k") else 1)
+        except ValueError:
+            return source_size
+        return min(source_size, int(source_size * bps / 900_000) + 4096)
+
+    def _known_hash(self, source: Path, entry: dict) -> Optional[str]:
+        row = self.hashes.execute(
+            "SELECT hash FROM hashes WHERE path = ? AND size = ? AND mtime = ?",
+            (str(source), entry["size"], entry["mtime"]),
+        ).fetchone()
+        return row[0] if row else None
+
+    def stream(self, items: Iterable[Tuple[Path, str, dict]]) -> Iterator[Tuple[Path, str]]:
+        """
+        Takes (source path, device relative path, library entry) items and
+        yields (file to copy, device relative path). Pass-through files are
+        yielded immediately, encodes as soon as they finish; at most twice
+        the number of workers are queued at once. Failed encodes are reported
+        and skipped.
+        """
+        pending = {}
+
+        def finish(futures):
+            for future in futures:
+                source, device_rel, entry = pending.pop(future)
+                try:
+                    output, content_hash = future.result()
+                except Exception as e:
+                    print(f"\033[91mError transcoding {source.name}: {e}\033[0m")
+                    continue
+                self.hashes.execute(
+                    "INSERT OR REPLACE INTO hashes (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+                    (str(source), entry["size"], entry["mtime"], content_hash),
+                )
+                yield Path(output), device_rel
+
+        for source, device_rel, entry in items:
+            if not self.applies(source.name):
+                yield source, device_rel
+                continue
+
+            if self.pool is None:
+                # Started from the prefetch thread: forking a threaded process can copy held locks.
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context("forkserver"))
+            future = self.pool.submit(
+                _transcode_file, str(source), self._known_hash(source, entry), self.settings_key,
+                self.encoder.command, self.bitrate, str(self.cache_dir), self.encoder.extension,
+            )
+            pending[future] = (source, device_rel, entry)
+
+            while len(pending) >= 2 * self.workers:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finish(finished)
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finish(finished)
+        self.hashes.commit()
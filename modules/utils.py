@@ -6,6 +6,9 @@
  Description : Provides utility functions for handling the music 
                folder, identifying devices for mountpoints, listing 
                blocking processes, and safely unmounting iPods.
+               Before unmounting, the iPod's pending writes are
+               flushed with a progress bar, so the unmount itself
+               does not stall without feedback.
                This submodule is part of the iPod Manager project.
  Author      : blackbunt
  Created     : 2025-01-26
@@ -13,14 +16,25 @@
  Repository  : https://github.com/blackbunt/ipod-manager
 ==================================================================
 """
+import os
+import threading
 import subprocess
 from pathlib import Path
-from InquirerPy import inquirer
+from typing import List, Optional
+from modules.devices import get_mount_source
+from modules.journal import syncfs
+from modules import trace
+
+MEMINFO_PATH = "/proc/meminfo"
+FLUSH_POLL_INTERVAL = 0.2  # seconds between progress updates while flushing
 
 def get_music_folder() -> str:
     """Get the music folder dynamically using xdg-user-dir."""
-    result = subprocess.run(["xdg-user-dir", "MUSIC"], capture_output=True, text=True)
-    music_dir = result.stdout.strip()
+    try:
+        result = subprocess.run(["xdg-user-dir", "MUSIC"], capture_output=True, text=True)
+        music_dir = result.stdout.strip()
+    except FileNotFoundError:  # xdg-user-dirs is not installed on headless systems
+        music_dir = ""
 
     # Fallback to ~/Musik if xdg-user-dir fails
     if not music_dir or not Path(music_dir).is_dir():
@@ -33,57 +47,102 @@ def get_device_for_mountpoint(mountpoint: str) -> str:
     Determines the device associated with a given mountpoint.
     Returns the device identifier (e.g., /dev/sdb2).
     """
+    # Read straight from the kernel's mount table instead of running lsblk.
+    return get_mount_source(mountpoint)
+
+def _process_name(pid: str) -> str:
     try:
-        # Run lsblk with the specified column options
-        result = subprocess.run(
-            ['lsblk', '-o', 'NAME,MOUNTPOINT', '--noheadings', '--raw'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-
-        # Parse the output
-        for line in result.stdout.splitlines():
-            #print(f"Line: {line}")
-            columns = line.split(None, 1)  # Split into NAME and MOUNTPOINT
-            #print(f"Columns: {columns}")
-            if len(columns) == 2:
-                device, mount = columns
-                # Decode \\x20 to a regular space
-                normalized_mount = mount.encode('utf-8').decode('unicode_escape').strip()
-                # Convert PosixPath to string
-                if normalized_mount == str(mountpoint).strip():
-                    #print(f"Found device: /dev/{device}")
-                    return f"/dev/{device}"
-
-        # Raise an exception if no device is found
-        raise FileNotFoundError(f"No device found for mountpoint {mountpoint}.")
+        with open(f"/proc/{pid}/comm", "r", encoding="utf-8", errors="replace") as f:
+            return f.read().strip()
+    except OSError:
+        return "?"
 
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Error running lsblk: {e.stderr}")
-    
-def list_blocking_processes(mountpoint: str):
+def list_blocking_processes(mountpoint: str) -> List[str]:
     """
-    Lists processes using the given device or mountpoint.
-    Returns a list of strings containing information about the blocking processes.
+    Lists processes using the given mountpoint: with files open on it, or
+    their working or root directory there. Only the /proc/<pid> links are
+    read (never the files behind them), so this takes milliseconds where
+    lsof checks every open file of the system. Processes of other users
+    are only seen when running as root, as with lsof.
+    Returns a list of strings describing the blocking processes.
     """
+    root = os.path.realpath(mountpoint)
+    prefix = root.rstrip("/") + "/"
+    blocking = []
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        paths = []
+        links = [f"/proc/{pid}/cwd", f"/proc/{pid}/root"]
+        try:
+            links += [f"/proc/{pid}/fd/{fd}" for fd in os.listdir(f"/proc/{pid}/fd")]
+        except OSError:  # gone, or not ours to look at
+            pass
+        for link in links:
+            try:
+                target = os.readlink(link)
+            except OSError:
+                continue
+            if target == root or target.startswith(prefix):
+                paths.append(target)
+        if paths:
+            more = f" and {len(paths) - 1} more" if len(paths) > 1 else ""
+            blocking.append(f"{_process_name(pid)} (pid {pid}): {paths[0]}{more}")
+    return blocking
+
+def read_dirty_bytes(meminfo_path: str = MEMINFO_PATH) -> int:
+    """Returns the data waiting to be written to disk (Dirty + Writeback in /proc/meminfo), system-wide."""
+    pending = 0
     try:
-        result = subprocess.run(
-            ['lsof', mountpoint],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return result.stdout.splitlines()
-    except subprocess.CalledProcessError as e:
-        if e.returncode == 1:  # No error, just no processes found
-            return []
-        raise RuntimeError(f"Error running lsof: {e.stderr}")
+        with open(meminfo_path, "r") as f:
+            for line in f:
+                if line.startswith(("Dirty:", "Writeback:")):
+                    pending += int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pending
 
-def safely_unmount_ipod(mountpoint: str):
+def flush_device(mountpoint: str) -> bool:
+    """
+    Writes everything still cached for the iPod to it (syncfs) and shows
+    the progress from the kernel's Dirty and Writeback counters. These
+    count all devices, so other writers can move the bar; it is complete
+    once the iPod's file system is flushed. Returns False if it failed.
+    """
+    from tqdm import tqdm
+
+    error = []
+
+    def flush():
+        try:
+            syncfs(Path(mountpoint))
+        except OSError as e:
+            error.append(e)
+
+    thread = threading.Thread(target=flush, name="syncfs", daemon=True)
+    with trace.phase("flush"):
+        thread.start()
+        thread.join(FLUSH_POLL_INTERVAL)
+        if thread.is_alive():
+            start = read_dirty_bytes()
+            with tqdm(total=start, desc="Writing cached data to the iPod", unit="B", unit_scale=True,
+                      unit_divisor=1024) as progress:
+                while thread.is_alive():
+                    done = max(0, start - read_dirty_bytes())
+                    progress.update(max(0, done - progress.n))
+                    thread.join(FLUSH_POLL_INTERVAL)
+                progress.update(progress.total - progress.n)
+    if error:
+        print(f"\033[91mError writing cached data to the iPod: {error[0]}\033[0m")
+        return False
+    return True
+
+def safely_unmount_ipod(mountpoint: str, force: Optional[bool] = None) -> bool:
     """
     Safely unmounts the iPod and powers it off.
-    Notifies the user about blocking processes.
+    Notifies the user about blocking processes and asks whether to go on,
+    unless force says so (True unmounts anyway, False gives up).
+    Returns True if the iPod was removed.
     """
     try:
         # Determine the device for the mountpoint
@@ -96,25 +155,34 @@ def safely_unmount_ipod(mountpoint: str):
             for process in blocking_processes:
                 print(process)
 
-            # User confirmation with InquirerPy
-            confirm = inquirer.confirm(
-                message="Do you want to unmount the device anyway?",
-                default=False
-            ).execute()
+            if force is None:
+                # User confirmation with InquirerPy
+                from InquirerPy import inquirer
+                force = inquirer.confirm(
+                    message="Do you want to unmount the device anyway?",
+                    default=False
+                ).execute()
 
-            if not confirm:
+            if not force:
                 print("Unmounting canceled.")
-                return
+                return False
+
+        with trace.phase("unmount"):
+            # Flush first, with feedback; the unmount then has nothing left to write.
+            if not flush_device(mountpoint):
+                return False
+            print("All data is on the iPod.")
 
-        # Unmount the device
-        subprocess.run(['udisksctl', 'unmount', '-b', device], check=True)
-        print(f"iPod {device} was successfully unmounted.")
+            # Unmount the device
+            subprocess.run(['udisksctl', 'unmount', '-b', device], check=True)
+            print(f"iPod {device} was successfully unmounted.")
 
-        # Power off the device
-        subprocess.run(['udisksctl', 'power-off', '-b', device], check=True)
-        print(f"iPod {device} was safely removed.")
-        exit(0)
+            # Power off the device
+            subprocess.run(['udisksctl', 'power-off', '-b', device], check=True)
+            print(f"iPod {device} was safely removed.")
+        return True
     except FileNotFoundError as e:
         print(f"Error: {e}")
     except subprocess.CalledProcessError as e:
         print(f"Error safely removing the iPod: {e}")
+    return False
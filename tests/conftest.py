@@ -0,0 +1,31 @@
+"""
+==================================================================
+ iPod Manager - Tests
+==================================================================
+ File        : conftest.py
+ Description : Makes the modules importable from the tests and
+               loads ipod-manager.py, whose name is not a valid
+               module name, as a module.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def manager():
+    """The ipod-manager.py script as a module."""
+    spec = importlib.util.spec_from_file_location("ipod_manager", ROOT / "ipod-manager.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,72 @@
+"""
+==================================================================
+ iPod Manager - Tests
+==================================================================
+ File        : test_fanout.py
+ Description : A failing device writer or an unreadable source must
+               not stop a fan-out sync to several iPods.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+import os
+import threading
+
+from modules.fanout import fan_out_copy
+from modules.journal import PART_SUFFIX
+
+
+def run_fan_out(*args, **kwargs) -> dict:
+    """Runs fan_out_copy on a thread and fails if it does not return."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(fan_out_copy(*args, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "fan_out_copy hangs"
+    return result
+
+
+def test_writer_failing_in_on_done_is_dropped(tmp_path):
+    source_dir = tmp_path / "lib"
+    source_dir.mkdir()
+    items = []
+    for index in range(20):
+        source = source_dir / f"{index}.mp3"
+        source.write_bytes(os.urandom(200_000))
+        items.append((source, source, {"a": f"x/{index}.mp3", "b": f"x/{index}.mp3"}))
+
+    def on_done(device, item, st, checksum):
+        if device == "a":
+            raise OSError(5, "Input/output error")
+
+    # A small buffer makes the reader wait for the failed writer if it is not dropped.
+    result = run_fan_out(items, {"a": tmp_path / "a", "b": tmp_path / "b"},
+                         chunk_size=65536, buffer_bytes=131072, on_done=on_done)
+
+    done, failed = result["a"]
+    assert done == [] and len(failed) == len(items)
+    done, failed = result["b"]
+    assert len(done) == len(items) and failed == []
+    assert not list((tmp_path / "a").rglob("*" + PART_SUFFIX))
+
+
+def test_unreadable_source_is_reported(tmp_path):
+    source_dir = tmp_path / "lib"
+    source_dir.mkdir()
+    good = source_dir / "good.mp3"
+    good.write_bytes(b"x" * 1000)
+    missing = source_dir / "missing.mp3"
+    items = [
+        (missing, missing, {"a": "x/missing.mp3", "b": "x/missing.mp3"}),
+        (good, good, {"a": "x/good.mp3", "b": "x/good.mp3"}),
+    ]
+
+    result = run_fan_out(items, {"a": tmp_path / "a", "b": tmp_path / "b"}, reserve=["a"])
+
+    for device in ("a", "b"):
+        done, failed = result[device]
+        assert done == [good]
+        assert [item for item, _ in failed] == [missing]
+        assert sorted(os.listdir(tmp_path / device / "x")) == ["good.mp3"]
@@ -0,0 +1,25 @@
+"""
+==================================================================
+ iPod Manager - Tests
+==================================================================
+ File        : test_planner.py
+ Description : Free space planning on an iPod that is nearly full.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+from modules import planner
+
+
+def test_nothing_to_write_fits_on_a_full_device(tmp_path, monkeypatch):
+    # Less free space than the reserve kept for the manifest and journal.
+    monkeypatch.setattr(planner, "get_device_space", lambda mount: (planner.RESERVE_BYTES // 2, 32768))
+
+    plan = planner.plan_space([], tmp_path, tmp_path / "Music")
+    assert plan.fits
+    assert plan.required == 0
+
+    plan = planner.plan_space([("A/B/1.mp3", 1000)], tmp_path, tmp_path / "Music")
+    assert not plan.fits
@@ -0,0 +1,29 @@
+"""
+==================================================================
+ iPod Manager - Tests
+==================================================================
+ File        : test_watch.py
+ Description : Which connected iPods the watch command processes.
+ Author      : blackbunt
+ Created     : 2026-10-17
+ License     : GPLv3 (https://www.gnu.org/licenses/gpl-3.0.html)
+ Repository  : https://github.com/blackbunt/ipod-manager
+==================================================================
+"""
+from pathlib import Path
+
+from modules import devices
+
+
+def test_profile_with_a_single_ipod(manager, monkeypatch):
+    events = [("added", Path("/media/other")), ("added", Path("/media/ipod")), ("removed", Path("/media/ipod"))]
+    monkeypatch.setattr(devices, "watch_ipods", lambda: iter(events))
+    monkeypatch.setattr(manager, "read_device_id", lambda mountpoint: None)
+    processed = []
+    monkeypatch.setattr(manager, "process_connected_ipod", lambda ipod, options: processed.append(ipod))
+
+    # Profiles may give ipod as a string instead of a list.
+    result = manager.command_watch({"ipod": "/media/ipod"})
+
+    assert processed == [Path("/media/ipod")]
+    assert result["processed"] == 1